@@ -1,1736 +1,2206 @@
-from __future__ import annotations
-
-import os
-import sys
-from typing import Any, Dict
-
-# Ensure local folder is importable even if run from another working directory
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-if BASE_DIR not in sys.path:
-    sys.path.insert(0, BASE_DIR)
-
-from bson import ObjectId
-
-import asyncio
-
-from telethon import TelegramClient
-from telethon.sessions import StringSession
-
-import phonenumbers
-
-
-def _emoji_from_region(region: str) -> str:
-    """Convert country code (IN) -> flag emoji (🇮🇳)."""
-    if not region or len(region) != 2:
-        return ""
-    region = region.upper()
-    return chr(127397 + ord(region[0])) + chr(127397 + ord(region[1]))
-
-
-def detect_country_from_phone(phone_e164: str) -> tuple[str | None, str | None, bool]:
-    """Return (country_code, emoji, needs_us_ca_choice).
-
-    Uses phonenumbers to detect region. If region can't be determined for +1,
-    we ask admin to choose US/CA.
-    """
-    try:
-        num = phonenumbers.parse(phone_e164, None)
-        region = phonenumbers.region_code_for_number(num)
-    except Exception:
-        region = None
-
-    digits = "".join(ch for ch in phone_e164 if ch.isdigit())
-
-    # Special handling for +1 if unresolved
-    if digits.startswith("1") and (region is None or region not in {"US", "CA"}):
-        return None, None, True
-
-    if not region:
-        return None, None, False
-
-    return region, _emoji_from_region(region), False
-
-try:
-    from telegram import (
-        InlineKeyboardButton,
-        InlineKeyboardMarkup,
-        KeyboardButton,
-        ReplyKeyboardMarkup,
-        ReplyKeyboardRemove,
-        Update,
-    )
-    from telegram.constants import ParseMode
-    from telegram.ext import ContextTypes
-except ImportError as e:  # pragma: no cover
-    raise RuntimeError(
-        "Wrong 'telegram' package installed. This project requires 'python-telegram-bot'.\n\n"
-        "Fix (recommended):\n"
-        "  pip uninstall -y telegram\n"
-        "  pip uninstall -y python-telegram-bot telegram-bot\n"
-        "  pip install -U python-telegram-bot\n\n"
-        "Then restart the bot. Original import error: "
-        + str(e)
-    )
-
-
-
-async def _notify_referral_award(
-    *,
-    context: ContextTypes.DEFAULT_TYPE,
-    repo: Repo,
-    referred_user_id: int,
-    deposit_amount: int,
-    admin_id: int,
-    deposit_id: str | None = None,
-) -> None:
-    """Credit referral earning to referrer (forever) and notify them.
-
-    Note: This is called after a deposit is approved.
-    """
-    # Find referral mapping
-    ref = await repo.db.referrals.find_one({"referred_user_id": int(referred_user_id)})
-    if not ref:
-        return
-
-    referrer_id = int(ref.get("referrer_user_id") or 0)
-    if not referrer_id:
-        return
-
-    reward = int(round((int(deposit_amount) * float(REFERRAL_PERCENT)) / 100.0))
-    if reward <= 0:
-        return
-
-    user = await repo.add_referral_earning(
-        referrer_user_id=referrer_id,
-        referred_user_id=int(referred_user_id),
-        amount=float(reward),
-        by_admin=int(admin_id),
-        deposit_id=str(deposit_id) if deposit_id else None,
-        deposit_amount=int(deposit_amount),
-    )
-
-    referred_un = (ref.get("referred_username") or "").strip()
-    ref_line = f"@{referred_un}" if referred_un else "N/A"
-
-    try:
-        await context.bot.send_message(
-            chat_id=referrer_id,
-            text=(
-                "🎉 Referral Reward Added!\n"
-                f"• From user: {referred_user_id} {ref_line}\n"
-                f"• Deposit: ₹{int(deposit_amount)}\n"
-                f"• Reward: +₹{reward} credits ({REFERRAL_PERCENT:.1f}%)\n"
-                f"• New Balance: {int((user or {}).get('credits', 0))} credits"
-            ),
-        )
-    except Exception:
-        pass
-
-
-async def safe_edit(
-    message,
-    text: str,
-    *,
-    reply_markup: InlineKeyboardMarkup | None = None,
-    parse_mode=ParseMode.MARKDOWN,
-):
-    """Edit a message safely.
-
-    - If the message is a photo/document with caption, use edit_caption.
-    - Else use edit_text.
-    """
-    try:
-        if getattr(message, "photo", None) and (getattr(message, "text", None) in (None, "")):
-            return await message.edit_caption(caption=text, parse_mode=parse_mode, reply_markup=reply_markup)
-        return await message.edit_text(text=text, parse_mode=parse_mode, reply_markup=reply_markup)
-    except Exception:
-        return await message.edit_text(text=text, parse_mode=parse_mode, reply_markup=reply_markup)
-
-
-
-def deposits_keyboard(
-      filter_key: str,
-      page: int,
-      has_prev: bool,
-      has_next: bool,
-      deposits: list[dict] | None = None,
-  ) -> InlineKeyboardMarkup:
-      """Deposits list keyboard.
-
-      Adds per-deposit 'View' buttons so admins can open/resend screenshot even if initial DM failed.
-      """
-      # filter_key: all|pending|approved
-      rows: list[list[InlineKeyboardButton]] = [
-          [
-              InlineKeyboardButton("🟡 Pending", callback_data="admin:deposits:pending:0"),
-              InlineKeyboardButton("🟢 Confirmed", callback_data="admin:deposits:approved:0"),
-              InlineKeyboardButton("📋 All", callback_data="admin:deposits:all:0"),
-          ]
-      ]
-
-      # Per deposit view buttons (page sized, so safe)
-      if deposits:
-          for d in deposits:
-              dep_id = str(d.get("_id"))
-              amt = d.get("amount")
-              uid = d.get("user_id")
-              rows.append([InlineKeyboardButton(f"🔎 View {amt} | {uid}", callback_data=f"admin:dep:view:{dep_id}")])
-
-      nav: list[InlineKeyboardButton] = []
-      if has_prev:
-          nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"admin:deposits:{filter_key}:{page-1}"))
-      if has_next:
-          nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"admin:deposits:{filter_key}:{page+1}"))
-      if nav:
-          rows.append(nav)
-
-      rows.append([InlineKeyboardButton("⬅️ Back", callback_data="admin:menu")])
-      return kb(rows)
-
-from config import ADMIN_USER_IDS, TELEGRAM_API_ID, TELEGRAM_API_HASH, BOT_USERNAME
-
-# Backward-compatible: if REFERRAL_PERCENT is not present in config.py yet
-try:
-    from config import REFERRAL_PERCENT  # type: ignore
-except Exception:
-    import os
-
-    REFERRAL_PERCENT = float(os.getenv("REFERRAL_PERCENT", "3.0"))
-from database import Repo, get_db
-
-
-def is_admin(user_id: int) -> bool:
-    return int(user_id) in set(ADMIN_USER_IDS)
-
-
-def kb(rows: list[list[InlineKeyboardButton]]) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(rows)
-
-
-def cancel_reply_kb() -> ReplyKeyboardMarkup:
-    # bottom keyboard for admin text flows
-    return ReplyKeyboardMarkup([[KeyboardButton("Cancel")]], resize_keyboard=True)
-
-
-async def restore_main_reply_menu(message) -> None:
-    """Ensure the normal bottom reply keyboard is visible (after back navigation).
-
-    Telegram only applies ReplyKeyboardMarkup when sending a message, so we send
-    a zero-width character to keep it visually silent.
-    """
-    try:
-        await message.reply_text("\u200b", reply_markup=main_reply_menu(True))
-    except Exception:
-        return
-
-
-def main_reply_menu(is_admin_user: bool = True) -> ReplyKeyboardMarkup:
-    # Restore the normal bottom menu after cancelling admin flows
-    rows = [
-        [KeyboardButton("🛒 Buy"), KeyboardButton("💳 Deposit")],
-        [KeyboardButton("💰 Balance"), KeyboardButton("📜 History")],
-        [KeyboardButton("🆘 Support")],
-    ]
-    if is_admin_user:
-        rows.append([KeyboardButton("🛠 Admin")])
-
-    return ReplyKeyboardMarkup(rows, resize_keyboard=True, is_persistent=True, selective=False)
-
-
-def admin_menu_keyboard() -> InlineKeyboardMarkup:
-    # Most rows: 3 buttons per row (clean grid)
-    # Last row: Stats + Menu (2 per row)
-    return kb(
-        [
-            [
-                InlineKeyboardButton("➕ Add Account", callback_data="admin:addaccount"),
-                InlineKeyboardButton("👤 Credits", callback_data="admin:credits"),
-                InlineKeyboardButton("📦 Accounts", callback_data="admin:accounts"),
-            ],
-            [
-                InlineKeyboardButton("💳 Deposits", callback_data="admin:deposits"),
-                InlineKeyboardButton("💰 Active Credits", callback_data="admin:activecredits:0"),
-            ],
-            [
-                InlineKeyboardButton("💠 QRs", callback_data="admin:qrs"),
-                InlineKeyboardButton("🎁 Referrals", callback_data="admin:referrals:0"),
-                InlineKeyboardButton("🏷️ Bulk Discount", callback_data="admin:bulkdiscount"),
-            ],
-            [
-                InlineKeyboardButton("🚫 Ban System", callback_data="admin:banmenu"),
-                InlineKeyboardButton("📊 Stats", callback_data="admin:stats"),
-                InlineKeyboardButton("🏠 Menu", callback_data="menu:home"),
-            ],
-        ]
-    )
-
-
-def accounts_menu_keyboard() -> InlineKeyboardMarkup:
-    return kb(
-        [
-            [
-                InlineKeyboardButton("✅ Available Accounts", callback_data="admin:accounts:available:0"),
-                InlineKeyboardButton("💸 Sold Accounts", callback_data="admin:accounts:sold:0"),
-            ],
-            [InlineKeyboardButton("⬅️ Back", callback_data="admin:menu")],
-        ]
-    )
-
-
-def accounts_list_keyboard(
-    accounts: list[dict],
-    *,
-    filter_key: str,
-    page: int,
-    has_prev: bool,
-    has_next: bool,
-) -> InlineKeyboardMarkup:
-    rows: list[list[InlineKeyboardButton]] = []
-
-    # list items
-    for a in accounts:
-        acc_id = str(a.get("_id"))
-        emoji = a.get("country_emoji") or ""
-        country = a.get("country") or ""
-        year = a.get("year")
-        status = "sold" if a.get("status") == "assigned" else a.get("status")
-        sold_to = ""
-        if status == "sold":
-            su = (a.get("sold_to_username") or "").strip()
-            sid = a.get("sold_to_user_id") or a.get("assigned_to")
-            sold_to = f" -> @{su}" if su else (f" -> {sid}" if sid else "")
-
-        price = a.get("price")
-        price_txt = f"{price}c" if price is not None else "default"
-        rows.append(
-            [
-                InlineKeyboardButton(
-                    f"{emoji}+{a.get('phone')} | {country} | {year} | {status}{sold_to} | {price_txt}",
-                    callback_data=f"admin:account:view:{acc_id}",
-                )
-            ]
-        )
-
-    # pagination
-    nav: list[InlineKeyboardButton] = []
-    if has_prev:
-        nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"admin:accounts:{filter_key}:{page-1}"))
-    if has_next:
-        nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"admin:accounts:{filter_key}:{page+1}"))
-    if nav:
-        rows.append(nav)
-
-    rows.append([InlineKeyboardButton("⬅️ Back", callback_data="admin:accounts")])
-    return kb(rows)
-
-
-def account_detail_keyboard(account_id: str) -> InlineKeyboardMarkup:
-    return kb(
-        [
-            [
-                InlineKeyboardButton("✏️ Edit", callback_data=f"admin:account:edit:{account_id}"),
-                InlineKeyboardButton("🗑 Delete", callback_data=f"admin:account:delete:{account_id}"),
-            ],
-            [
-                InlineKeyboardButton("🛠️ Manage Devices", callback_data=f"dev:menu:{account_id}"),
-                InlineKeyboardButton("📱 Get OTP", callback_data=f"admin:account:getotp:{account_id}"),
-            ],
-            [InlineKeyboardButton("⬅️ Back", callback_data="admin:accounts")],
-        ]
-    )
-
-
-def account_delete_confirm_keyboard(account_id: str) -> InlineKeyboardMarkup:
-    return kb(
-        [
-            [InlineKeyboardButton("✅ Yes, delete", callback_data=f"admin:account:delete_confirm:{account_id}")],
-            [InlineKeyboardButton("❌ Cancel", callback_data=f"admin:account:view:{account_id}")],
-        ]
-    )
-
-
-def active_credits_keyboard(page: int, has_prev: bool, has_next: bool) -> InlineKeyboardMarkup:
-    nav: list[InlineKeyboardButton] = []
-    if has_prev:
-        nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"admin:activecredits:{page-1}"))
-    if has_next:
-        nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"admin:activecredits:{page+1}"))
-
-    rows: list[list[InlineKeyboardButton]] = []
-    if nav:
-        rows.append(nav)
-    rows.append([InlineKeyboardButton("⬅️ Back", callback_data="admin:menu")])
-    return kb(rows)
-
-
-# Sessions helper functions removed
-
-
-async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, state: Dict[int, Dict[str, Any]]) -> bool:
-    """Handle admin:* callbacks. Returns True if handled."""
-    query = update.callback_query
-    if not query:
-        return False
-
-    data = query.data or ""
-    if not data.startswith("admin:"):
-        return False
-
-    uid = update.effective_user.id
-    if not is_admin(uid):
-        await query.answer("❌ Access denied.", show_alert=True)
-        return True
-
-    repo: Repo = context.application.bot_data["repo"]
-
-    if data == "admin:menu":
-        await restore_main_reply_menu(query.message)
-        await safe_edit(query.message, "🛠 Admin Panel", reply_markup=admin_menu_keyboard(), parse_mode=None)
-        return True
-
-    if data == "admin:addaccount":
-        # Use fixed API creds; ask only for phone
-        state[uid] = {"flow": "admin_add_account", "step": "phone", "api_id": TELEGRAM_API_ID, "api_hash": TELEGRAM_API_HASH}
-        await query.message.reply_text(
-            "➕ Add Account\n\nSend phone with + (example: +923001234567):",
-            reply_markup=cancel_reply_kb(),
-        )
-        return True
-
-    if data in {"admin:addaccount:cc:us", "admin:addaccount:cc:ca"}:
-        await query.answer(cache_time=0)
-        st = state.get(uid) or {}
-        if st.get("flow") != "admin_add_account" or st.get("step") != "pick_usca":
-            return True
-        if data.endswith(":us"):
-            st["country"] = "US"
-            st["country_emoji"] = "🇺🇸"
-        else:
-            st["country"] = "CA"
-            st["country_emoji"] = "🇨🇦"
-        st["step"] = "year"
-        state[uid] = st
-        await query.message.reply_text("Send account year (example 2023) or type 'skip':")
-        return True
-
-    if data == "admin:credits":
-        await query.answer(cache_time=0)
-        await restore_main_reply_menu(query.message)
-        await safe_edit(
-            query.message,
-            "👤 *Credits Manager*\n\nChoose action:",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=kb(
-                [
-                    [
-                        InlineKeyboardButton("➕ Add", callback_data="admin:credits:add"),
-                        InlineKeyboardButton("➖ Remove", callback_data="admin:credits:remove"),
-                    ],
-                    [InlineKeyboardButton("⬅️ Back", callback_data="admin:menu")],
-                ]
-            ),
-        )
-        return True
-
-    if data in {"admin:credits:add", "admin:credits:remove"}:
-        await query.answer(cache_time=0)
-        mode = "add" if data.endswith(":add") else "remove"
-        # Store UI message for inline updates and prompt for input
-        state[uid] = {
-            "flow": "admin_credits_inline",
-            "step": "input",
-            "mode": mode,
-            "ui_chat_id": query.message.chat_id,
-            "ui_message_id": query.message.message_id,
-        }
-        await safe_edit(
-            query.message,
-            f"👤 *Credits ({mode})*\n\nSend in one line:\n`<user_id> <amount>`\n\nOr press Cancel.",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=kb([[InlineKeyboardButton("⬅️ Back", callback_data="admin:credits")]]),
-        )
-        # show bottom cancel keyboard too
-        await query.message.reply_text("Press Cancel to stop.", reply_markup=cancel_reply_kb())
-        return True
-
-    if data == "admin:accounts":
-        await query.answer(cache_time=0)
-        await restore_main_reply_menu(query.message)
-        await safe_edit(query.message, "📦 Accounts\n\nChoose list:", reply_markup=accounts_menu_keyboard(), parse_mode=None)
-        return True
-
-    if data.startswith("admin:accounts:"):
-        # admin:accounts:<available|sold>:<page>
-        await query.answer(cache_time=0)
-        await restore_main_reply_menu(query.message)
-        parts = data.split(":")
-        filter_key = parts[2] if len(parts) > 2 else "available"
-        page = int(parts[3]) if len(parts) > 3 and parts[3].isdigit() else 0
-
-        status = "available" if filter_key == "available" else "assigned"  # sold
-        total_rows = await repo.count_accounts(status=status)
-        page_size = 5
-        max_page = max(0, (total_rows - 1) // page_size)
-        if page > max_page:
-            page = max_page
-
-        accounts = await repo.list_accounts_page(status=status, page=page, page_size=page_size)
-        has_prev = page > 0
-        has_next = page < max_page
-
-        title = "✅ Available Accounts" if filter_key == "available" else "💸 Sold Accounts"
-        header = f"{title}\n\nPage: {page+1}/{max_page+1 if total_rows else 1}"
-
-        if not accounts:
-            await safe_edit(
-                query.message,
-                header + "\n\nNo accounts found.",
-                reply_markup=accounts_list_keyboard([], filter_key=filter_key, page=page, has_prev=False, has_next=False),
-                parse_mode=None,
-            )
-            return True
-
-        await safe_edit(
-            query.message,
-            header + "\n\nSelect an account:",
-            reply_markup=accounts_list_keyboard(accounts, filter_key=filter_key, page=page, has_prev=has_prev, has_next=has_next),
-            parse_mode=None,
-        )
-        return True
-
-    # Sessions handlers removed (all admin:sessions:* callbacks now ignored)
-
-    if data == "admin:bulkdiscount":
-        await query.answer(cache_time=0)
-        await restore_main_reply_menu(query.message)
-        st = await repo.get_bulk_discount()
-        enabled = bool(st.get("enabled"))
-        percent = int(st.get("percent", 0) or 0)
-        status_txt = "ON ✅" if enabled else "OFF ❌"
-        text = (
-            "🏷️ Bulk Price Discount\n\n"
-            f"Status: {status_txt}\n"
-            f"Discount: {percent}%\n\n"
-            "Applies to ALL available accounts.\n"
-            "Use Set % to change discount amount."
-        )
-        await safe_edit(
-            query.message,
-            text,
-            parse_mode=None,
-            reply_markup=kb(
-                [
-                    [InlineKeyboardButton("✏️ Set %", callback_data="admin:bulkdiscount:set")],
-                    [
-                        InlineKeyboardButton(
-                            "⛔ Turn OFF" if enabled else "✅ Turn ON",
-                            callback_data="admin:bulkdiscount:off" if enabled else "admin:bulkdiscount:on",
-                        )
-                    ],
-                    [InlineKeyboardButton("⬅️ Back", callback_data="admin:menu")],
-                ]
-            ),
-        )
-        return True
-
-    if data == "admin:bulkdiscount:on":
-        await query.answer(cache_time=0)
-        await restore_main_reply_menu(query.message)
-        st = await repo.get_bulk_discount()
-        percent = int(st.get("percent", 0) or 0)
-        await repo.apply_bulk_discount(percent=percent)
-        await query.answer("✅ Discount turned ON", show_alert=True)
-
-        # Re-render screen (like QRs toggle)
-        st2 = await repo.get_bulk_discount()
-        enabled2 = bool(st2.get("enabled"))
-        percent2 = int(st2.get("percent", 0) or 0)
-        status_txt2 = "ON ✅" if enabled2 else "OFF ❌"
-        text2 = (
-            "🏷️ Bulk Price Discount\n\n"
-            f"Status: {status_txt2}\n"
-            f"Discount: {percent2}%\n\n"
-            "Applies to ALL available accounts.\n"
-            "Use Set % to change discount amount."
-        )
-        await safe_edit(
-            query.message,
-            text2,
-            parse_mode=None,
-            reply_markup=kb(
-                [
-                    [InlineKeyboardButton("✏️ Set %", callback_data="admin:bulkdiscount:set")],
-                    [
-                        InlineKeyboardButton(
-                            "⛔ Turn OFF" if enabled2 else "✅ Turn ON",
-                            callback_data="admin:bulkdiscount:off" if enabled2 else "admin:bulkdiscount:on",
-                        )
-                    ],
-                    [InlineKeyboardButton("⬅️ Back", callback_data="admin:menu")],
-                ]
-            ),
-        )
-        return True
-
-    if data == "admin:bulkdiscount:off":
-        await query.answer(cache_time=0)
-        await restore_main_reply_menu(query.message)
-        await repo.disable_bulk_discount()
-        await query.answer("⛔ Discount turned OFF", show_alert=True)
-
-        # Re-render screen (like QRs toggle)
-        st2 = await repo.get_bulk_discount()
-        enabled2 = bool(st2.get("enabled"))
-        percent2 = int(st2.get("percent", 0) or 0)
-        status_txt2 = "ON ✅" if enabled2 else "OFF ❌"
-        text2 = (
-            "🏷️ Bulk Price Discount\n\n"
-            f"Status: {status_txt2}\n"
-            f"Discount: {percent2}%\n\n"
-            "Applies to ALL available accounts.\n"
-            "Use Set % to change discount amount."
-        )
-        await safe_edit(
-            query.message,
-            text2,
-            parse_mode=None,
-            reply_markup=kb(
-                [
-                    [InlineKeyboardButton("✏️ Set %", callback_data="admin:bulkdiscount:set")],
-                    [
-                        InlineKeyboardButton(
-                            "⛔ Turn OFF" if enabled2 else "✅ Turn ON",
-                            callback_data="admin:bulkdiscount:off" if enabled2 else "admin:bulkdiscount:on",
-                        )
-                    ],
-                    [InlineKeyboardButton("⬅️ Back", callback_data="admin:menu")],
-                ]
-            ),
-        )
-        return True
-
-    if data == "admin:bulkdiscount:set":
-        await query.answer(cache_time=0)
-        await restore_main_reply_menu(query.message)
-        state[uid] = {"flow": "admin_bulkdiscount", "step": "percent"}
-        await query.message.reply_text(
-            "🏷️ Bulk Price Discount\n\nSend discount percent (0-95).\nExample: 20\n\nType Cancel to stop.",
-            reply_markup=cancel_reply_kb(),
-        )
-        return True
-
-    if data == "admin:qrs":
-        await query.answer(cache_time=0)
-        await restore_main_reply_menu(query.message)
-        flags = await repo.get_inr_qr_flags()
-        qr1 = "ON ✅" if flags.get("qr1") else "OFF ❌"
-        qr2 = "ON ✅" if flags.get("qr2") else "OFF ❌"
-        crypto_enabled = await repo.get_crypto_enabled()
-        crypto_txt = "ON ✅" if crypto_enabled else "OFF ❌"
-        text = f"💠 Payment Settings\n\nQR 1: {qr1}\nQR 2: {qr2}\n\nCrypto: {crypto_txt}"
-        await safe_edit(
-            query.message,
-            text,
-            parse_mode=None,
-            reply_markup=kb(
-                [
-                    [
-                        InlineKeyboardButton("Toggle QR 1", callback_data="admin:qrs:toggle:qr1"),
-                        InlineKeyboardButton("Toggle QR 2", callback_data="admin:qrs:toggle:qr2"),
-                    ],
-                    [InlineKeyboardButton("Toggle Crypto", callback_data="admin:qrs:toggle:crypto")],
-                    [InlineKeyboardButton("⬅️ Back", callback_data="admin:menu")],
-                ]
-            ),
-        )
-        return True
-
-    if data.startswith("admin:qrs:toggle:"):
-        await query.answer(cache_time=0)
-        await restore_main_reply_menu(query.message)
-        qr_key = data.split(":", 3)[3]
-        if qr_key == "crypto":
-            cur = await repo.get_crypto_enabled()
-            await repo.set_crypto_enabled(enabled=not cur)
-            flags = await repo.get_inr_qr_flags()
-        else:
-            flags = await repo.get_inr_qr_flags()
-            new_enabled = not bool(flags.get(qr_key))
-            flags = await repo.set_inr_qr_flag(qr_key=qr_key, enabled=new_enabled)
-        qr1 = "ON ✅" if flags.get("qr1") else "OFF ❌"
-        qr2 = "ON ✅" if flags.get("qr2") else "OFF ❌"
-        crypto_enabled = await repo.get_crypto_enabled()
-        crypto_txt = "ON ✅" if crypto_enabled else "OFF ❌"
-        text = f"💠 Payment Settings\n\nQR 1: {qr1}\nQR 2: {qr2}\n\nCrypto: {crypto_txt}"
-        await safe_edit(
-            query.message,
-            text,
-            parse_mode=None,
-            reply_markup=kb(
-                [
-                    [
-                        InlineKeyboardButton("Toggle QR 1", callback_data="admin:qrs:toggle:qr1"),
-                        InlineKeyboardButton("Toggle QR 2", callback_data="admin:qrs:toggle:qr2"),
-                    ],
-                    [InlineKeyboardButton("Toggle Crypto", callback_data="admin:qrs:toggle:crypto")],
-                    [InlineKeyboardButton("⬅️ Back", callback_data="admin:menu")],
-                ]
-            ),
-        )
-        return True
-
-    if data == "admin:banmenu":
-        await query.answer(cache_time=0)
-        await restore_main_reply_menu(query.message)
-        await safe_edit(
-            query.message,
-            "🚫 Ban System\n\nChoose action:",
-            parse_mode=None,
-            reply_markup=kb(
-                [
-                    [
-                        InlineKeyboardButton("🚫 Ban", callback_data="admin:banmenu:ban"),
-                        InlineKeyboardButton("✅ Unban", callback_data="admin:banmenu:unban"),
-                    ],
-                    [InlineKeyboardButton("📋 Check Ban List", callback_data="admin:banlist:0")],
-                    [
-                    ],
-                    [InlineKeyboardButton("⬅️ Back", callback_data="admin:menu")],
-                ]
-            ),
-        )
-        return True
-
-    if data.startswith("admin:banlist:"):
-        await query.answer(cache_time=0)
-        await restore_main_reply_menu(query.message)
-        page = int(data.split(":", 2)[2]) if data.split(":", 2)[2].isdigit() else 0
-        db = get_db()
-        page_size = 5
-        total = await db.banned_users.count_documents({})
-        max_page = max(0, (total - 1) // page_size) if total else 0
-        if page > max_page:
-            page = max_page
-
-        cur = (
-            db.banned_users.find({})
-            .sort("created_at", -1)
-            .skip(page * page_size)
-            .limit(page_size)
-        )
-        items = await cur.to_list(length=page_size)
-
-        lines: list[str] = ["🚫 Banned Users", ""]
-        if not items:
-            lines.append("No banned users.")
-        else:
-            for it in items:
-                uid2 = it.get("user_id")
-                un = (it.get("username") or "").strip()
-                uline = f"@{un}" if un else "N/A"
-                lines.append(f"• {uid2} | {uline}")
-
-        nav: list[list[InlineKeyboardButton]] = []
-        btns: list[InlineKeyboardButton] = []
-        if page > 0:
-            btns.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"admin:banlist:{page-1}"))
-        if page < max_page:
-            btns.append(InlineKeyboardButton("Next ➡️", callback_data=f"admin:banlist:{page+1}"))
-        if btns:
-            nav.append(btns)
-        nav.append([InlineKeyboardButton("⬅️ Back", callback_data="admin:banmenu")])
-
-        await safe_edit(query.message, "\n".join(lines), parse_mode=None, reply_markup=kb(nav))
-        return True
-
-    if data in {"admin:banmenu:ban", "admin:banmenu:unban"}:
-        await query.answer(cache_time=0)
-        await restore_main_reply_menu(query.message)
-        mode = "ban" if data.endswith(":ban") else "unban"
-        state[uid] = {"flow": "admin_ban", "step": "input", "mode": mode}
-        await query.message.reply_text(
-            f"🚫 Ban System ({mode})\n\nSend user id:\nExample: 6670166083\n\nType Cancel to stop.",
-            reply_markup=cancel_reply_kb(),
-        )
-        return True
-
-    # (Edit Tokens removed)
-
-    if data.startswith("admin:referrals:"):
-        await query.answer(cache_time=0)
-        await restore_main_reply_menu(query.message)
-        page = int(data.split(":", 2)[2]) if data.split(":", 2)[2].isdigit() else 0
-
-        db = get_db()
-        page_size = 10
-
-        pipeline = [
-            {"$group": {"_id": "$referrer_user_id", "count": {"$sum": 1}, "username": {"$first": "$referrer_username"}}},
-            {"$sort": {"count": -1}},
-            {"$skip": page * page_size},
-            {"$limit": page_size},
-        ]
-
-        rows = [r async for r in db.referrals.aggregate(pipeline)]
-        total_referrers = await db.referrals.distinct("referrer_user_id")
-        total = len(total_referrers)
-        max_page = max(0, (total - 1) // page_size) if total else 0
-
-        lines: list[str] = ["🎁 Referrals (Top referrers)", ""]
-        if not rows:
-            lines.append("No referrals yet.")
-        else:
-            for r in rows:
-                rid = int(r.get("_id") or 0)
-                uname = (r.get("username") or "").strip()
-                ref_count = int(r.get("count") or 0)
-                udoc = await db.users.find_one({"user_id": rid})
-                earned = float((udoc or {}).get("ref_earned_total", 0.0) or 0.0)
-                uline = f"@{uname}" if uname else "N/A"
-                lines.append(f"• {rid} | {uline} | refs: {ref_count} | earned: ₹{earned:.2f}")
-
-        nav: list[list[InlineKeyboardButton]] = []
-        btns: list[InlineKeyboardButton] = []
-        if page > 0:
-            btns.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"admin:referrals:{page-1}"))
-        if page < max_page:
-            btns.append(InlineKeyboardButton("Next ➡️", callback_data=f"admin:referrals:{page+1}"))
-        if btns:
-            nav.append(btns)
-        nav.append([InlineKeyboardButton("⬅️ Back", callback_data="admin:menu")])
-
-        await safe_edit(query.message, "\n".join(lines), parse_mode=None, reply_markup=kb(nav))
-        return True
-
-    # admin:sessions:purge_confirm removed
-
-    if data.startswith("admin:activecredits:"):
-        # admin:activecredits:<page>
-        await query.answer(cache_time=0)
-        await restore_main_reply_menu(query.message)
-        page = int(data.split(":", 2)[2]) if data.split(":", 2)[2].isdigit() else 0
-
-        db = get_db()
-        page_size = 15
-        total_rows = await db.users.count_documents({"credits": {"$gt": 0}})
-        max_page = max(0, (total_rows - 1) // page_size)
-        if page > max_page:
-            page = max_page
-
-        cursor = (
-            db.users.find({"credits": {"$gt": 0}})
-            .sort("credits", -1)
-            .skip(page * page_size)
-            .limit(page_size)
-        )
-        users = await cursor.to_list(length=page_size)
-
-        lines: list[str] = [
-            "💰 Active Credits",
-            "",
-            f"Page: {page + 1}/{max_page + 1}",
-            "",
-        ]
-
-        if not users:
-            lines.append("No users with credits > 0.")
-        else:
-            for u in users:
-                uid2 = u.get("user_id") or u.get("_id")
-                username = (u.get("username") or "").strip()
-                # Fallback for older records: try to read last known username from deposits
-                if not username and uid2:
-                    last_dep = await db.deposits.find_one({"user_id": int(uid2)}, sort=[("created_at", -1)])
-                    if last_dep:
-                        username = (last_dep.get("username") or "").strip()
-                credits = u.get("credits", 0)
-                uname = f"@{username}" if username else "N/A"
-                lines.append(f"• {uid2} | {uname} | credits: {credits}")
-
-        has_prev = page > 0
-        has_next = page < max_page
-        await safe_edit(
-            query.message,
-            "\n".join(lines),
-            parse_mode=None,
-            reply_markup=active_credits_keyboard(page, has_prev, has_next),
-        )
-        return True
-
-    if data == "admin:stats":
-        await query.answer(cache_time=0)
-        await restore_main_reply_menu(query.message)
-        db = get_db()
-        total_users = await db.users.count_documents({})
-        total_accounts = await db.accounts.count_documents({})
-        available = await db.accounts.count_documents({"status": "available"})
-        sold = await db.accounts.count_documents({"status": "assigned"})
-
-        text = (
-            "📊 *Statistics*\n\n"
-            f"👥 Users: *{total_users}*\n"
-            f"📦 Accounts: *{total_accounts}*\n"
-            f"✅ Available: *{available}*\n"
-            f"💸 Sold: *{sold}*\n"
-        )
-
-        await safe_edit(query.message, text, parse_mode=ParseMode.MARKDOWN, reply_markup=kb([[InlineKeyboardButton("⬅️ Back", callback_data="admin:menu")]]))
-        return True
-
-    if data == "admin:deposits":
-        await restore_main_reply_menu(query.message)
-        # default view: pending page 0
-        data = "admin:deposits:pending:0"
-
-    if data.startswith("admin:deposits:"):
-        await restore_main_reply_menu(query.message)
-        # admin:deposits:<filter>:<page>
-        parts = data.split(":")
-        filter_key = parts[2] if len(parts) > 2 else "pending"
-        page = int(parts[3]) if len(parts) > 3 and parts[3].isdigit() else 0
-
-        status = None
-        if filter_key == "pending":
-            status = "pending"
-        elif filter_key == "approved":
-            status = "approved"
-        else:
-            status = None  # all
-
-        totals = await repo.deposit_totals()
-        # hide rejected in UI
-        pending_count = totals.get("pending_count", 0)
-        pending_amount = totals.get("pending_amount", 0)
-        approved_count = totals.get("approved_count", 0)
-        approved_amount = totals.get("approved_amount", 0)
-        total_count = pending_count + approved_count
-        total_amount = pending_amount + approved_amount
-
-        total_rows = await repo.count_deposits(status=status)
-        page_size = 8
-        max_page = max(0, (total_rows - 1) // page_size)
-        if page > max_page:
-            page = max_page
-
-        deps = await repo.list_deposits_page(status=status, page=page, page_size=page_size)
-
-        header = [
-            "💳 Deposits",
-            "",
-            f"🟡 Pending: {pending_count} (amount {pending_amount})",
-            f"🟢 Confirmed: {approved_count} (amount {approved_amount})",
-            f"⭐ Total: {total_count} (amount {total_amount})",
-            "",
-        ]
-
-        lines: list[str] = []
-        for d in deps:
-            stt = d.get("status")
-            icon = "🟡" if stt == "pending" else "🟢" if stt == "approved" else "⚪"
-            amount = d.get("amount")
-            user_id = d.get("user_id")
-            username = d.get("username") or ""
-            dep_id = str(d.get("_id"))
-            lines.append(f"{icon} {amount} | {user_id} @{username} | {dep_id}")
-
-        body = "\n".join(header + (lines or ["No records."]))
-        has_prev = page > 0
-        has_next = page < max_page
-
-        # Use plain text to avoid Telegram Markdown parse errors from dynamic content.
-        await safe_edit(
-            query.message,
-            body,
-            reply_markup=deposits_keyboard(filter_key, page, has_prev, has_next, deps),
-            parse_mode=None,
-        )
-        return True
-
-    if data.startswith("admin:account:view:"):
-        acc_id = data.split(":", 3)[3]
-
-        # Stop OTP monitoring if this admin was monitoring this account
-        try:
-            account_manager: AccountManager = context.application.bot_data["account_manager"]
-            oid = ObjectId(acc_id)
-            if account_manager.get_admin_monitor(oid) == int(uid):
-                account_manager.stop_admin_monitor(oid)
-        except Exception:
-            pass
-
-        acc = await repo.get_account(ObjectId(acc_id))
-        if not acc:
-            await query.answer("❌ Account not found.", show_alert=True)
-            return True
-
-        status = "sold" if acc.get("status") == "assigned" else acc.get("status")
-        emoji = acc.get("country_emoji") or ""
-        country = acc.get("country") or ""
-        year = acc.get("year")
-        price = acc.get("price")
-        twofa = acc.get("twofa_password")
-
-        sold_to_line = ""
-        if status == "sold":
-            su = (acc.get("sold_to_username") or "").strip()
-            sid = acc.get("sold_to_user_id") or acc.get("assigned_to")
-            if su:
-                sold_to_line = f"Sold to: *@{su}*\n"
-            elif sid:
-                sold_to_line = f"Sold to: *{sid}*\n"
-
-        text = (
-            "*Account Details*\n\n"
-            f"ID: `{acc_id}`\n"
-            f"Phone: `{emoji} +{acc.get('phone')}`\n"
-            f"Country: *{country}*\n"
-            f"Year: *{year if year is not None else '-'}*\n"
-            f"Status: *{status}*\n"
-            + sold_to_line
-            + f"Price: *{price if price is not None else 'default'}*\n"
-            + f"2FA: *{'set' if twofa else 'not set'}*\n"
-        )
-        await safe_edit(query.message, text, reply_markup=account_detail_keyboard(acc_id), parse_mode=ParseMode.MARKDOWN)
-        return True
-
-    if data.startswith("admin:account:delete:"):
-        acc_id = data.split(":", 3)[3]
-        await safe_edit(
-            query.message,
-            "⚠️ Delete this account? This cannot be undone.",
-            reply_markup=account_delete_confirm_keyboard(acc_id),
-            parse_mode=None,
-        )
-        return True
-
-    if data.startswith("admin:account:delete_confirm:"):
-        acc_id = data.split(":", 3)[3]
-        ok = await repo.delete_account(ObjectId(acc_id))
-        await safe_edit(query.message, "✅ Deleted." if ok else "Account not found.", reply_markup=None, parse_mode=None)
-        return True
-
-    if data.startswith("admin:account:edit:"):
-        acc_id = data.split(":", 3)[3]
-        state[uid] = {"flow": "admin_edit_account", "step": "field", "account_id": acc_id}
-        await query.message.reply_text(
-            "✏️ Edit Account\n\n"
-            "Type which field to edit: `country`, `emoji`, `year`, `twofa`, `price`\n"
-            "Or type `cancel`.",
-            parse_mode=ParseMode.MARKDOWN,
-        )
-        return True
-
-    if data.startswith("admin:account:getotp:"):
-        await query.answer(cache_time=0)
-        acc_id_s = data.split(":", 3)[3]
-        try:
-            account_id = ObjectId(acc_id_s)
-        except Exception:
-            await query.answer("Invalid account ID.", show_alert=True)
-            return True
-
-        acc = await repo.get_account(account_id)
-        if not acc:
-            await query.answer("Account not found.", show_alert=True)
-            return True
-
-        phone = acc.get("phone") or ""
-        twofa = (acc.get("twofa_password") or "").strip()
-        twofa_line = f"\n🔒 2FA: `{twofa}`" if twofa else "\n🔒 2FA: Not set"
-
-        # Start monitoring (replace any existing monitor)
-        account_manager: AccountManager = context.application.bot_data["account_manager"]
-        account_manager.start_admin_monitor(account_id, uid)
-
-        # Ensure session connected (admin monitor mode: do NOT mark admin as buyer)
-        try:
-            await account_manager.ensure_connected_for_admin_monitor(account_id, acc)
-        except Exception as e:
-            await query.answer(f"Failed to connect session: {e}", show_alert=True)
-            account_manager.stop_admin_monitor(account_id)
-            return True
-
-        await safe_edit(
-            query.message,
-            f"📱 Get OTP\n\n"
-            f"Phone: +{phone}{twofa_line}\n\n"
-            f"✅ OTP forwarding started.\n"
-            f"I will forward any OTP received in this chat.",
-
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=kb(
-                [
-                    [InlineKeyboardButton("🔄 Retry OTP", callback_data=f"admin:account:getotp:{acc_id_s}")],
-                    [InlineKeyboardButton("⬅️ Back", callback_data=f"admin:account:view:{acc_id_s}")],
-                ]
-            ),
-        )
-        return True
-
-    # Cancel removed; use Retry button or Back (stops monitor automatically)
-    if data.startswith("admin:account:getotp:cancel:"):
-        await query.answer(cache_time=0)
-        return True
-
-    # Deposit details / resend screenshot
-    if data.startswith("admin:dep:view:"):
-        dep_id = data.split(":", 3)[3]
-        dep = await repo.get_deposit(dep_id)
-        if not dep:
-            await query.answer("❌ Deposit not found.", show_alert=True)
-            return True
-
-        stt = dep.get("status")
-        method = (dep.get("method") or "").upper()
-        network = (dep.get("network") or "").upper()
-        amount = dep.get("amount")
-        amount_text = dep.get("amount_text")
-        user_id = dep.get("user_id")
-        username = dep.get("username") or ""
-
-        # Build action buttons (same as bot)
-        if dep.get("method") == "crypto":
-            action_markup = kb(
-                [
-                    [
-                        InlineKeyboardButton("✅ Set Credits & Approve", callback_data=f"admin:dep:setcredits:{dep_id}"),
-                        InlineKeyboardButton("❌ Reject", callback_data=f"admin:dep:reject:{dep_id}"),
-                    ],
-                    [InlineKeyboardButton("⬅️ Back", callback_data="admin:deposits")],
-                ]
-            )
-        else:
-            action_markup = kb(
-                [
-                    [
-                        InlineKeyboardButton("✅ Approve", callback_data=f"admin:dep:approve:{dep_id}"),
-                        InlineKeyboardButton("❌ Reject", callback_data=f"admin:dep:reject:{dep_id}"),
-                    ],
-                    [InlineKeyboardButton("⬅️ Back", callback_data="admin:deposits")],
-                ]
-            )
-
-        # Diagnostics: last notify failures
-        notify = dep.get("admin_notify") or []
-        fails = [n for n in notify if not n.get("ok")]
-        fail_lines = []
-        for n in fails[-5:]:
-            fail_lines.append(f"• admin {n.get('admin_id')}: {n.get('error')}")
-        diag = ("\n\n⚠️ Last notify errors:\n" + "\n".join(fail_lines)) if fail_lines else ""
-
-        caption = (
-            "💳 Deposit Request\n\n"
-            f"Status: {stt}\n"
-            f"User: {user_id} @{username if username else 'N/A'}\n"
-            f"Method: {method}" + (f" ({network})" if network else "") + "\n"
-            + (f"Paid: {amount_text}\n" if amount_text else "")
-            + f"Amount: {amount}\n"
-            + f"Deposit ID: {dep_id}"
-            + diag
-        )
-
-        sc = dep.get("screenshot")
-        if sc and sc.get("file_id"):
-            try:
-                if sc.get("kind") == "photo":
-                    await context.bot.send_photo(
-                        chat_id=uid,
-                        photo=sc["file_id"],
-                        caption=caption,
-                        parse_mode=None,
-                        reply_markup=action_markup,
-                    )
-                else:
-                    await context.bot.send_document(
-                        chat_id=uid,
-                        document=sc["file_id"],
-                        caption=caption,
-                        parse_mode=None,
-                        reply_markup=action_markup,
-                    )
-                await query.answer("✅ Sent deposit details.", show_alert=True)
-            except Exception as e:
-                await query.answer(f"❌ Failed to send screenshot: {e}", show_alert=True)
-        else:
-            # No screenshot saved (old deposits)
-            await safe_edit(query.message, caption + "\n\n❌ Screenshot not stored.", parse_mode=None, reply_markup=action_markup)
-        return True
-
-    # Deposit approvals
-    if data.startswith("admin:dep:setcredits:"):
-        dep_id = data.split(":", 3)[3]
-        dep = await repo.get_deposit(dep_id)
-        if not dep or dep.get("status") != "pending":
-            await query.answer("❌ Deposit not found or already processed.", show_alert=True)
-            return True
-        state[uid] = {"flow": "admin_dep_setcredits", "step": "credits", "dep_id": dep_id}
-        await query.message.reply_text(
-            "Send how many credits to add for this crypto payment (example: 1 USDT = 70 credits => send 70):"
-        )
-        return True
-
-    if data.startswith("admin:dep:approve:"):
-        # INR deposit approve: credits = amount
-        dep_id = data.split(":", 3)[3]
-        dep = await repo.get_deposit(dep_id)
-        if not dep or dep.get("status") != "pending":
-            await query.answer("❌ Deposit not found or already processed.", show_alert=True)
-            return True
-
-        base = int(dep.get("amount", 0))
-        bonus = int(round((base * float(REFERRAL_PERCENT)) / 100.0))
-        credits = base + bonus
-
-        dep2 = await repo.mark_deposit(dep_id, "approved", admin_id=uid, credits_added=credits)
-        if not dep2:
-            await query.answer("❌ Deposit not found or already processed.", show_alert=True)
-            return True
-
-        await repo.add_credits(dep["user_id"], credits, by_admin=uid)
-        await query.answer("✅ Approved and credits added.", show_alert=True)
-
-        # notify depositor with bonus
-        try:
-            udoc = await repo.db.users.find_one({"user_id": int(dep["user_id"])})
-            bal = int((udoc or {}).get("credits", 0))
-            await context.bot.send_message(
-                chat_id=int(dep["user_id"]),
-                text=(
-                    "✅ Deposit approved!\n"
-                    f"• Deposit: ₹{base}\n"
-                    f"• Bonus: +₹{bonus} ({REFERRAL_PERCENT:.1f}%)\n"
-                    f"• Total Credited: ₹{credits}\n"
-                    f"• Balance: {bal} credits"
-                ),
-            )
-        except Exception:
-            pass
-
-        # Referral earning (3%) to referrer if user was referred
-        try:
-            await _notify_referral_award(
-                context=context,
-                repo=repo,
-                referred_user_id=int(dep["user_id"]),
-                deposit_amount=int(base),
-                admin_id=int(uid),
-                deposit_id=str(dep_id),
-            )
-        except Exception:
-            pass
-
-        return True
-
-    if data.startswith("admin:dep:reject:"):
-        dep_id = data.split(":", 3)[3]
-        dep = await repo.mark_deposit(dep_id, "rejected", admin_id=uid)
-        if not dep:
-            await query.answer("❌ Deposit not found or already processed.", show_alert=True)
-            return True
-        await query.answer("❌ Rejected.", show_alert=True)
-        try:
-            await context.bot.send_message(
-                chat_id=int(dep["user_id"]),
-                text="❌ Payment rejected. Contact admin if this is a mistake.",
-            )
-        except Exception:
-            pass
-        return True
-
-    return True
-
-
-async def handle_admin_text(
-    update: Update,
-    context: ContextTypes.DEFAULT_TYPE,
-    state: Dict[int, Dict[str, Any]],
-    account_manager,
-) -> bool:
-    """Handle admin guided text flows. Returns True if handled."""
-    if not update.message:
-        return False
-
-    uid = update.effective_user.id
-    if uid not in state:
-        return False
-
-    st = state[uid]
-    flow = st.get("flow")
-    step = st.get("step")
-
-    if flow not in {
-        "admin_add_account",
-        "admin_credits",
-        "admin_credits_inline",
-        "admin_edit_account",
-        "admin_dep_setcredits",
-        "admin_tokenedit",
-        "admin_ban",
-        "admin_bulkdiscount",
-    }:
-        return False
-
-    if not is_admin(uid):
-        state.pop(uid, None)
-        return True
-
-    repo: Repo = context.application.bot_data["repo"]
-    text = update.message.text.strip()
-
-    # Global cancel for admin text flows (via bottom reply keyboard or typed text)
-    if text.lower() == "cancel":
-        state.pop(uid, None)
-        await update.message.reply_text("Cancelled.", reply_markup=main_reply_menu(True))
-        return True
-
-    # ----- bulk discount -----
-    if flow == "admin_bulkdiscount":
-        if step == "percent":
-            if not text.isdigit():
-                await update.message.reply_text("Send a number between 0 and 95 (example 20):")
-                return True
-            p = int(text)
-            if p < 0 or p > 95:
-                await update.message.reply_text("Percent must be 0-95. Send again:")
-                return True
-
-            try:
-                await repo.apply_bulk_discount(percent=p)
-            except Exception as e:
-                state.pop(uid, None)
-                await update.message.reply_text(
-                    f"❌ Failed to apply discount: {e}",
-                    reply_markup=main_reply_menu(True),
-                )
-                return True
-
-            state.pop(uid, None)
-            st2 = await repo.get_bulk_discount()
-            await update.message.reply_text(
-                f"✅ Bulk discount updated successfully!\n\nStatus: {'ON ✅' if st2.get('enabled') else 'OFF ❌'}\nDiscount: {int(st2.get('percent', 0) or 0)}%",
-                reply_markup=main_reply_menu(True),
-            )
-            return True
-
-    # ----- add account -----
-    if flow == "admin_add_account":
-        # API credentials are fixed (see FIXED_API_ID/FIXED_API_HASH). Start from phone.
-        if step == "phone":
-            # ensure fixed API creds are present
-            st.setdefault("api_id", TELEGRAM_API_ID)
-            st.setdefault("api_hash", TELEGRAM_API_HASH)
-
-            phone_e164 = text.replace(" ", "")
-            if not phone_e164.startswith("+"):
-                await update.message.reply_text("Phone must start with +. Send again:")
-                return True
-            st["phone_e164"] = phone_e164
-            st["phone"] = phone_e164.lstrip("+")
-
-            # Auto detect country + emoji from calling code
-            cc, em, needs_choice = detect_country_from_phone(phone_e164)
-            if needs_choice:
-                st["step"] = "pick_usca"
-                state[uid] = st
-                await update.message.reply_text(
-                    "Detected +1 number. Choose country:",
-                    reply_markup=ReplyKeyboardRemove(),
-                )
-                await update.message.reply_text(
-                    "Select:",
-                    reply_markup=kb(
-                        [
-                            [
-                                InlineKeyboardButton("🇺🇸 USA", callback_data="admin:addaccount:cc:us"),
-                                InlineKeyboardButton("🇨🇦 Canada", callback_data="admin:addaccount:cc:ca"),
-                            ]
-                        ]
-                    ),
-                )
-                return True
-
-            if cc and em:
-                st["country"] = cc
-                st["country_emoji"] = em
-            else:
-                # No manual country/emoji input anymore
-                await update.message.reply_text(
-                    "❌ Could not detect country from this number. Please send a valid international number with correct country code.",
-                    reply_markup=cancel_reply_kb(),
-                )
-                st["step"] = "phone"
-                return True
-
-            st["step"] = "year"
-            await update.message.reply_text("Send account year (example 2023) or type 'skip':")
-            return True
-
-        if step == "year":
-            t = text.strip().lower()
-            if t == "skip":
-                st["year"] = None
-                st["premium_months"] = None
-                st["step"] = "price"
-                await update.message.reply_text("Send price in credits for this account (example 75):")
-                return True
-
-            if t == "premium":
-                st["year"] = "premium"
-                st["step"] = "premium_months"
-                await update.message.reply_text("⭐ Premium selected. Send premium months (number, e.g. 1):")
-                return True
-
-            if not t.isdigit() or len(t) != 4:
-                await update.message.reply_text("Year must be 4 digits like 2023, or type 'premium', or 'skip':")
-                return True
-            st["year"] = int(t)
-            st["premium_months"] = None
-
-            st["step"] = "price"
-            await update.message.reply_text("Send price in credits for this account (example 75):")
-            return True
-
-        if step == "premium_months":
-            if not text.isdigit() or int(text) <= 0:
-                await update.message.reply_text("Send premium months as a number (e.g. 1):")
-                return True
-            st["premium_months"] = int(text)
-            st["step"] = "price"
-            await update.message.reply_text("Send price in credits for this account (example 75):")
-            return True
-
-        if step == "price":
-            if not text.isdigit():
-                await update.message.reply_text("Price must be numeric. Send again:")
-                return True
-            st["price"] = int(text)
-
-            st["step"] = "send_code"
-            await update.message.reply_text("Sending Telegram login code to this phone...")
-            await account_manager.admin_begin_login(uid, st["api_id"], st["api_hash"], st["phone_e164"])
-            await update.message.reply_text("Now send the OTP code. If 2FA enabled, I will ask password.")
-            return True
-
-        if step == "send_code":
-            code = text.replace(" ", "")
-            doc, status = await account_manager.admin_complete_code(uid, code)
-            if status == "need_password":
-                st["step"] = "tg_password"
-                await update.message.reply_text("Telegram 2FA required. Send Telegram 2FA password:")
-                return True
-
-            if status == "invalid_code":
-                # allow retry
-                st["step"] = "send_code"
-                await update.message.reply_text(
-                    "❌ Invalid OTP code. Send the OTP again (or press Cancel).",
-                    reply_markup=cancel_reply_kb(),
-                )
-                return True
-
-            if status == "code_expired":
-                # must restart login (resend code)
-                await account_manager.admin_cancel_login(uid)
-                state.pop(uid, None)
-                await update.message.reply_text(
-                    "⚠️ OTP expired. Please start again and request a new code.",
-                    reply_markup=main_reply_menu(True),
-                )
-                return True
-
-            if status != "ok" or not doc:
-                await account_manager.admin_cancel_login(uid)
-                state.pop(uid, None)
-                await update.message.reply_text("Failed to login. Cancelled.", reply_markup=main_reply_menu(True))
-                return True
-
-            await repo.create_account(
-                phone=doc["phone"],
-                api_id=doc["api_id"],
-                api_hash=doc["api_hash"],
-                session_string=doc["session_string"],
-                added_by=uid,
-                year=st.get("year"),
-                premium_months=st.get("premium_months"),
-                country=st.get("country"),
-                country_emoji=st.get("country_emoji"),
-                twofa_password=st.get("twofa_password"),
-                price=st.get("price"),
-            )
-            state.pop(uid, None)
-            await update.message.reply_text("✅ Account saved and added to stock.", reply_markup=main_reply_menu(True))
-            return True
-
-        if step == "tg_password":
-            pwd = text.strip()
-            doc, status = await account_manager.admin_complete_password(uid, pwd)
-            if status in {"invalid_password"} or status != "ok" or not doc:
-                # Don't cancel the whole flow; allow retry
-                st["step"] = "tg_password"
-                await update.message.reply_text(
-                    "❌ Wrong 2FA password. Send again (or press Cancel).",
-                    reply_markup=cancel_reply_kb(),
-                )
-                return True
-
-            # Save ONLY the correct 2FA password
-            st["twofa_password"] = pwd
-
-            await repo.create_account(
-                phone=doc["phone"],
-                api_id=doc["api_id"],
-                api_hash=doc["api_hash"],
-                session_string=doc["session_string"],
-                added_by=uid,
-                year=st.get("year"),
-                premium_months=st.get("premium_months"),
-                country=st.get("country"),
-                country_emoji=st.get("country_emoji"),
-                twofa_password=st.get("twofa_password"),
-                price=st.get("price"),
-            )
-            state.pop(uid, None)
-            await update.message.reply_text("✅ Account saved and added to stock.", reply_markup=main_reply_menu(True))
-            return True
-
-    # ----- edit account -----
-    if flow == "admin_edit_account":
-        if text.lower() == "cancel":
-            state.pop(uid, None)
-            await update.message.reply_text("Cancelled.")
-            return True
-
-        acc_id = st.get("account_id")
-        if not acc_id:
-            state.pop(uid, None)
-            return True
-
-        if step == "field":
-            field = text.lower().strip()
-            if field not in {"country", "emoji", "year", "twofa", "price"}:
-                await update.message.reply_text("Choose: country / emoji / year / twofa / price (or cancel)")
-                return True
-            st["field"] = field
-            st["step"] = "value"
-            await update.message.reply_text("Send new value (or 'skip' to clear):")
-            return True
-
-        if step == "value":
-            field = st.get("field")
-            val_raw = text
-
-            fields: dict[str, Any] = {}
-            if val_raw.lower() == "skip":
-                mapping = {
-                    "country": "country",
-                    "emoji": "country_emoji",
-                    "year": "year",
-                    "twofa": "twofa_password",
-                    "price": "price",
-                }
-                fields[mapping[field]] = None
-            else:
-                if field == "country":
-                    fields["country"] = val_raw.upper()
-                elif field == "emoji":
-                    fields["country_emoji"] = val_raw
-                elif field == "year":
-                    if not val_raw.isdigit() or len(val_raw) != 4:
-                        await update.message.reply_text("Year must be 4 digits (example 2023)")
-                        return True
-                    fields["year"] = int(val_raw)
-                elif field == "twofa":
-                    fields["twofa_password"] = val_raw
-                elif field == "price":
-                    if not val_raw.isdigit():
-                        await update.message.reply_text("Price must be numeric")
-                        return True
-                    fields["price"] = int(val_raw)
-
-            ok = await repo.update_account_fields(ObjectId(acc_id), fields)
-            state.pop(uid, None)
-            await update.message.reply_text("✅ Updated." if ok else "No changes saved.")
-            return True
-
-    # ----- crypto deposit: set credits then approve -----
-    if flow == "admin_dep_setcredits":
-        if step == "credits":
-            if not text.isdigit() or int(text) <= 0:
-                await update.message.reply_text("Send numeric credits (example 70):")
-                return True
-
-            dep_id = st.get("dep_id")
-            base = int(text)
-            bonus = int(round((base * float(REFERRAL_PERCENT)) / 100.0))
-            credits = base + bonus
-
-            dep = await repo.mark_deposit(dep_id, "approved", admin_id=uid, credits_added=credits)
-            if not dep:
-                state.pop(uid, None)
-                await update.message.reply_text("Deposit not found or already processed.")
-                return True
-
-            await repo.add_credits(dep["user_id"], credits, by_admin=uid)
-            state.pop(uid, None)
-            await update.message.reply_text("✅ Approved and credits added.")
-            try:
-                udoc = await repo.db.users.find_one({"user_id": int(dep["user_id"])})
-                bal = int((udoc or {}).get("credits", 0))
-                await context.bot.send_message(
-                    chat_id=int(dep["user_id"]),
-                    text=(
-                        "✅ Deposit approved!\n"
-                        f"• Deposit: ₹{base}\n"
-                        f"• Bonus: +₹{bonus} ({REFERRAL_PERCENT:.1f}%)\n"
-                        f"• Total Credited: ₹{credits}\n"
-                        f"• Balance: {bal} credits"
-                    ),
-                )
-            except Exception:
-                pass
-
-            # Referral earning to referrer if user was referred
-            try:
-                await _notify_referral_award(
-                    context=context,
-                    repo=repo,
-                    referred_user_id=int(dep["user_id"]),
-                    deposit_amount=int(base),
-                    admin_id=int(uid),
-                    deposit_id=str(dep_id),
-                )
-            except Exception:
-                pass
-
-            return True
-
-    # ----- credits inline (no new messages) -----
-    if flow == "admin_credits_inline":
-        if step == "input":
-            parts = text.split()
-            if len(parts) != 2 or not parts[0].isdigit() or not parts[1].lstrip('-').isdigit():
-                # keep inline prompt
-                chat_id = st.get("ui_chat_id")
-                msg_id = st.get("ui_message_id")
-                if chat_id and msg_id:
-                    await context.bot.edit_message_text(
-                        chat_id=chat_id,
-                        message_id=msg_id,
-                        text="❌ Invalid format. Use: `<user_id> <amount>`",
-                        parse_mode=ParseMode.MARKDOWN,
-                        reply_markup=kb([[InlineKeyboardButton("⬅️ Back", callback_data="admin:credits")]]),
-                    )
-                return True
-
-            target = int(parts[0])
-            amt = int(parts[1])
-            if st.get("mode") == "remove":
-                amt = -abs(amt)
-
-            user = await repo.add_credits(target, amt, by_admin=uid)
-            chat_id = st.get("ui_chat_id")
-            msg_id = st.get("ui_message_id")
-            state.pop(uid, None)
-
-            if chat_id and msg_id:
-                await context.bot.edit_message_text(
-                    chat_id=chat_id,
-                    message_id=msg_id,
-                    text=f"✅ Updated user `{target}` credits: *{user.get('credits', 0)}*",
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=kb([[InlineKeyboardButton("⬅️ Back", callback_data="admin:menu")]]),
-                )
-            return True
-
-    # ----- credits -----
-    if flow == "admin_ban":
-        if step == "input":
-            if not text.isdigit():
-                await update.message.reply_text("Send numeric user id:")
-                return True
-            target = int(text)
-            mode = st.get("mode")
-            if mode == "ban":
-                # capture username if known
-                uname = ""
-                try:
-                    ch = await context.bot.get_chat(target)
-                    uname = getattr(ch, "username", "") or ""
-                except Exception:
-                    uname = ""
-                await repo.ban_user(user_id=target, by_admin=uid, username=uname)
-                state.pop(uid, None)
-                await update.message.reply_text(
-                    f"✅ Banned user: {target}",
-                    reply_markup=main_reply_menu(True),
-                )
-                return True
-            else:
-                ok = await repo.unban_user(user_id=target)
-                state.pop(uid, None)
-                await update.message.reply_text(
-                    f"✅ Unbanned user: {target}" if ok else f"User not banned: {target}",
-                    reply_markup=main_reply_menu(True),
-                )
-                return True
-
-    if flow == "admin_tokenedit":
-        if step == "input":
-            parts = text.split()
-            if len(parts) != 2 or not parts[0].isdigit() or not parts[1].isdigit():
-                await update.message.reply_text("Format: <user_id> <count>")
-                return True
-            target = int(parts[0])
-            count = int(parts[1])
-            mode = st.get("mode")
-            if mode == "remove":
-                count = -abs(count)
-            else:
-                count = abs(count)
-
-            new_tokens = await repo.add_tokens(target, count)
-            state.pop(uid, None)
-            await update.message.reply_text(
-                f"✅ Tokens updated for {target}: {new_tokens}",
-                reply_markup=main_reply_menu(True),
-            )
-            return True
-
-    if flow == "admin_credits":
-        if step == "user_id":
-            if not text.isdigit():
-                await update.message.reply_text("Send numeric user id:")
-                return True
-            st["target_user"] = int(text)
-            st["step"] = "mode"
-            await update.message.reply_text("Type 'add' to add credits or 'set' to set credits:")
-            return True
-
-        if step == "mode":
-            m = text.lower()
-            if m not in {"add", "set"}:
-                await update.message.reply_text("Type 'add' or 'set':")
-                return True
-            st["mode"] = m
-            st["step"] = "amount"
-            await update.message.reply_text("Send amount (number):")
-            return True
-
-        if step == "amount":
-            if not text.lstrip("-").isdigit():
-                await update.message.reply_text("Send numeric amount:")
-                return True
-            amt = int(text)
-            target = int(st["target_user"])
-            if st.get("mode") == "add":
-                user = await repo.add_credits(target, amt, by_admin=uid)
-            else:
-                user = await repo.set_credits(target, amt, by_admin=uid)
-            state.pop(uid, None)
-            await update.message.reply_text(
-                f"✅ Updated user {target} credits: {user.get('credits', 0)}",
-                reply_markup=main_reply_menu(True),
-            )
-            return True
-
-    return False
+from __future__ import annotations
+
+import os
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict
+
+# Ensure local folder is importable even if run from another working directory
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from bson import ObjectId
+
+import asyncio
+import functools
+import re
+from collections import deque
+
+
+# Compiled validators for the admin text flows: one C-level scan instead of
+# separate isdigit + length passes per message.
+_YEAR_RE = re.compile(r"^\d{4}$").match
+_DIGITS_RE = re.compile(r"^\d+$").match
+_PHONE_RE = re.compile(r"^\+\d{6,15}$").match
+_SIGNED_INT_RE = re.compile(r"-?[0-9]+").fullmatch
+
+
+def _parse_int(s: str) -> int | None:
+    """Validate-and-parse a signed integer in one pass.
+
+    ASCII digits only — str.isdigit/int() both accept Unicode digit
+    codepoints, which we don't want from pasted admin input.
+    """
+    return int(s) if _SIGNED_INT_RE(s) else None
+
+
+# ObjectId re-validates 24 hex chars and allocates per call; the same account
+# id is converted repeatedly under Retry/Back navigation, so memoize it
+# (ObjectId instances are immutable).
+_oid = functools.lru_cache(maxsize=4096)(ObjectId)
+
+
+# Strips every non-digit character in a single C-level pass (vs a per-char
+# Python generator) when scrubbing phone numbers.
+_NONDIGIT_TABLE = str.maketrans("", "", "".join(chr(c) for c in range(128) if not chr(c).isdigit()))
+
+# Whitespace scrub for pasted phone numbers / OTP codes. Includes NBSP, which
+# Telegram clients insert when numbers are copied from formatted messages.
+_WS_STRIP = str.maketrans("", "", " \t\r\n\u00a0")
+
+
+@functools.lru_cache(maxsize=512)
+def _emoji_from_region(region: str) -> str:
+    """Convert country code (IN) -> flag emoji (🇮🇳)."""
+    if not region or len(region) != 2:
+        return ""
+    region = region.upper()
+    return chr(127397 + ord(region[0])) + chr(127397 + ord(region[1]))
+
+
+# Calling-code prefix -> candidate regions, built lazily from phonenumbers
+# metadata (the import itself pulls in several MB, so it stays deferred).
+# Calling codes are 1-3 digits, so resolving a number is at most three dict
+# probes instead of a full phonenumbers.parse over the region regexes.
+_PREFIX_REGIONS: dict[str, tuple[str, ...]] | None = None
+
+
+def _prefix_regions() -> dict[str, tuple[str, ...]]:
+    global _PREFIX_REGIONS
+    if _PREFIX_REGIONS is None:
+        import phonenumbers
+
+        _PREFIX_REGIONS = {
+            str(cc): tuple(regions)
+            for cc, regions in phonenumbers.COUNTRY_CODE_TO_REGION_CODE.items()
+        }
+    return _PREFIX_REGIONS
+
+
+def detect_country_from_phone(phone_e164: str) -> tuple[str | None, str | None, bool]:
+    """Return (country_code, emoji, needs_us_ca_choice).
+
+    Resolves the calling-code prefix against the precomputed table; only
+    shared calling codes (several regions per prefix) fall back to a full
+    phonenumbers parse. +1 can't be split without the subscriber prefix, so
+    we ask the admin to choose US/CA.
+    """
+    digits = phone_e164.translate(_NONDIGIT_TABLE)
+
+    # +1 can never be resolved from the calling code alone, so answer before
+    # touching the prefix table — the most common input then skips even the
+    # lazy phonenumbers metadata import.
+    if digits.startswith("1"):
+        return None, None, True
+
+    table = _prefix_regions()
+    regions: tuple[str, ...] = ()
+    for n in (1, 2, 3):
+        hit = table.get(digits[:n])
+        if hit:
+            regions = hit
+            break
+
+    if len(regions) == 1:
+        region = regions[0]
+        return region, _emoji_from_region(region), False
+
+    if not regions:
+        return None, None, False
+
+    # Shared calling code (e.g. +7 RU/KZ): let phonenumbers disambiguate.
+    import phonenumbers
+
+    try:
+        num = phonenumbers.parse(phone_e164, None)
+        region = phonenumbers.region_code_for_number(num)
+    except Exception:
+        region = None
+
+    if not region:
+        return None, None, False
+
+    return region, _emoji_from_region(region), False
+
+try:
+    from telegram import (
+        InlineKeyboardButton,
+        InlineKeyboardMarkup,
+        KeyboardButton,
+        ReplyKeyboardMarkup,
+        ReplyKeyboardRemove,
+        Update,
+    )
+    from telegram.constants import ParseMode
+    from telegram.ext import ContextTypes
+except ImportError as e:  # pragma: no cover
+    raise RuntimeError(
+        "Wrong 'telegram' package installed. This project requires 'python-telegram-bot'.\n\n"
+        "Fix (recommended):\n"
+        "  pip uninstall -y telegram\n"
+        "  pip uninstall -y python-telegram-bot telegram-bot\n"
+        "  pip install -U python-telegram-bot\n\n"
+        "Then restart the bot. Original import error: "
+        + str(e)
+    )
+
+
+
+async def _notify_referral_award(
+    *,
+    context: ContextTypes.DEFAULT_TYPE,
+    repo: Repo,
+    referred_user_id: int,
+    deposit_amount: int,
+    admin_id: int,
+    deposit_id: str | None = None,
+) -> None:
+    """Credit referral earning to referrer (forever) and notify them.
+
+    Note: This is called after a deposit is approved.
+    """
+    # Find referral mapping
+    ref = await repo.db.referrals.find_one({"referred_user_id": int(referred_user_id)})
+    if not ref:
+        return
+
+    referrer_id = int(ref.get("referrer_user_id") or 0)
+    if not referrer_id:
+        return
+
+    reward = _referral_bonus(int(deposit_amount))
+    if reward <= 0:
+        return
+
+    user = await repo.add_referral_earning(
+        referrer_user_id=referrer_id,
+        referred_user_id=int(referred_user_id),
+        amount=float(reward),
+        by_admin=int(admin_id),
+        deposit_id=str(deposit_id) if deposit_id else None,
+        deposit_amount=int(deposit_amount),
+    )
+
+    referred_un = (ref.get("referred_username") or "").strip()
+    ref_line = f"@{referred_un}" if referred_un else "N/A"
+
+    # The DB write above is the only ordering constraint; notify the referrer
+    # in the background so a slow Telegram round-trip can't stall the
+    # deposit-approval handler.
+    async def _notify() -> None:
+        try:
+            await context.bot.send_message(
+                chat_id=referrer_id,
+                text=(
+                    "🎉 Referral Reward Added!\n"
+                    f"• From user: {referred_user_id} {ref_line}\n"
+                    f"• Deposit: ₹{int(deposit_amount)}\n"
+                    f"• Reward: +₹{reward} credits ({REFERRAL_PERCENT:.1f}%)\n"
+                    f"• New Balance: {int((user or {}).get('credits', 0))} credits"
+                ),
+            )
+        except Exception:
+            pass
+
+    _spawn_bg(_notify())
+
+
+async def safe_edit(
+    message,
+    text: str,
+    *,
+    reply_markup: InlineKeyboardMarkup | None = None,
+    parse_mode=ParseMode.MARKDOWN,
+):
+    """Edit a message safely.
+
+    - If the message is a photo/document with caption, use edit_caption.
+    - Else use edit_text.
+
+    No-op edits (double-clicks, unchanged renders) are left to Telegram's
+    "message is not modified" error, swallowed like every other failure -
+    same as the safe_edit helpers in bot.py and device_manager.py, which
+    edit these same messages and could not keep a local skip-cache honest.
+    """
+    # Pick the right edit method once: media messages only have captions, so
+    # retrying edit_text after a failed edit would just buy a second 400.
+    try:
+        if getattr(message, "photo", None) or getattr(message, "document", None):
+            return await message.edit_caption(caption=text, parse_mode=parse_mode, reply_markup=reply_markup)
+        return await message.edit_text(text=text, parse_mode=parse_mode, reply_markup=reply_markup)
+    except Exception:
+        return None
+
+
+
+# Static rows shared by the paginated keyboards below; only per-page rows are
+# allocated per call.
+_DEPOSIT_FILTER_TABS = [
+    InlineKeyboardButton("\U0001f7e1 Pending", callback_data="admin:deposits:pending:0"),
+    InlineKeyboardButton("\U0001f7e2 Confirmed", callback_data="admin:deposits:approved:0"),
+    InlineKeyboardButton("\U0001f4cb All", callback_data="admin:deposits:all:0"),
+]
+_BACK_TO_MENU_ROW = [InlineKeyboardButton("\u2b05\ufe0f Back", callback_data="admin:menu")]
+_BACK_TO_ACCOUNTS_ROW = [InlineKeyboardButton("\u2b05\ufe0f Back", callback_data="admin:accounts")]
+
+
+def deposits_keyboard(
+      filter_key: str,
+      page: int,
+      has_prev: bool,
+      has_next: bool,
+      deposits: list[dict] | None = None,
+  ) -> InlineKeyboardMarkup:
+      """Deposits list keyboard.
+
+      Adds per-deposit 'View' buttons so admins can open/resend screenshot even if initial DM failed.
+      """
+      # filter_key: all|pending|approved
+      rows: list[list[InlineKeyboardButton]] = [_DEPOSIT_FILTER_TABS]
+
+      # Per deposit view buttons (page sized, so safe)
+      if deposits:
+          for d in deposits:
+              dep_id = str(d.get("_id"))
+              amt = d.get("amount")
+              uid = d.get("user_id")
+              rows.append([InlineKeyboardButton(f"🔎 View {amt} | {uid}", callback_data=f"admin:dep:view:{dep_id}")])
+
+      nav: list[InlineKeyboardButton] = []
+      if has_prev:
+          nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"admin:deposits:{filter_key}:{page-1}"))
+      if has_next:
+          nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"admin:deposits:{filter_key}:{page+1}"))
+      if nav:
+          rows.append(nav)
+
+      rows.append(_BACK_TO_MENU_ROW)
+      return kb(rows)
+
+from config import ADMIN_USER_IDS, TELEGRAM_API_ID, TELEGRAM_API_HASH, BOT_USERNAME
+
+# Backward-compatible: if REFERRAL_PERCENT is not present in config.py yet
+try:
+    from config import REFERRAL_PERCENT  # type: ignore
+except Exception:
+    import os
+
+    REFERRAL_PERCENT = float(os.getenv("REFERRAL_PERCENT", "3.0"))
+from database import Repo
+
+
+# REFERRAL_PERCENT folded to basis points once at import so every approval is
+# pure integer math: no float coercion, no float round (exact .5 cases round
+# half-up instead of float round's half-even).
+_REFERRAL_BPS = int(round(float(REFERRAL_PERCENT) * 100))
+
+
+def _referral_bonus(base: int) -> int:
+    return (base * _REFERRAL_BPS + 5000) // 10000
+
+
+def _parse_page(data: "str | list[str]", idx: int = 2) -> int:
+    """Parse the page token out of callback data; bad/missing tokens -> 0.
+
+    Accepts either the raw callback string or an already-split token list so
+    callers that split for other fields don't pay a second split.
+    """
+    parts = data.split(":") if isinstance(data, str) else data
+    try:
+        return max(0, int(parts[idx]))
+    except (IndexError, ValueError):
+        return 0
+
+
+# Background tasks are kept referenced until done so the event loop can't
+# garbage-collect them mid-flight.
+_BG_TASKS: set[asyncio.Task] = set()
+
+
+def _spawn_bg(coro) -> None:
+    """Run a coroutine in the background (fire-and-forget)."""
+    task = asyncio.create_task(coro)
+    _BG_TASKS.add(task)
+    task.add_done_callback(_BG_TASKS.discard)
+
+
+def _notify_bg(bot, **send_kwargs) -> None:
+    """Send a user notification without blocking the handler on the HTTPS
+    round-trip. Failures are swallowed, same as the previous inline sends."""
+
+    async def _send() -> None:
+        try:
+            await bot.send_message(**send_kwargs)
+        except Exception:
+            pass
+
+    _spawn_bg(_send())
+
+
+def _reply_bg(message, text: str, **reply_kwargs) -> None:
+    """reply_text without holding the handler open for the Telegram round-trip.
+
+    Used for prompts and confirmations nothing downstream depends on; the
+    user's own typing latency dwarfs the send, so ordering is preserved.
+    """
+
+    async def _send() -> None:
+        try:
+            await message.reply_text(text, **reply_kwargs)
+        except Exception:
+            pass
+
+    _spawn_bg(_send())
+
+
+# Deposit totals barely move between page flips, so they get their own short
+# TTL: rapid pagination reuses the cached numbers and deposits_overview skips
+# the totals facet's collection scan. [expires_at, totals]
+_DEP_TOTALS_CACHE: list = [0.0, None]
+_DEP_TOTALS_TTL = 5.0
+
+
+def _invalidate_dep_totals() -> None:
+    _DEP_TOTALS_CACHE[0] = 0.0
+
+
+# Frozen at import so the hot admin check is a single hash lookup instead of
+# rebuilding a set on every callback.
+_ADMIN_IDS: frozenset[int] = frozenset(int(x) for x in ADMIN_USER_IDS)
+
+
+def is_admin(user_id: int) -> bool:
+    return int(user_id) in _ADMIN_IDS
+
+
+# Thin alias kept for call-site brevity; binding the class directly skips a
+# wrapper frame per keyboard build.
+kb = InlineKeyboardMarkup
+
+
+@dataclass(slots=True)
+class AdminFlowState:
+    """State for one admin's guided text flow.
+
+    Slotted so each step read is a fixed-offset attribute load instead of a
+    dict hash lookup, and the per-admin footprint stays small. bot.py keeps
+    plain dicts in the same STATE map for user flows, so get() provides a
+    dict-compatible read for guard sites shared across modules.
+    """
+
+    flow: str
+    step: str
+    mode: str | None = None
+    account_id: str | None = None
+    field: str | None = None
+    dep_id: str | None = None
+    api_id: int | None = None
+    api_hash: str | None = None
+    phone_e164: str | None = None
+    phone: str | None = None
+    year: Any = None
+    premium_months: int | None = None
+    price: int | None = None
+    country: str | None = None
+    country_emoji: str | None = None
+    twofa_password: str | None = None
+    ui_chat_id: int | None = None
+    ui_message_id: int | None = None
+    target_user: int | None = None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+
+# Static keyboards below never change after import, so build each button tree
+# once instead of re-allocating it on every admin click.
+_CANCEL_REPLY_KB = ReplyKeyboardMarkup([[KeyboardButton("Cancel")]], resize_keyboard=True)
+
+
+def cancel_reply_kb() -> ReplyKeyboardMarkup:
+    # bottom keyboard for admin text flows
+    return _CANCEL_REPLY_KB
+
+
+async def restore_main_reply_menu(message) -> None:
+    """Ensure the normal bottom reply keyboard is visible (after back navigation).
+
+    Telegram only applies ReplyKeyboardMarkup when sending a message, so we send
+    a zero-width character to keep it visually silent.
+    """
+    try:
+        await message.reply_text("\u200b", reply_markup=main_reply_menu(True))
+    except Exception:
+        return
+
+
+def _build_main_reply_menu(is_admin_user: bool) -> ReplyKeyboardMarkup:
+    rows = [
+        [KeyboardButton("🛒 Buy"), KeyboardButton("💳 Deposit")],
+        [KeyboardButton("💰 Balance"), KeyboardButton("📜 History")],
+        [KeyboardButton("🆘 Support")],
+    ]
+    if is_admin_user:
+        rows.append([KeyboardButton("🛠 Admin")])
+
+    return ReplyKeyboardMarkup(rows, resize_keyboard=True, is_persistent=True, selective=False)
+
+
+_MAIN_REPLY_MENU_USER = _build_main_reply_menu(False)
+_MAIN_REPLY_MENU_ADMIN = _build_main_reply_menu(True)
+
+
+def main_reply_menu(is_admin_user: bool = True) -> ReplyKeyboardMarkup:
+    # Restore the normal bottom menu after cancelling admin flows
+    return _MAIN_REPLY_MENU_ADMIN if is_admin_user else _MAIN_REPLY_MENU_USER
+
+
+# Most rows: 3 buttons per row (clean grid)
+# Last row: Stats + Menu (2 per row)
+_ADMIN_MENU_KB = kb(
+    [
+        [
+            InlineKeyboardButton("➕ Add Account", callback_data="admin:addaccount"),
+            InlineKeyboardButton("👤 Credits", callback_data="admin:credits"),
+            InlineKeyboardButton("📦 Accounts", callback_data="admin:accounts"),
+        ],
+        [
+            InlineKeyboardButton("💳 Deposits", callback_data="admin:deposits"),
+            InlineKeyboardButton("💰 Active Credits", callback_data="admin:activecredits:0"),
+        ],
+        [
+            InlineKeyboardButton("💠 QRs", callback_data="admin:qrs"),
+            InlineKeyboardButton("🎁 Referrals", callback_data="admin:referrals:0"),
+            InlineKeyboardButton("🏷️ Bulk Discount", callback_data="admin:bulkdiscount"),
+        ],
+        [
+            InlineKeyboardButton("🚫 Ban System", callback_data="admin:banmenu"),
+            InlineKeyboardButton("📊 Stats", callback_data="admin:stats"),
+            InlineKeyboardButton("🏠 Menu", callback_data="menu:home"),
+        ],
+    ]
+)
+
+
+def admin_menu_keyboard() -> InlineKeyboardMarkup:
+    return _ADMIN_MENU_KB
+
+
+_ACCOUNTS_MENU_KB = kb(
+    [
+        [
+            InlineKeyboardButton("✅ Available Accounts", callback_data="admin:accounts:available:0"),
+            InlineKeyboardButton("💸 Sold Accounts", callback_data="admin:accounts:sold:0"),
+        ],
+        [InlineKeyboardButton("⬅️ Back", callback_data="admin:menu")],
+    ]
+)
+
+
+def accounts_menu_keyboard() -> InlineKeyboardMarkup:
+    return _ACCOUNTS_MENU_KB
+
+
+# Hot row template for the accounts list; bound once so the per-row loop does
+# a single formatting call instead of rebuilding the f-string pieces.
+_ACCOUNT_ROW_FMT = "{emoji}+{phone} | {country} | {year} | {status}{sold_to} | {price_txt}".format
+
+
+def _account_row_label(a: dict) -> str:
+    get = a.get
+    status = "sold" if get("status") == "assigned" else get("status")
+    sold_to = ""
+    if status == "sold":
+        su = (get("sold_to_username") or "").strip()
+        sid = get("sold_to_user_id") or get("assigned_to")
+        sold_to = f" -> @{su}" if su else (f" -> {sid}" if sid else "")
+
+    price = get("price")
+    return _ACCOUNT_ROW_FMT(
+        emoji=get("country_emoji") or "",
+        phone=get("phone"),
+        country=get("country") or "",
+        year=get("year"),
+        status=status,
+        sold_to=sold_to,
+        price_txt=f"{price}c" if price is not None else "default",
+    )
+
+
+def accounts_list_keyboard(
+    accounts: list[dict],
+    *,
+    filter_key: str,
+    page: int,
+    has_prev: bool,
+    has_next: bool,
+) -> InlineKeyboardMarkup:
+    rows: list[list[InlineKeyboardButton]] = []
+
+    # list items
+    for a in accounts:
+        rows.append(
+            [
+                InlineKeyboardButton(
+                    _account_row_label(a),
+                    callback_data=f"admin:account:view:{a.get('_id')}",
+                )
+            ]
+        )
+
+    # pagination
+    nav: list[InlineKeyboardButton] = []
+    if has_prev:
+        nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"admin:accounts:{filter_key}:{page-1}"))
+    if has_next:
+        nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"admin:accounts:{filter_key}:{page+1}"))
+    if nav:
+        rows.append(nav)
+
+    rows.append(_BACK_TO_ACCOUNTS_ROW)
+    return kb(rows)
+
+
+@functools.lru_cache(maxsize=256)
+def account_detail_keyboard(account_id: str) -> InlineKeyboardMarkup:
+    return kb(
+        [
+            [
+                InlineKeyboardButton("✏️ Edit", callback_data=f"admin:account:edit:{account_id}"),
+                InlineKeyboardButton("🗑 Delete", callback_data=f"admin:account:delete:{account_id}"),
+            ],
+            [
+                InlineKeyboardButton("🛠️ Manage Devices", callback_data=f"dev:menu:{account_id}"),
+                InlineKeyboardButton("📱 Get OTP", callback_data=f"admin:account:getotp:{account_id}"),
+            ],
+            [InlineKeyboardButton("⬅️ Back", callback_data="admin:accounts")],
+        ]
+    )
+
+
+@functools.lru_cache(maxsize=256)
+def account_delete_confirm_keyboard(account_id: str) -> InlineKeyboardMarkup:
+    return kb(
+        [
+            [InlineKeyboardButton("✅ Yes, delete", callback_data=f"admin:account:delete_confirm:{account_id}")],
+            [InlineKeyboardButton("❌ Cancel", callback_data=f"admin:account:view:{account_id}")],
+        ]
+    )
+
+
+@functools.lru_cache(maxsize=256)
+def _getotp_keyboard(account_id: str) -> InlineKeyboardMarkup:
+    return kb(
+        [
+            [InlineKeyboardButton("🔄 Retry OTP", callback_data=f"admin:account:getotp:{account_id}")],
+            [InlineKeyboardButton("⬅️ Back", callback_data=f"admin:account:view:{account_id}")],
+        ]
+    )
+
+
+@functools.lru_cache(maxsize=256)
+def _dep_action_keyboard(dep_id: str, is_crypto: bool) -> InlineKeyboardMarkup:
+    approve_btn = (
+        InlineKeyboardButton("✅ Set Credits & Approve", callback_data=f"admin:dep:setcredits:{dep_id}")
+        if is_crypto
+        else InlineKeyboardButton("✅ Approve", callback_data=f"admin:dep:approve:{dep_id}")
+    )
+    return kb(
+        [
+            [
+                approve_btn,
+                InlineKeyboardButton("❌ Reject", callback_data=f"admin:dep:reject:{dep_id}"),
+            ],
+            [InlineKeyboardButton("⬅️ Back", callback_data="admin:deposits")],
+        ]
+    )
+
+
+@functools.lru_cache(maxsize=4)
+def active_credits_keyboard(has_prev: bool, has_next: bool) -> InlineKeyboardMarkup:
+    # Keyset pagination: buttons carry a direction, the anchor lives in
+    # bot_data, so all four variants of this keyboard are cacheable.
+    nav: list[InlineKeyboardButton] = []
+    if has_prev:
+        nav.append(InlineKeyboardButton("⬅️ Prev", callback_data="admin:activecredits:prev"))
+    if has_next:
+        nav.append(InlineKeyboardButton("Next ➡️", callback_data="admin:activecredits:next"))
+
+    rows: list[list[InlineKeyboardButton]] = []
+    if nav:
+        rows.append(nav)
+    rows.append(_BACK_TO_MENU_ROW)
+    return kb(rows)
+
+
+# Sessions helper functions removed
+
+
+# ----------------------------
+# admin:* callback handlers
+#
+# handle_admin_callback dispatches on the second token of the callback data
+# (admin:<section>:...) via _CALLBACK_DISPATCH below, so each press costs one
+# dict lookup instead of walking a chain of prefix comparisons. All handlers
+# share the same signature and return True when the callback is consumed.
+# ----------------------------
+
+
+async def _cb_menu(query, context: ContextTypes.DEFAULT_TYPE, repo: Repo, state: Dict[int, Any], uid: int, data: str) -> bool:
+    if data == "admin:menu":
+        await safe_edit(query.message, "🛠 Admin Panel", reply_markup=admin_menu_keyboard(), parse_mode=None)
+        return True
+    return True
+
+
+async def _cb_addaccount(query, context: ContextTypes.DEFAULT_TYPE, repo: Repo, state: Dict[int, Any], uid: int, data: str) -> bool:
+    if data == "admin:addaccount":
+        # Use fixed API creds; ask only for phone
+        state[uid] = AdminFlowState(flow="admin_add_account", step="phone", api_id=TELEGRAM_API_ID, api_hash=TELEGRAM_API_HASH)
+        await query.message.reply_text(
+            "➕ Add Account\n\nSend phone with + (example: +923001234567):",
+            reply_markup=cancel_reply_kb(),
+        )
+        return True
+
+    if data in {"admin:addaccount:cc:us", "admin:addaccount:cc:ca"}:
+        _spawn_bg(query.answer(cache_time=0))
+        st = state.get(uid) or {}
+        if st.get("flow") != "admin_add_account" or st.get("step") != "pick_usca":
+            return True
+        if data.endswith(":us"):
+            st.country = "US"
+            st.country_emoji = "🇺🇸"
+        else:
+            st.country = "CA"
+            st.country_emoji = "🇨🇦"
+        st.step = "year"
+        state[uid] = st
+        await query.message.reply_text("Send account year (example 2023) or type 'skip':")
+        return True
+    return True
+
+
+async def _cb_credits(query, context: ContextTypes.DEFAULT_TYPE, repo: Repo, state: Dict[int, Any], uid: int, data: str) -> bool:
+    if data == "admin:credits":
+        _spawn_bg(query.answer(cache_time=0))
+        await safe_edit(
+            query.message,
+            "👤 *Credits Manager*\n\nChoose action:",
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=kb(
+                [
+                    [
+                        InlineKeyboardButton("➕ Add", callback_data="admin:credits:add"),
+                        InlineKeyboardButton("➖ Remove", callback_data="admin:credits:remove"),
+                    ],
+                    [InlineKeyboardButton("⬅️ Back", callback_data="admin:menu")],
+                ]
+            ),
+        )
+        return True
+
+    if data in {"admin:credits:add", "admin:credits:remove"}:
+        _spawn_bg(query.answer(cache_time=0))
+        mode = "add" if data.endswith(":add") else "remove"
+        # Store UI message for inline updates and prompt for input
+        state[uid] = AdminFlowState(
+            flow="admin_credits_inline",
+            step="input",
+            mode=mode,
+            ui_chat_id=query.message.chat_id,
+            ui_message_id=query.message.message_id,
+        )
+        await safe_edit(
+            query.message,
+            f"👤 *Credits ({mode})*\n\nSend in one line:\n`<user_id> <amount>`\n\nOr press Cancel.",
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=kb([[InlineKeyboardButton("⬅️ Back", callback_data="admin:credits")]]),
+        )
+        # show bottom cancel keyboard too
+        await query.message.reply_text("Press Cancel to stop.", reply_markup=cancel_reply_kb())
+        return True
+    return True
+
+
+async def _cb_accounts(query, context: ContextTypes.DEFAULT_TYPE, repo: Repo, state: Dict[int, Any], uid: int, data: str) -> bool:
+    if data == "admin:accounts":
+        _spawn_bg(query.answer(cache_time=0))
+        await safe_edit(query.message, "📦 Accounts\n\nChoose list:", reply_markup=accounts_menu_keyboard(), parse_mode=None)
+        return True
+
+    if data.startswith("admin:accounts:"):
+        # admin:accounts:<available|sold>:<page>
+        _spawn_bg(query.answer(cache_time=0))
+        parts = data.split(":")
+        filter_key = parts[2] if len(parts) > 2 else "available"
+        page = _parse_page(parts, 3)
+
+        status = "available" if filter_key == "available" else "assigned"  # sold
+        page_size = 5
+
+        # Fetch one extra row instead of running a count per click: its
+        # presence alone answers has_next, so pagination costs one find.
+        accounts = await repo.list_accounts_page(status=status, page=page, page_size=page_size, limit=page_size + 1)
+        if not accounts and page > 0:
+            # stale Next click past the end (rows deleted/sold meanwhile)
+            page = 0
+            accounts = await repo.list_accounts_page(status=status, page=0, page_size=page_size, limit=page_size + 1)
+        has_next = len(accounts) > page_size
+        accounts = accounts[:page_size]
+        has_prev = page > 0
+
+        title = "✅ Available Accounts" if filter_key == "available" else "💸 Sold Accounts"
+        header = f"{title}\n\nPage: {page+1}"
+
+        if not accounts:
+            await safe_edit(
+                query.message,
+                header + "\n\nNo accounts found.",
+                reply_markup=accounts_list_keyboard([], filter_key=filter_key, page=page, has_prev=False, has_next=False),
+                parse_mode=None,
+            )
+            return True
+
+        await safe_edit(
+            query.message,
+            header + "\n\nSelect an account:",
+            reply_markup=accounts_list_keyboard(accounts, filter_key=filter_key, page=page, has_prev=has_prev, has_next=has_next),
+            parse_mode=None,
+        )
+        return True
+    return True
+
+
+async def _cb_bulkdiscount(query, context: ContextTypes.DEFAULT_TYPE, repo: Repo, state: Dict[int, Any], uid: int, data: str) -> bool:
+    if data == "admin:bulkdiscount":
+        _spawn_bg(query.answer(cache_time=0))
+        st = await repo.get_bulk_discount()
+        enabled = bool(st.get("enabled"))
+        percent = int(st.get("percent", 0) or 0)
+        status_txt = "ON ✅" if enabled else "OFF ❌"
+        text = (
+            "🏷️ Bulk Price Discount\n\n"
+            f"Status: {status_txt}\n"
+            f"Discount: {percent}%\n\n"
+            "Applies to ALL available accounts.\n"
+            "Use Set % to change discount amount."
+        )
+        await safe_edit(
+            query.message,
+            text,
+            parse_mode=None,
+            reply_markup=kb(
+                [
+                    [InlineKeyboardButton("✏️ Set %", callback_data="admin:bulkdiscount:set")],
+                    [
+                        InlineKeyboardButton(
+                            "⛔ Turn OFF" if enabled else "✅ Turn ON",
+                            callback_data="admin:bulkdiscount:off" if enabled else "admin:bulkdiscount:on",
+                        )
+                    ],
+                    [InlineKeyboardButton("⬅️ Back", callback_data="admin:menu")],
+                ]
+            ),
+        )
+        return True
+
+    if data == "admin:bulkdiscount:on":
+        _spawn_bg(query.answer(cache_time=0))
+        st = await repo.get_bulk_discount()
+        percent = int(st.get("percent", 0) or 0)
+        await repo.apply_bulk_discount(percent=percent)
+        await query.answer("✅ Discount turned ON", show_alert=True)
+
+        # Re-render screen (like QRs toggle)
+        st2 = await repo.get_bulk_discount()
+        enabled2 = bool(st2.get("enabled"))
+        percent2 = int(st2.get("percent", 0) or 0)
+        status_txt2 = "ON ✅" if enabled2 else "OFF ❌"
+        text2 = (
+            "🏷️ Bulk Price Discount\n\n"
+            f"Status: {status_txt2}\n"
+            f"Discount: {percent2}%\n\n"
+            "Applies to ALL available accounts.\n"
+            "Use Set % to change discount amount."
+        )
+        await safe_edit(
+            query.message,
+            text2,
+            parse_mode=None,
+            reply_markup=kb(
+                [
+                    [InlineKeyboardButton("✏️ Set %", callback_data="admin:bulkdiscount:set")],
+                    [
+                        InlineKeyboardButton(
+                            "⛔ Turn OFF" if enabled2 else "✅ Turn ON",
+                            callback_data="admin:bulkdiscount:off" if enabled2 else "admin:bulkdiscount:on",
+                        )
+                    ],
+                    [InlineKeyboardButton("⬅️ Back", callback_data="admin:menu")],
+                ]
+            ),
+        )
+        return True
+
+    if data == "admin:bulkdiscount:off":
+        _spawn_bg(query.answer(cache_time=0))
+        await repo.disable_bulk_discount()
+        await query.answer("⛔ Discount turned OFF", show_alert=True)
+
+        # Re-render screen (like QRs toggle)
+        st2 = await repo.get_bulk_discount()
+        enabled2 = bool(st2.get("enabled"))
+        percent2 = int(st2.get("percent", 0) or 0)
+        status_txt2 = "ON ✅" if enabled2 else "OFF ❌"
+        text2 = (
+            "🏷️ Bulk Price Discount\n\n"
+            f"Status: {status_txt2}\n"
+            f"Discount: {percent2}%\n\n"
+            "Applies to ALL available accounts.\n"
+            "Use Set % to change discount amount."
+        )
+        await safe_edit(
+            query.message,
+            text2,
+            parse_mode=None,
+            reply_markup=kb(
+                [
+                    [InlineKeyboardButton("✏️ Set %", callback_data="admin:bulkdiscount:set")],
+                    [
+                        InlineKeyboardButton(
+                            "⛔ Turn OFF" if enabled2 else "✅ Turn ON",
+                            callback_data="admin:bulkdiscount:off" if enabled2 else "admin:bulkdiscount:on",
+                        )
+                    ],
+                    [InlineKeyboardButton("⬅️ Back", callback_data="admin:menu")],
+                ]
+            ),
+        )
+        return True
+
+    if data == "admin:bulkdiscount:set":
+        _spawn_bg(query.answer(cache_time=0))
+        state[uid] = AdminFlowState(flow="admin_bulkdiscount", step="percent")
+        await query.message.reply_text(
+            "🏷️ Bulk Price Discount\n\nSend discount percent (0-95).\nExample: 20\n\nType Cancel to stop.",
+            reply_markup=cancel_reply_kb(),
+        )
+        return True
+    return True
+
+
+@functools.lru_cache(maxsize=8)
+def _qrs_view(qr1: bool, qr2: bool, crypto: bool) -> tuple[str, InlineKeyboardMarkup]:
+    """Rendered text + keyboard for the payment settings screen.
+
+    Only 8 flag combinations exist, so each view is built exactly once.
+    """
+    qr1_txt = "ON ✅" if qr1 else "OFF ❌"
+    qr2_txt = "ON ✅" if qr2 else "OFF ❌"
+    crypto_txt = "ON ✅" if crypto else "OFF ❌"
+    text = f"💠 Payment Settings\n\nQR 1: {qr1_txt}\nQR 2: {qr2_txt}\n\nCrypto: {crypto_txt}"
+    markup = kb(
+        [
+            [
+                InlineKeyboardButton("Toggle QR 1", callback_data="admin:qrs:toggle:qr1"),
+                InlineKeyboardButton("Toggle QR 2", callback_data="admin:qrs:toggle:qr2"),
+            ],
+            [InlineKeyboardButton("Toggle Crypto", callback_data="admin:qrs:toggle:crypto")],
+            [InlineKeyboardButton("⬅️ Back", callback_data="admin:menu")],
+        ]
+    )
+    return text, markup
+
+
+async def _cb_qrs(query, context: ContextTypes.DEFAULT_TYPE, repo: Repo, state: Dict[int, Any], uid: int, data: str) -> bool:
+    if data == "admin:qrs":
+        _spawn_bg(query.answer(cache_time=0))
+        flags = await repo.get_inr_qr_flags()
+        crypto_enabled = await repo.get_crypto_enabled()
+        text, markup = _qrs_view(bool(flags.get("qr1")), bool(flags.get("qr2")), bool(crypto_enabled))
+        await safe_edit(query.message, text, parse_mode=None, reply_markup=markup)
+        return True
+
+    if data.startswith("admin:qrs:toggle:"):
+        _spawn_bg(query.answer(cache_time=0))
+        qr_key = data.split(":", 3)[3]
+        if qr_key == "crypto":
+            crypto_enabled = not await repo.get_crypto_enabled()
+            await repo.set_crypto_enabled(enabled=crypto_enabled)
+            flags = await repo.get_inr_qr_flags()
+        else:
+            # single atomic invert instead of read+write+reread, overlapped
+            # with the crypto flag fetch
+            flags, crypto_enabled = await asyncio.gather(
+                repo.toggle_inr_qr_flag(qr_key=qr_key),
+                repo.get_crypto_enabled(),
+            )
+        text, markup = _qrs_view(bool(flags.get("qr1")), bool(flags.get("qr2")), bool(crypto_enabled))
+        await safe_edit(query.message, text, parse_mode=None, reply_markup=markup)
+        return True
+    return True
+
+
+async def _cb_banmenu(query, context: ContextTypes.DEFAULT_TYPE, repo: Repo, state: Dict[int, Any], uid: int, data: str) -> bool:
+    if data == "admin:banmenu":
+        _spawn_bg(query.answer(cache_time=0))
+        await safe_edit(
+            query.message,
+            "🚫 Ban System\n\nChoose action:",
+            parse_mode=None,
+            reply_markup=kb(
+                [
+                    [
+                        InlineKeyboardButton("🚫 Ban", callback_data="admin:banmenu:ban"),
+                        InlineKeyboardButton("✅ Unban", callback_data="admin:banmenu:unban"),
+                    ],
+                    [InlineKeyboardButton("📋 Check Ban List", callback_data="admin:banlist:0")],
+                    [
+                    ],
+                    [InlineKeyboardButton("⬅️ Back", callback_data="admin:menu")],
+                ]
+            ),
+        )
+        return True
+
+    if data in {"admin:banmenu:ban", "admin:banmenu:unban"}:
+        _spawn_bg(query.answer(cache_time=0))
+        mode = "ban" if data.endswith(":ban") else "unban"
+        state[uid] = AdminFlowState(flow="admin_ban", step="input", mode=mode)
+        await query.message.reply_text(
+            f"🚫 Ban System ({mode})\n\nSend user id:\nExample: 6670166083\n\nType Cancel to stop.",
+            reply_markup=cancel_reply_kb(),
+        )
+        return True
+    return True
+
+
+async def _cb_banlist(query, context: ContextTypes.DEFAULT_TYPE, repo: Repo, state: Dict[int, Any], uid: int, data: str) -> bool:
+    if data.startswith("admin:banlist:"):
+        _spawn_bg(query.answer(cache_time=0))
+        page = _parse_page(data)
+        db = repo.db
+        page_size = 5
+        # Unfiltered count: metadata read instead of a collection scan.
+        total = await db.banned_users.estimated_document_count()
+        max_page = max(0, (total - 1) // page_size) if total else 0
+        if page > max_page:
+            page = max_page
+
+        cur = (
+            db.banned_users.find({}, {"user_id": 1, "username": 1})
+            .sort("created_at", -1)
+            .skip(page * page_size)
+            .limit(page_size)
+        )
+        # Stream rows straight into the rendered lines (no intermediate list).
+        lines: list[str] = ["🚫 Banned Users", ""]
+        async for it in cur:
+            uid2 = it.get("user_id")
+            un = (it.get("username") or "").strip()
+            uline = f"@{un}" if un else "N/A"
+            lines.append(f"• {uid2} | {uline}")
+        if len(lines) == 2:
+            lines.append("No banned users.")
+
+        nav: list[list[InlineKeyboardButton]] = []
+        btns: list[InlineKeyboardButton] = []
+        if page > 0:
+            btns.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"admin:banlist:{page-1}"))
+        if page < max_page:
+            btns.append(InlineKeyboardButton("Next ➡️", callback_data=f"admin:banlist:{page+1}"))
+        if btns:
+            nav.append(btns)
+        nav.append([InlineKeyboardButton("⬅️ Back", callback_data="admin:banmenu")])
+
+        await safe_edit(query.message, "\n".join(lines), parse_mode=None, reply_markup=kb(nav))
+        return True
+    return True
+
+
+# (Edit Tokens removed)
+
+
+async def _cb_referrals(query, context: ContextTypes.DEFAULT_TYPE, repo: Repo, state: Dict[int, Any], uid: int, data: str) -> bool:
+    if data.startswith("admin:referrals:"):
+        _spawn_bg(query.answer(cache_time=0))
+        page = _parse_page(data)
+
+        db = repo.db
+        page_size = 10
+
+        # Single round-trip: page rows + total referrer count + per-referrer
+        # earnings ($lookup on users) instead of distinct() + N find_one calls.
+        pipeline = [
+            {"$group": {"_id": "$referrer_user_id", "count": {"$sum": 1}, "username": {"$first": "$referrer_username"}}},
+            {
+                "$facet": {
+                    "rows": [
+                        {"$sort": {"count": -1}},
+                        {"$skip": page * page_size},
+                        {"$limit": page_size},
+                        {
+                            # pipeline form so only the one rendered field
+                            # crosses the wire, not whole user documents
+                            "$lookup": {
+                                "from": "users",
+                                "let": {"rid": "$_id"},
+                                "pipeline": [
+                                    {"$match": {"$expr": {"$eq": ["$user_id", "$$rid"]}}},
+                                    {"$project": {"ref_earned_total": 1, "_id": 0}},
+                                ],
+                                "as": "u",
+                            }
+                        },
+                        {"$set": {"earned": {"$ifNull": [{"$arrayElemAt": ["$u.ref_earned_total", 0]}, 0]}}},
+                    ],
+                    "total": [{"$count": "n"}],
+                }
+            },
+        ]
+
+        facet: dict[str, Any] = {}
+        async for r in db.referrals.aggregate(pipeline):
+            facet = r
+            break
+        rows = facet.get("rows") or []
+        total_rows = facet.get("total") or []
+        total = int((total_rows[0] or {}).get("n", 0)) if total_rows else 0
+        max_page = max(0, (total - 1) // page_size) if total else 0
+
+        lines: list[str] = ["🎁 Referrals (Top referrers)", ""]
+        if not rows:
+            lines.append("No referrals yet.")
+        else:
+            for r in rows:
+                rid = int(r.get("_id") or 0)
+                uname = (r.get("username") or "").strip()
+                ref_count = int(r.get("count") or 0)
+                earned = float(r.get("earned") or 0.0)
+                uline = f"@{uname}" if uname else "N/A"
+                lines.append(f"• {rid} | {uline} | refs: {ref_count} | earned: ₹{earned:.2f}")
+
+        nav: list[list[InlineKeyboardButton]] = []
+        btns: list[InlineKeyboardButton] = []
+        if page > 0:
+            btns.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"admin:referrals:{page-1}"))
+        if page < max_page:
+            btns.append(InlineKeyboardButton("Next ➡️", callback_data=f"admin:referrals:{page+1}"))
+        if btns:
+            nav.append(btns)
+        nav.append([InlineKeyboardButton("⬅️ Back", callback_data="admin:menu")])
+
+        await safe_edit(query.message, "\n".join(lines), parse_mode=None, reply_markup=kb(nav))
+        return True
+    return True
+
+
+async def _cb_activecredits(query, context: ContextTypes.DEFAULT_TYPE, repo: Repo, state: Dict[int, Any], uid: int, data: str) -> bool:
+    if data.startswith("admin:activecredits"):
+        # admin:activecredits:<0|next|prev> - keyset pagination on
+        # (credits desc, _id asc): each page is a bounded range scan instead
+        # of a skip that walks every preceding document, so deep pages cost
+        # the same as page one and no count query is needed.
+        _spawn_bg(query.answer(cache_time=0))
+
+        db = repo.db
+        page_size = 15
+
+        cursors: Dict[int, dict] = context.application.bot_data.setdefault("active_credits_cursors", {})
+        cur = cursors.get(uid)
+        action = data.rsplit(":", 1)[-1]
+        if action == "next" and cur and cur.get("last"):
+            cur["anchors"].append(cur["last"])
+        elif action == "prev" and cur and len(cur["anchors"]) > 1:
+            cur["anchors"].pop()
+        elif action not in {"next", "prev"} or cur is None:
+            # fresh open (or stale buttons after a restart): start over
+            cur = {"anchors": [None], "last": None}
+            cursors[uid] = cur
+
+        anchor = cur["anchors"][-1]
+        q: dict[str, Any] = {"credits": {"$gt": 0}}
+        if anchor is not None:
+            last_credits, last_id = anchor
+            q["$or"] = [
+                {"credits": {"$lt": last_credits}},
+                {"credits": last_credits, "_id": {"$gt": last_id}},
+            ]
+
+        users = await (
+            db.users.find(q, {"user_id": 1, "username": 1, "credits": 1})
+            .sort([("credits", -1), ("_id", 1)])
+            .limit(page_size + 1)
+            .to_list(page_size + 1)
+        )
+        has_next = len(users) > page_size
+        users = users[:page_size]
+        page = len(cur["anchors"])  # 1-based; depth of the anchor stack
+        cur["last"] = (int(users[-1].get("credits", 0)), users[-1]["_id"]) if users else None
+
+        lines: list[str] = [
+            "💰 Active Credits",
+            "",
+            f"Page: {page}",
+            "",
+        ]
+
+        if not users:
+            lines.append("No users with credits > 0.")
+        else:
+            # Fallback for older records: read last known username from deposits.
+            # Batched into one aggregation instead of one find_one per row (N+1).
+            missing = [int(u["user_id"]) for u in users if u.get("user_id") and not (u.get("username") or "").strip()]
+            dep_usernames: dict[int, str] = {}
+            if missing:
+                pipeline = [
+                    {"$match": {"user_id": {"$in": missing}}},
+                    {"$sort": {"created_at": -1}},
+                    {"$group": {"_id": "$user_id", "username": {"$first": "$username"}}},
+                ]
+                async for row in db.deposits.aggregate(pipeline):
+                    dep_usernames[int(row["_id"])] = (row.get("username") or "").strip()
+
+            for u in users:
+                uid2 = u.get("user_id") or u.get("_id")
+                username = (u.get("username") or "").strip()
+                if not username and uid2:
+                    username = dep_usernames.get(int(uid2), "")
+                credits = u.get("credits", 0)
+                uname = f"@{username}" if username else "N/A"
+                lines.append(f"• {uid2} | {uname} | credits: {credits}")
+
+        await safe_edit(
+            query.message,
+            "\n".join(lines),
+            parse_mode=None,
+            reply_markup=active_credits_keyboard(page > 1, has_next),
+        )
+        return True
+    return True
+
+
+async def _cb_stats(query, context: ContextTypes.DEFAULT_TYPE, repo: Repo, state: Dict[int, Any], uid: int, data: str) -> bool:
+    if data == "admin:stats":
+        _spawn_bg(query.answer(cache_time=0))
+        db = repo.db
+        # One grouped scan over accounts instead of three separate counts,
+        # overlapped with the users count: four round-trips become two in
+        # max(RTT) wall time. The unfiltered users total comes from collection
+        # metadata rather than a scan; slight staleness is fine on a dashboard.
+        total_users, status_rows = await asyncio.gather(
+            db.users.estimated_document_count(),
+            db.accounts.aggregate([{"$group": {"_id": "$status", "n": {"$sum": 1}}}]).to_list(None),
+        )
+        by_status = {r.get("_id"): int(r.get("n", 0)) for r in status_rows}
+        total_accounts = sum(by_status.values())
+        available = by_status.get("available", 0)
+        sold = by_status.get("assigned", 0)
+
+        text = (
+            "📊 *Statistics*\n\n"
+            f"👥 Users: *{total_users}*\n"
+            f"📦 Accounts: *{total_accounts}*\n"
+            f"✅ Available: *{available}*\n"
+            f"💸 Sold: *{sold}*\n"
+        )
+
+        await safe_edit(query.message, text, parse_mode=ParseMode.MARKDOWN, reply_markup=kb([[InlineKeyboardButton("⬅️ Back", callback_data="admin:menu")]]))
+        return True
+    return True
+
+
+# Status icon lookup for deposit rows (dict probe beats chained ternaries).
+_DEP_STATUS_ICONS = {"pending": "🟡", "approved": "🟢"}
+
+# Projections for the detail views: only the fields the templates actually
+# read, so the driver doesn't decode session strings / full notify history.
+_ACCOUNT_VIEW_FIELDS = {
+    "phone": 1,
+    "country": 1,
+    "country_emoji": 1,
+    "year": 1,
+    "status": 1,
+    "sold_to_username": 1,
+    "sold_to_user_id": 1,
+    "assigned_to": 1,
+    "price": 1,
+    "twofa_password": 1,
+}
+_DEP_VIEW_FIELDS = {
+    "status": 1,
+    "amount": 1,
+    "amount_text": 1,
+    "user_id": 1,
+    "username": 1,
+    "method": 1,
+    "network": 1,
+    "screenshot": 1,
+    "admin_notify": 1,
+}
+_DEP_DECIDE_FIELDS = {"status": 1, "amount": 1, "user_id": 1}
+
+
+async def _cb_deposits(query, context: ContextTypes.DEFAULT_TYPE, repo: Repo, state: Dict[int, Any], uid: int, data: str) -> bool:
+    if data == "admin:deposits":
+        # default view: pending page 0
+        data = "admin:deposits:pending:0"
+
+    if data.startswith("admin:deposits:"):
+        # admin:deposits:<filter>:<page>
+        parts = data.split(":")
+        filter_key = parts[2] if len(parts) > 2 else "pending"
+        page = _parse_page(parts, 3)
+
+        status = None
+        if filter_key == "pending":
+            status = "pending"
+        elif filter_key == "approved":
+            status = "approved"
+        else:
+            status = None  # all
+
+        # Totals, filtered count and page rows come back in one $facet query;
+        # recent totals are served from the TTL cache and skipped server-side.
+        page_size = 8
+        now = time.monotonic()
+        cached_totals = _DEP_TOTALS_CACHE[1] if _DEP_TOTALS_CACHE[0] > now else None
+        totals, total_rows, deps = await repo.deposits_overview(
+            status=status, page=page, page_size=page_size, include_totals=cached_totals is None
+        )
+        if totals is None:
+            totals = cached_totals or {}
+        else:
+            _DEP_TOTALS_CACHE[0] = now + _DEP_TOTALS_TTL
+            _DEP_TOTALS_CACHE[1] = totals
+        # hide rejected in UI
+        pending_count = totals.get("pending_count", 0)
+        pending_amount = totals.get("pending_amount", 0)
+        approved_count = totals.get("approved_count", 0)
+        approved_amount = totals.get("approved_amount", 0)
+        total_count = pending_count + approved_count
+        total_amount = pending_amount + approved_amount
+
+        max_page = max(0, (total_rows - 1) // page_size)
+        if page > max_page:
+            # Stale page token (rows shrank since the keyboard was built).
+            page = max_page
+            deps = await repo.list_deposits_page(status=status, page=page, page_size=page_size)
+
+        header = [
+            "💳 Deposits",
+            "",
+            f"🟡 Pending: {pending_count} (amount {pending_amount})",
+            f"🟢 Confirmed: {approved_count} (amount {approved_amount})",
+            f"⭐ Total: {total_count} (amount {total_amount})",
+            "",
+        ]
+
+        # Preallocated so the per-row loop is a single f-string + index store.
+        lines: list[str] = [""] * len(deps)
+        for i, d in enumerate(deps):
+            d_get = d.get
+            icon = _DEP_STATUS_ICONS.get(d_get("status"), "⚪")
+            lines[i] = f"{icon} {d_get('amount')} | {d_get('user_id')} @{d_get('username') or ''} | {d_get('_id')}"
+
+        has_prev = page > 0
+        has_next = page < max_page
+
+        # Extend in place: no third list materialized just to feed join.
+        header.extend(lines or ("No records.",))
+
+        # Use plain text to avoid Telegram Markdown parse errors from dynamic content.
+        await safe_edit(
+            query.message,
+            "\n".join(header),
+            reply_markup=deposits_keyboard(filter_key, page, has_prev, has_next, deps),
+            parse_mode=None,
+        )
+        return True
+    return True
+
+
+# ----------------------------
+# admin:account:* / admin:dep:* handlers
+#
+# These callbacks all have the shape admin:<section>:<action>:<id>, so the
+# dispatcher routes them through _ID_ROUTES keyed on the full prefix (one
+# rpartition + one dict lookup) and passes only the trailing id in.
+# ----------------------------
+
+
+async def _h_account_view(acc_id: str, query, context: ContextTypes.DEFAULT_TYPE, repo: Repo, state: Dict[int, Any], uid: int) -> bool:
+    # Stop OTP monitoring if this admin was monitoring this account
+    try:
+        account_manager: AccountManager = context.application.bot_data["account_manager"]
+        oid = _oid(acc_id)
+        if account_manager.get_admin_monitor(oid) == int(uid):
+            account_manager.stop_admin_monitor(oid)
+    except Exception:
+        pass
+
+    acc = await repo.get_account(_oid(acc_id), fields=_ACCOUNT_VIEW_FIELDS)
+    if not acc:
+        await query.answer("❌ Account not found.", show_alert=True)
+        return True
+
+    status = "sold" if acc.get("status") == "assigned" else acc.get("status")
+    emoji = acc.get("country_emoji") or ""
+    country = acc.get("country") or ""
+    year = acc.get("year")
+    price = acc.get("price")
+    twofa = acc.get("twofa_password")
+
+    sold_to_line = ""
+    if status == "sold":
+        su = (acc.get("sold_to_username") or "").strip()
+        sid = acc.get("sold_to_user_id") or acc.get("assigned_to")
+        if su:
+            sold_to_line = f"Sold to: *@{su}*\n"
+        elif sid:
+            sold_to_line = f"Sold to: *{sid}*\n"
+
+    text = (
+        "*Account Details*\n\n"
+        f"ID: `{acc_id}`\n"
+        f"Phone: `{emoji} +{acc.get('phone')}`\n"
+        f"Country: *{country}*\n"
+        f"Year: *{year if year is not None else '-'}*\n"
+        f"Status: *{status}*\n"
+        + sold_to_line
+        + f"Price: *{price if price is not None else 'default'}*\n"
+        + f"2FA: *{'set' if twofa else 'not set'}*\n"
+    )
+    await safe_edit(query.message, text, reply_markup=account_detail_keyboard(acc_id), parse_mode=ParseMode.MARKDOWN)
+    return True
+
+
+async def _h_account_delete(acc_id: str, query, context: ContextTypes.DEFAULT_TYPE, repo: Repo, state: Dict[int, Any], uid: int) -> bool:
+    await safe_edit(
+        query.message,
+        "⚠️ Delete this account? This cannot be undone.",
+        reply_markup=account_delete_confirm_keyboard(acc_id),
+        parse_mode=None,
+    )
+    return True
+
+
+async def _h_account_delete_confirm(acc_id: str, query, context: ContextTypes.DEFAULT_TYPE, repo: Repo, state: Dict[int, Any], uid: int) -> bool:
+    ok = await repo.delete_account(_oid(acc_id))
+    await safe_edit(query.message, "✅ Deleted." if ok else "Account not found.", reply_markup=None, parse_mode=None)
+    return True
+
+
+async def _h_account_edit(acc_id: str, query, context: ContextTypes.DEFAULT_TYPE, repo: Repo, state: Dict[int, Any], uid: int) -> bool:
+    state[uid] = AdminFlowState(flow="admin_edit_account", step="field", account_id=acc_id)
+    await query.message.reply_text(
+        "✏️ Edit Account\n\n"
+        "Type which field to edit: `country`, `emoji`, `year`, `twofa`, `price`\n"
+        "Or type `cancel`.",
+        parse_mode=ParseMode.MARKDOWN,
+    )
+    return True
+
+
+async def _h_account_getotp(acc_id_s: str, query, context: ContextTypes.DEFAULT_TYPE, repo: Repo, state: Dict[int, Any], uid: int) -> bool:
+    _spawn_bg(query.answer(cache_time=0))
+    try:
+        account_id = _oid(acc_id_s)
+    except Exception:
+        await query.answer("Invalid account ID.", show_alert=True)
+        return True
+
+    acc = await repo.get_account(account_id)
+    if not acc:
+        await query.answer("Account not found.", show_alert=True)
+        return True
+
+    phone = acc.get("phone") or ""
+    twofa = (acc.get("twofa_password") or "").strip()
+    twofa_line = f"\n🔒 2FA: `{twofa}`" if twofa else "\n🔒 2FA: Not set"
+
+    # Start monitoring (replace any existing monitor)
+    account_manager: AccountManager = context.application.bot_data["account_manager"]
+    account_manager.start_admin_monitor(account_id, uid)
+
+    # Ensure session connected (admin monitor mode: do NOT mark admin as buyer).
+    # A slow MTProto handshake must not pin the handler open-ended, so the
+    # connect gets a hard 8s budget.
+    try:
+        await asyncio.wait_for(
+            account_manager.ensure_connected_for_admin_monitor(account_id, acc), 8.0
+        )
+    except asyncio.TimeoutError:
+        await query.answer("Connect timed out, retry.", show_alert=True)
+        account_manager.stop_admin_monitor(account_id)
+        return True
+    except Exception as e:
+        await query.answer(f"Failed to connect session: {e}", show_alert=True)
+        account_manager.stop_admin_monitor(account_id)
+        return True
+
+    await safe_edit(
+        query.message,
+        f"📱 Get OTP\n\n"
+        f"Phone: +{phone}{twofa_line}\n\n"
+        f"✅ OTP forwarding started.\n"
+        f"I will forward any OTP received in this chat.",
+
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=_getotp_keyboard(acc_id_s),
+    )
+    return True
+
+
+async def _h_account_getotp_cancel(acc_id: str, query, context: ContextTypes.DEFAULT_TYPE, repo: Repo, state: Dict[int, Any], uid: int) -> bool:
+    # Cancel removed; use Retry button or Back (stops monitor automatically)
+    _spawn_bg(query.answer(cache_time=0))
+    return True
+
+
+async def _h_dep_view(dep_id: str, query, context: ContextTypes.DEFAULT_TYPE, repo: Repo, state: Dict[int, Any], uid: int) -> bool:
+    # Deposit details / resend screenshot
+    dep = await repo.get_deposit(dep_id, fields=_DEP_VIEW_FIELDS)
+    if not dep:
+        await query.answer("❌ Deposit not found.", show_alert=True)
+        return True
+
+    stt = dep.get("status")
+    method = (dep.get("method") or "").upper()
+    network = (dep.get("network") or "").upper()
+    amount = dep.get("amount")
+    amount_text = dep.get("amount_text")
+    user_id = dep.get("user_id")
+    username = dep.get("username") or ""
+
+    # Build action buttons (same as bot)
+    action_markup = _dep_action_keyboard(dep_id, dep.get("method") == "crypto")
+
+    # Diagnostics: last notify failures. Only the last 5 are shown, so keep a
+    # bounded deque instead of materializing the full failure list.
+    notify = dep.get("admin_notify") or []
+    tail = deque((n for n in notify if not n.get("ok")), maxlen=5)
+    fail_lines = [f"• admin {n.get('admin_id')}: {n.get('error')}" for n in tail]
+    diag = ("\n\n⚠️ Last notify errors:\n" + "\n".join(fail_lines)) if fail_lines else ""
+
+    caption = (
+        "💳 Deposit Request\n\n"
+        f"Status: {stt}\n"
+        f"User: {user_id} @{username if username else 'N/A'}\n"
+        f"Method: {method}" + (f" ({network})" if network else "") + "\n"
+        + (f"Paid: {amount_text}\n" if amount_text else "")
+        + f"Amount: {amount}\n"
+        + f"Deposit ID: {dep_id}"
+        + diag
+    )
+
+    sc = dep.get("screenshot")
+    if sc and sc.get("file_id"):
+        try:
+            if sc.get("kind") == "photo":
+                await context.bot.send_photo(
+                    chat_id=uid,
+                    photo=sc["file_id"],
+                    caption=caption,
+                    parse_mode=None,
+                    reply_markup=action_markup,
+                )
+            else:
+                await context.bot.send_document(
+                    chat_id=uid,
+                    document=sc["file_id"],
+                    caption=caption,
+                    parse_mode=None,
+                    reply_markup=action_markup,
+                )
+            await query.answer("✅ Sent deposit details.", show_alert=True)
+        except Exception as e:
+            await query.answer(f"❌ Failed to send screenshot: {e}", show_alert=True)
+    else:
+        # No screenshot saved (old deposits)
+        await safe_edit(query.message, caption + "\n\n❌ Screenshot not stored.", parse_mode=None, reply_markup=action_markup)
+    return True
+
+
+async def _h_dep_setcredits(dep_id: str, query, context: ContextTypes.DEFAULT_TYPE, repo: Repo, state: Dict[int, Any], uid: int) -> bool:
+    dep = await repo.get_deposit(dep_id, fields=_DEP_DECIDE_FIELDS)
+    if not dep or dep.get("status") != "pending":
+        await query.answer("❌ Deposit not found or already processed.", show_alert=True)
+        return True
+    state[uid] = AdminFlowState(flow="admin_dep_setcredits", step="credits", dep_id=dep_id)
+    await query.message.reply_text(
+        "Send how many credits to add for this crypto payment (example: 1 USDT = 70 credits => send 70):"
+    )
+    return True
+
+
+async def _h_dep_approve(dep_id: str, query, context: ContextTypes.DEFAULT_TYPE, repo: Repo, state: Dict[int, Any], uid: int) -> bool:
+    # INR deposit approve: credits = amount + referral bonus. The amount is
+    # read off the atomically marked deposit via credits_fn, so there is no
+    # separate status pre-check round-trip (and no TOCTOU between two admins).
+    dep2, user = await repo.approve_deposit(
+        dep_id,
+        admin_id=uid,
+        credits_fn=lambda d: int(d.get("amount", 0)) + _referral_bonus(int(d.get("amount", 0))),
+    )
+    _invalidate_dep_totals()
+    if not dep2:
+        await query.answer("❌ Deposit not found or already processed.", show_alert=True)
+        return True
+
+    # Coerce once; the target user id is reused in four spots below.
+    uid_target = int(dep2["user_id"])
+    base = int(dep2.get("amount", 0))
+    bonus = _referral_bonus(base)
+    credits = base + bonus
+
+    await query.answer("✅ Approved and credits added.", show_alert=True)
+
+    # Referral award (3% to referrer) runs in the background; the updated
+    # balance comes straight back from the credit write.
+    async def _ref() -> None:
+        try:
+            await _notify_referral_award(
+                context=context,
+                repo=repo,
+                referred_user_id=uid_target,
+                deposit_amount=base,
+                admin_id=int(uid),
+                deposit_id=dep_id,
+            )
+        except Exception:
+            pass
+
+    _spawn_bg(_ref())
+
+    # notify depositor with bonus
+    bal = int((user or {}).get("credits", 0))
+    _notify_bg(
+        context.bot,
+        chat_id=uid_target,
+        text=(
+            "✅ Deposit approved!\n"
+            f"• Deposit: ₹{base}\n"
+            f"• Bonus: +₹{bonus} ({REFERRAL_PERCENT:.1f}%)\n"
+            f"• Total Credited: ₹{credits}\n"
+            f"• Balance: {bal} credits"
+        ),
+    )
+
+    return True
+
+
+async def _h_dep_reject(dep_id: str, query, context: ContextTypes.DEFAULT_TYPE, repo: Repo, state: Dict[int, Any], uid: int) -> bool:
+    dep = await repo.mark_deposit(dep_id, "rejected", admin_id=uid)
+    _invalidate_dep_totals()
+    if not dep:
+        await query.answer("❌ Deposit not found or already processed.", show_alert=True)
+        return True
+    await query.answer("❌ Rejected.", show_alert=True)
+    _notify_bg(
+        context.bot,
+        chat_id=int(dep["user_id"]),
+        text="❌ Payment rejected. Contact admin if this is a mistake.",
+    )
+    return True
+
+
+_CALLBACK_DISPATCH: Dict[str, Callable[..., Awaitable[bool]]] = {
+    "menu": _cb_menu,
+    "addaccount": _cb_addaccount,
+    "credits": _cb_credits,
+    "accounts": _cb_accounts,
+    "bulkdiscount": _cb_bulkdiscount,
+    "qrs": _cb_qrs,
+    "banmenu": _cb_banmenu,
+    "banlist": _cb_banlist,
+    "referrals": _cb_referrals,
+    "activecredits": _cb_activecredits,
+    "stats": _cb_stats,
+    "deposits": _cb_deposits,
+}
+
+# Full-prefix routes for admin:<section>:<action>:<id> callbacks. The prefix is
+# recovered with one rpartition, so these cost a single dict lookup and no
+# per-branch startswith scans.
+_ID_ROUTES: Dict[str, Callable[..., Awaitable[bool]]] = {
+    "admin:account:view": _h_account_view,
+    "admin:account:delete": _h_account_delete,
+    "admin:account:delete_confirm": _h_account_delete_confirm,
+    "admin:account:edit": _h_account_edit,
+    "admin:account:getotp": _h_account_getotp,
+    "admin:account:getotp:cancel": _h_account_getotp_cancel,
+    "admin:dep:view": _h_dep_view,
+    "admin:dep:setcredits": _h_dep_setcredits,
+    "admin:dep:approve": _h_dep_approve,
+    "admin:dep:reject": _h_dep_reject,
+}
+
+
+async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, state: Dict[int, Any]) -> bool:
+    """Handle admin:* callbacks. Returns True if handled."""
+    query = update.callback_query
+    if not query:
+        return False
+
+    data = query.data or ""
+    if not data.startswith("admin:"):
+        return False
+
+    uid = update.effective_user.id
+    if not is_admin(uid):
+        await query.answer("❌ Access denied.", show_alert=True)
+        return True
+
+    repo: Repo = context.application.bot_data["repo"]
+
+    prev_flow = state.get(uid)
+
+    # id-suffixed callbacks (admin:<section>:<action>:<id>) first
+    head, _, tail = data.rpartition(":")
+    route = _ID_ROUTES.get(head)
+    if route is not None:
+        handled = await route(tail, query, context, repo, state, uid)
+    else:
+        handler = _CALLBACK_DISPATCH.get(data.split(":", 2)[1])
+        if handler is None:
+            # Unknown/removed admin sections are consumed silently (legacy behaviour).
+            return True
+        handled = await handler(query, context, repo, state, uid, data)
+
+    # Navigating away from an open text flow abandons it: drop the state and
+    # restore the normal bottom keyboard (the flow prompt swapped it for
+    # Cancel). Pure navigation with no flow open sends nothing, keeping one
+    # sendMessage per press off the shared 30 msg/s budget. The US/CA pick is
+    # the one callback that continues a flow rather than leaving it.
+    if (
+        isinstance(prev_flow, AdminFlowState)
+        and state.get(uid) is prev_flow
+        and not data.startswith("admin:addaccount:cc:")
+    ):
+        state.pop(uid, None)
+        _spawn_bg(restore_main_reply_menu(query.message))
+
+    return handled
+
+
+# ----------------------------
+# handle_admin_text step handlers
+#
+# Each admin text flow step is its own coroutine, dispatched through
+# _TEXT_DISPATCH on the (flow, step) pair: one dict probe per message instead
+# of walking nested flow/step comparison chains. All share one signature and
+# return True when the message is consumed.
+# ----------------------------
+
+
+async def _t_bulkdiscount_percent(update: Update, context: ContextTypes.DEFAULT_TYPE, state: Dict[int, Any], st: AdminFlowState, repo: Repo, account_manager, uid: int, text: str) -> bool:
+    if not _DIGITS_RE(text):
+        _reply_bg(update.message, "Send a number between 0 and 95 (example 20):")
+        return True
+    p = int(text)
+    if p < 0 or p > 95:
+        _reply_bg(update.message, "Percent must be 0-95. Send again:")
+        return True
+
+    state.pop(uid, None)
+    try:
+        await repo.apply_bulk_discount(percent=p)
+    except Exception as e:
+        _reply_bg(update.message, 
+            f"❌ Failed to apply discount: {e}",
+            reply_markup=main_reply_menu(True),
+        )
+        return True
+
+    st2 = await repo.get_bulk_discount()
+    _reply_bg(update.message, 
+        f"✅ Bulk discount updated successfully!\n\nStatus: {'ON ✅' if st2.get('enabled') else 'OFF ❌'}\nDiscount: {int(st2.get('percent', 0) or 0)}%",
+        reply_markup=main_reply_menu(True),
+    )
+    return True
+
+
+async def _t_add_phone(update: Update, context: ContextTypes.DEFAULT_TYPE, state: Dict[int, Any], st: AdminFlowState, repo: Repo, account_manager, uid: int, text: str) -> bool:
+    # API credentials are fixed (see FIXED_API_ID/FIXED_API_HASH); ensure present.
+    if st.api_id is None:
+        st.api_id = TELEGRAM_API_ID
+    if st.api_hash is None:
+        st.api_hash = TELEGRAM_API_HASH
+
+    phone_e164 = text.translate(_WS_STRIP)
+    if not _PHONE_RE(phone_e164):
+        _reply_bg(update.message, "Phone must start with +. Send again:")
+        return True
+    st.phone_e164 = phone_e164
+    st.phone = phone_e164.lstrip("+")
+
+    # Auto detect country + emoji from calling code
+    cc, em, needs_choice = detect_country_from_phone(phone_e164)
+    if needs_choice:
+        st.step = "pick_usca"
+        state[uid] = st
+        await update.message.reply_text(
+            "Detected +1 number. Choose country:",
+            reply_markup=ReplyKeyboardRemove(),
+        )
+        await update.message.reply_text(
+            "Select:",
+            reply_markup=kb(
+                [
+                    [
+                        InlineKeyboardButton("🇺🇸 USA", callback_data="admin:addaccount:cc:us"),
+                        InlineKeyboardButton("🇨🇦 Canada", callback_data="admin:addaccount:cc:ca"),
+                    ]
+                ]
+            ),
+        )
+        return True
+
+    if cc and em:
+        st.country = cc
+        st.country_emoji = em
+    else:
+        # No manual country/emoji input anymore
+        _reply_bg(update.message, 
+            "❌ Could not detect country from this number. Please send a valid international number with correct country code.",
+            reply_markup=cancel_reply_kb(),
+        )
+        st.step = "phone"
+        return True
+
+    st.step = "year"
+    _reply_bg(update.message, "Send account year (example 2023) or type 'skip':")
+    return True
+
+
+async def _t_add_year(update: Update, context: ContextTypes.DEFAULT_TYPE, state: Dict[int, Any], st: AdminFlowState, repo: Repo, account_manager, uid: int, text: str) -> bool:
+    t = text.strip().lower()
+    if t == "skip":
+        st.year = None
+        st.premium_months = None
+        st.step = "price"
+        _reply_bg(update.message, "Send price in credits for this account (example 75):")
+        return True
+
+    if t == "premium":
+        st.year = "premium"
+        st.step = "premium_months"
+        _reply_bg(update.message, "⭐ Premium selected. Send premium months (number, e.g. 1):")
+        return True
+
+    if not _YEAR_RE(t):
+        _reply_bg(update.message, "Year must be 4 digits like 2023, or type 'premium', or 'skip':")
+        return True
+    st.year = int(t)
+    st.premium_months = None
+
+    st.step = "price"
+    _reply_bg(update.message, "Send price in credits for this account (example 75):")
+    return True
+
+
+async def _t_add_premium_months(update: Update, context: ContextTypes.DEFAULT_TYPE, state: Dict[int, Any], st: AdminFlowState, repo: Repo, account_manager, uid: int, text: str) -> bool:
+    if not _DIGITS_RE(text) or int(text) <= 0:
+        _reply_bg(update.message, "Send premium months as a number (e.g. 1):")
+        return True
+    st.premium_months = int(text)
+    st.step = "price"
+    _reply_bg(update.message, "Send price in credits for this account (example 75):")
+    return True
+
+
+async def _t_add_price(update: Update, context: ContextTypes.DEFAULT_TYPE, state: Dict[int, Any], st: AdminFlowState, repo: Repo, account_manager, uid: int, text: str) -> bool:
+    if not _DIGITS_RE(text):
+        _reply_bg(update.message, "Price must be numeric. Send again:")
+        return True
+    st.price = int(text)
+
+    st.step = "send_code"
+    _reply_bg(update.message, "Sending Telegram login code to this phone...")
+    await account_manager.admin_begin_login(uid, st.api_id, st.api_hash, st.phone_e164)
+    _reply_bg(update.message, "Now send the OTP code. If 2FA enabled, I will ask password.")
+    return True
+
+
+async def _t_add_send_code(update: Update, context: ContextTypes.DEFAULT_TYPE, state: Dict[int, Any], st: AdminFlowState, repo: Repo, account_manager, uid: int, text: str) -> bool:
+    code = text.translate(_WS_STRIP)
+    doc, status = await account_manager.admin_complete_code(uid, code)
+    if status == "need_password":
+        st.step = "tg_password"
+        _reply_bg(update.message, "Telegram 2FA required. Send Telegram 2FA password:")
+        return True
+
+    if status == "invalid_code":
+        # allow retry
+        st.step = "send_code"
+        _reply_bg(update.message, 
+            "❌ Invalid OTP code. Send the OTP again (or press Cancel).",
+            reply_markup=cancel_reply_kb(),
+        )
+        return True
+
+    if status == "code_expired":
+        # must restart login (resend code)
+        await account_manager.admin_cancel_login(uid)
+        state.pop(uid, None)
+        _reply_bg(update.message, 
+            "⚠️ OTP expired. Please start again and request a new code.",
+            reply_markup=main_reply_menu(True),
+        )
+        return True
+
+    if status != "ok" or not doc:
+        await account_manager.admin_cancel_login(uid)
+        state.pop(uid, None)
+        _reply_bg(update.message, "Failed to login. Cancelled.", reply_markup=main_reply_menu(True))
+        return True
+
+    state.pop(uid, None)
+    await repo.create_account(
+        phone=doc["phone"],
+        api_id=doc["api_id"],
+        api_hash=doc["api_hash"],
+        session_string=doc["session_string"],
+        added_by=uid,
+        year=st.year,
+        premium_months=st.premium_months,
+        country=st.country,
+        country_emoji=st.country_emoji,
+        twofa_password=st.twofa_password,
+        price=st.price,
+    )
+    _reply_bg(update.message, "✅ Account saved and added to stock.", reply_markup=main_reply_menu(True))
+    return True
+
+
+async def _t_add_tg_password(update: Update, context: ContextTypes.DEFAULT_TYPE, state: Dict[int, Any], st: AdminFlowState, repo: Repo, account_manager, uid: int, text: str) -> bool:
+    pwd = text.strip()
+    doc, status = await account_manager.admin_complete_password(uid, pwd)
+    if status in {"invalid_password"} or status != "ok" or not doc:
+        # Don't cancel the whole flow; allow retry
+        st.step = "tg_password"
+        _reply_bg(update.message, 
+            "❌ Wrong 2FA password. Send again (or press Cancel).",
+            reply_markup=cancel_reply_kb(),
+        )
+        return True
+
+    # Save ONLY the correct 2FA password
+    st.twofa_password = pwd
+
+    state.pop(uid, None)
+    await repo.create_account(
+        phone=doc["phone"],
+        api_id=doc["api_id"],
+        api_hash=doc["api_hash"],
+        session_string=doc["session_string"],
+        added_by=uid,
+        year=st.year,
+        premium_months=st.premium_months,
+        country=st.country,
+        country_emoji=st.country_emoji,
+        twofa_password=st.twofa_password,
+        price=st.price,
+    )
+    _reply_bg(update.message, "✅ Account saved and added to stock.", reply_markup=main_reply_menu(True))
+    return True
+
+
+async def _t_edit_field(update: Update, context: ContextTypes.DEFAULT_TYPE, state: Dict[int, Any], st: AdminFlowState, repo: Repo, account_manager, uid: int, text: str) -> bool:
+    if not st.account_id:
+        state.pop(uid, None)
+        return True
+    field = text.lower().strip()
+    if field not in {"country", "emoji", "year", "twofa", "price"}:
+        _reply_bg(update.message, "Choose: country / emoji / year / twofa / price (or cancel)")
+        return True
+    st.field = field
+    st.step = "value"
+    _reply_bg(update.message, "Send new value (or 'skip' to clear):")
+    return True
+
+
+async def _t_edit_value(update: Update, context: ContextTypes.DEFAULT_TYPE, state: Dict[int, Any], st: AdminFlowState, repo: Repo, account_manager, uid: int, text: str) -> bool:
+    acc_id = st.account_id
+    if not acc_id:
+        state.pop(uid, None)
+        return True
+
+    field = st.field
+    val_raw = text
+
+    fields: dict[str, Any] = {}
+    if val_raw.lower() == "skip":
+        mapping = {
+            "country": "country",
+            "emoji": "country_emoji",
+            "year": "year",
+            "twofa": "twofa_password",
+            "price": "price",
+        }
+        fields[mapping[field]] = None
+    else:
+        if field == "country":
+            fields["country"] = val_raw.upper()
+        elif field == "emoji":
+            fields["country_emoji"] = val_raw
+        elif field == "year":
+            if not _YEAR_RE(val_raw):
+                _reply_bg(update.message, "Year must be 4 digits (example 2023)")
+                return True
+            fields["year"] = int(val_raw)
+        elif field == "twofa":
+            fields["twofa_password"] = val_raw
+        elif field == "price":
+            if not _DIGITS_RE(val_raw):
+                _reply_bg(update.message, "Price must be numeric")
+                return True
+            fields["price"] = int(val_raw)
+
+    state.pop(uid, None)
+    ok = await repo.update_account_fields(_oid(acc_id), fields)
+    _reply_bg(update.message, "✅ Updated." if ok else "No changes saved.")
+    return True
+
+
+async def _t_dep_setcredits(update: Update, context: ContextTypes.DEFAULT_TYPE, state: Dict[int, Any], st: AdminFlowState, repo: Repo, account_manager, uid: int, text: str) -> bool:
+    # crypto deposit: set credits then approve
+    if not _DIGITS_RE(text) or int(text) <= 0:
+        _reply_bg(update.message, "Send numeric credits (example 70):")
+        return True
+
+    dep_id = st.dep_id
+    base = int(text)
+    bonus = _referral_bonus(base)
+    credits = base + bonus
+
+    state.pop(uid, None)
+    dep, user = await repo.approve_deposit(dep_id, admin_id=uid, credits=credits)
+    _invalidate_dep_totals()
+    if not dep:
+        _reply_bg(update.message, "Deposit not found or already processed.")
+        return True
+
+    uid_target = int(dep["user_id"])
+    _reply_bg(update.message, "✅ Approved and credits added.")
+
+    # Same shape as the INR approve path: referral award in the
+    # background, balance straight from the credit write.
+    async def _ref() -> None:
+        try:
+            await _notify_referral_award(
+                context=context,
+                repo=repo,
+                referred_user_id=uid_target,
+                deposit_amount=base,
+                admin_id=int(uid),
+                deposit_id=str(dep_id),
+            )
+        except Exception:
+            pass
+
+    _spawn_bg(_ref())
+
+    bal = int((user or {}).get("credits", 0))
+    _notify_bg(
+        context.bot,
+        chat_id=uid_target,
+        text=(
+            "✅ Deposit approved!\n"
+            f"• Deposit: ₹{base}\n"
+            f"• Bonus: +₹{bonus} ({REFERRAL_PERCENT:.1f}%)\n"
+            f"• Total Credited: ₹{credits}\n"
+            f"• Balance: {bal} credits"
+        ),
+    )
+
+    return True
+
+
+async def _t_credits_inline(update: Update, context: ContextTypes.DEFAULT_TYPE, state: Dict[int, Any], st: AdminFlowState, repo: Repo, account_manager, uid: int, text: str) -> bool:
+    # credits inline (no new messages); one `<user_id> <amount>` pair per
+    # line, so a pasted batch lands in a single bulk write.
+    rows: list[tuple[int, int]] = []
+    for line in filter(None, (ln.strip() for ln in text.splitlines())):
+        parts = line.split()
+        target = _parse_int(parts[0]) if len(parts) == 2 else None
+        amt = _parse_int(parts[1]) if len(parts) == 2 else None
+        if target is None or target < 0 or amt is None:
+            rows = []
+            break
+        rows.append((target, amt))
+    if not rows:
+        # keep inline prompt
+        chat_id = st.ui_chat_id
+        msg_id = st.ui_message_id
+        if chat_id and msg_id:
+            await context.bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=msg_id,
+                text="❌ Invalid format. Use: `<user_id> <amount>` (one pair per line)",
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=kb([[InlineKeyboardButton("⬅️ Back", callback_data="admin:credits")]]),
+            )
+        return True
+
+    if st.mode == "remove":
+        rows = [(t, -abs(a)) for t, a in rows]
+
+    chat_id = st.ui_chat_id
+    msg_id = st.ui_message_id
+    state.pop(uid, None)
+
+    # Run the credit write off the dispatcher so other chats' updates are not
+    # queued behind this admin's DB round-trip (state is already popped, so a
+    # repeated message cannot re-enter the flow while the write is in flight).
+    async def _apply() -> None:
+        try:
+            if len(rows) == 1:
+                target, amt = rows[0]
+                user = await repo.add_credits(target, amt, by_admin=uid)
+                result = f"✅ Updated user `{target}` credits: *{user.get('credits', 0)}*"
+            else:
+                n = await repo.bulk_add_credits(rows, by_admin=uid)
+                result = f"✅ Updated credits for *{n}* users."
+        except Exception:
+            result = "❌ Failed to update credits. Try again."
+        if chat_id and msg_id:
+            try:
+                await context.bot.edit_message_text(
+                    chat_id=chat_id,
+                    message_id=msg_id,
+                    text=result,
+                    parse_mode=ParseMode.MARKDOWN,
+                    reply_markup=kb([[InlineKeyboardButton("⬅️ Back", callback_data="admin:menu")]]),
+                )
+            except Exception:
+                pass
+
+    _spawn_bg(_apply())
+    return True
+
+
+# Ban sweeps often retype the same ids (ban, unban, ban again); cache the
+# resolved username briefly so repeats skip both the users lookup and the
+# Telegram get_chat round-trip. Misses (empty username) are cached too.
+_USERNAME_CACHE: Dict[int, tuple[str, float]] = {}
+_USERNAME_TTL = 300.0
+_USERNAME_CACHE_MAX = 256
+
+
+async def _resolve_username(bot, repo: Repo, target: int) -> str:
+    now = time.monotonic()
+    hit = _USERNAME_CACHE.get(target)
+    if hit is not None and now - hit[1] < _USERNAME_TTL:
+        return hit[0]
+    # Anyone who has interacted with the bot is already in users, so only
+    # fall back to the Telegram get_chat round-trip when the doc has no
+    # username.
+    udoc = await repo.db.users.find_one({"user_id": target}, {"username": 1, "_id": 0})
+    uname = ((udoc or {}).get("username") or "").strip()
+    if not uname:
+        try:
+            ch = await bot.get_chat(target)
+            uname = getattr(ch, "username", "") or ""
+        except Exception:
+            uname = ""
+    if len(_USERNAME_CACHE) >= _USERNAME_CACHE_MAX:
+        # Drop the oldest insertion; plenty for an admin cleanup sweep.
+        _USERNAME_CACHE.pop(next(iter(_USERNAME_CACHE)))
+    _USERNAME_CACHE[target] = (uname, now)
+    return uname
+
+
+async def _t_ban_input(update: Update, context: ContextTypes.DEFAULT_TYPE, state: Dict[int, Any], st: AdminFlowState, repo: Repo, account_manager, uid: int, text: str) -> bool:
+    if not _DIGITS_RE(text):
+        _reply_bg(update.message, "Send numeric user id:")
+        return True
+    target = int(text)
+    state.pop(uid, None)
+    if st.mode == "ban":
+        uname = await _resolve_username(context.bot, repo, target)
+        await repo.ban_user(user_id=target, by_admin=uid, username=uname)
+        _reply_bg(update.message, 
+            f"✅ Banned user: {target}",
+            reply_markup=main_reply_menu(True),
+        )
+        return True
+    else:
+        ok = await repo.unban_user(user_id=target)
+        _reply_bg(update.message, 
+            f"✅ Unbanned user: {target}" if ok else f"User not banned: {target}",
+            reply_markup=main_reply_menu(True),
+        )
+        return True
+
+
+
+
+
+
+
+
+
+
+_TEXT_DISPATCH: Dict[tuple[str, str], Callable[..., Awaitable[bool]]] = {
+    ("admin_bulkdiscount", "percent"): _t_bulkdiscount_percent,
+    ("admin_add_account", "phone"): _t_add_phone,
+    ("admin_add_account", "year"): _t_add_year,
+    ("admin_add_account", "premium_months"): _t_add_premium_months,
+    ("admin_add_account", "price"): _t_add_price,
+    ("admin_add_account", "send_code"): _t_add_send_code,
+    ("admin_add_account", "tg_password"): _t_add_tg_password,
+    ("admin_edit_account", "field"): _t_edit_field,
+    ("admin_edit_account", "value"): _t_edit_value,
+    ("admin_dep_setcredits", "credits"): _t_dep_setcredits,
+    ("admin_credits_inline", "input"): _t_credits_inline,
+    ("admin_ban", "input"): _t_ban_input,
+}
+
+# Flows owned by this module; anything else in STATE belongs to bot.py.
+_ADMIN_TEXT_FLOWS = frozenset(flow for flow, _ in _TEXT_DISPATCH)
+
+
+async def handle_admin_text(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    state: Dict[int, Any],
+    account_manager,
+) -> bool:
+    """Handle admin guided text flows. Returns True if handled."""
+    if not update.message:
+        return False
+
+    uid = update.effective_user.id
+    if uid not in state:
+        return False
+
+    st = state[uid]
+    flow = st.get("flow")
+    step = st.get("step")
+
+    if flow not in _ADMIN_TEXT_FLOWS:
+        return False
+
+    if not is_admin(uid):
+        state.pop(uid, None)
+        return True
+
+    repo: Repo = context.application.bot_data["repo"]
+    text = update.message.text.strip()
+
+    # Global cancel for admin text flows (via bottom reply keyboard or typed text)
+    if text.lower() == "cancel":
+        state.pop(uid, None)
+        _reply_bg(update.message, "Cancelled.", reply_markup=main_reply_menu(True))
+        return True
+
+    handler = _TEXT_DISPATCH.get((flow, step))
+    if handler is None:
+        # e.g. admin_add_account parked on the pick_usca callback step
+        return False
+    return await handler(update, context, state, st, repo, account_manager, uid, text)
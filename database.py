@@ -1,1050 +1,1317 @@
-from __future__ import annotations
-
-from datetime import datetime, timezone
-from typing import Any, Optional
-
-from bson import ObjectId
-from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
-
-# Use certifi CA bundle for TLS connections to MongoDB Atlas (helps on Windows/Python)
-try:
-    import certifi  # type: ignore
-except Exception:  # pragma: no cover
-    certifi = None  # type: ignore
-from pymongo import ReturnDocument
-
-from config import DB_NAME, MONGO_URI
-
-_client: Optional[AsyncIOMotorClient] = None
-_db: Optional[AsyncIOMotorDatabase] = None
-
-
-def utcnow() -> datetime:
-    return datetime.now(timezone.utc)
-
-
-def get_client() -> AsyncIOMotorClient:
-    global _client
-    if _client is None:
-        kwargs: dict[str, Any] = {}
-        if certifi is not None:
-            kwargs["tlsCAFile"] = certifi.where()
-        # keep default timeouts unless overridden by URI
-        _client = AsyncIOMotorClient(MONGO_URI, **kwargs)
-    return _client
-
-
-def get_db() -> AsyncIOMotorDatabase:
-    global _db
-    if _db is None:
-        _db = get_client()[DB_NAME]
-    return _db
-
-
-async def init_indexes() -> None:
-    db = get_db()
-
-    await db.users.create_index("user_id", unique=True)
-    await db.credit_logs.create_index([("user_id", 1), ("created_at", -1)])
-
-    await db.accounts.create_index("phone", unique=True)
-    await db.accounts.create_index("status")
-    await db.accounts.create_index("country")
-    await db.accounts.create_index("year")
-    await db.accounts.create_index([("country", 1), ("year", 1), ("status", 1)])
-    await db.accounts.create_index([("assigned_to", 1), ("status", 1)])
-
-    await db.purchases.create_index([("user_id", 1), ("created_at", -1)])
-    await db.purchases.create_index([("account_id", 1), ("created_at", -1)])
-
-    await db.deposits.create_index([("user_id", 1), ("created_at", -1)])
-    await db.deposits.create_index([("status", 1), ("created_at", -1)])
-
-    # referrals
-    await db.referrals.create_index([("referred_user_id", 1)], unique=True)
-    await db.referrals.create_index([("referrer_user_id", 1), ("created_at", -1)])
-
-    # referral earnings log (optional, for audit)
-    await db.ref_earn_logs.create_index([("referrer_user_id", 1), ("created_at", -1)])
-    await db.ref_earn_logs.create_index([("referred_user_id", 1), ("created_at", -1)])
-    await db.ref_earn_logs.create_index([("deposit_id", 1)], unique=True, sparse=True)
-
-    # legacy tokens (kept for compatibility; no longer used in UI)
-    await db.ref_tokens.create_index([("user_id", 1)], unique=True)
-
-    # bans
-    await db.banned_users.create_index([("user_id", 1)], unique=True)
-
-    # qr settings
-    await db.qr_settings.create_index([("key", 1)], unique=True)
-
-    # admin settings (bulk discount etc.)
-    await db.admin_settings.create_index([("key", 1)], unique=True)
-
-
-class Repo:
-    def __init__(self, db: AsyncIOMotorDatabase):
-        self.db = db
-
-    # -------- Admin Settings (Bulk Discount) --------
-    async def get_bulk_discount(self) -> dict[str, Any]:
-        """Return {'enabled': bool, 'percent': int}."""
-        doc = await self.db.admin_settings.find_one({"key": "bulk_discount"})
-        if not doc:
-            return {"enabled": False, "percent": 0}
-        return {"enabled": bool(doc.get("enabled", False)), "percent": int(doc.get("percent", 0) or 0)}
-
-    async def set_bulk_discount(self, *, enabled: bool, percent: int) -> dict[str, Any]:
-        percent_i = int(percent)
-        await self.db.admin_settings.update_one(
-            {"key": "bulk_discount"},
-            {"$set": {"key": "bulk_discount", "enabled": bool(enabled), "percent": percent_i, "updated_at": utcnow()}},
-            upsert=True,
-        )
-        return await self.get_bulk_discount()
-
-    async def apply_bulk_discount(self, *, percent: int) -> dict[str, Any]:
-        """Apply discount percent to ALL AVAILABLE accounts.
-
-        Stores original base price in 'base_price' (only once) so it can be reset.
-        """
-        p = max(0, min(95, int(percent)))
-
-        # Ensure base_price is saved (only if missing)
-        await self.db.accounts.update_many(
-            {"status": "available", "price": {"$ne": None}, "base_price": {"$exists": False}},
-            [{"$set": {"base_price": "$price"}}],
-        )
-
-        # Apply discount based on base_price
-        await self.db.accounts.update_many(
-            {"status": "available", "base_price": {"$ne": None}},
-            [
-                {
-                    "$set": {
-                        "price": {
-                            "$toInt": {
-                                "$round": [
-                                    {
-                                        "$multiply": [
-                                            "$base_price",
-                                            {"$divide": [{"$subtract": [100, p]}, 100]},
-                                        ]
-                                    },
-                                    0,
-                                ]
-                            }
-                        },
-                        "updated_at": "$$NOW",
-                    }
-                }
-            ],
-        )
-
-        return await self.set_bulk_discount(enabled=True, percent=p)
-
-    async def disable_bulk_discount(self) -> dict[str, Any]:
-        """Disable discount and restore price from base_price (keeps base_price)."""
-        await self.db.accounts.update_many(
-            {"status": "available", "base_price": {"$ne": None}},
-            [{"$set": {"price": "$base_price", "updated_at": "$$NOW"}}],
-        )
-        st = await self.get_bulk_discount()
-        return await self.set_bulk_discount(enabled=False, percent=int(st.get("percent", 0) or 0))
-
-    async def reset_bulk_discount(self) -> dict[str, Any]:
-        """Reset to normal (restore price and remove base_price field)."""
-        await self.db.accounts.update_many(
-            {"status": "available", "base_price": {"$exists": True}},
-            [{"$set": {"price": "$base_price", "updated_at": "$$NOW"}}],
-        )
-        await self.db.accounts.update_many(
-            {"status": "available", "base_price": {"$exists": True}},
-            {"$unset": {"base_price": ""}},
-        )
-        return await self.set_bulk_discount(enabled=False, percent=0)
-
-    # -------- Payment toggles --------
-    async def get_crypto_enabled(self) -> bool:
-        doc = await self.db.admin_settings.find_one({"key": "crypto_enabled"})
-        if not doc:
-            return True
-        return bool(doc.get("enabled", True))
-
-    async def set_crypto_enabled(self, *, enabled: bool) -> bool:
-        await self.db.admin_settings.update_one(
-            {"key": "crypto_enabled"},
-            {"$set": {"key": "crypto_enabled", "enabled": bool(enabled), "updated_at": utcnow()}},
-            upsert=True,
-        )
-        return await self.get_crypto_enabled()
-
-    # ----------------------------
-    # Referral / earnings
-    # ----------------------------
-    async def is_new_user(self, user_id: int) -> bool:
-        doc = await self.db.users.find_one({"user_id": int(user_id)})
-        return doc is None
-
-    async def save_referral_if_new(
-        self,
-        *,
-        referred_user_id: int,
-        referred_username: str | None,
-        referrer_user_id: int,
-        referrer_username: str | None,
-    ) -> bool:
-        """Save referral for a NEW user. Returns True if saved."""
-        if referred_user_id == referrer_user_id:
-            return False
-
-        # only for new users
-        if not await self.is_new_user(referred_user_id):
-            return False
-
-        now = utcnow()
-        try:
-            await self.db.referrals.insert_one(
-                {
-                    "referrer_user_id": int(referrer_user_id),
-                    "referrer_username": (referrer_username or ""),
-                    "referred_user_id": int(referred_user_id),
-                    "referred_username": (referred_username or ""),
-                    "created_at": now,
-                    "credited": False,
-                }
-            )
-        except Exception:
-            return False
-
-        # store on user document too
-        await self.db.users.update_one(
-            {"user_id": int(referred_user_id)},
-            {
-                "$setOnInsert": {"user_id": int(referred_user_id), "credits": 0, "created_at": now},
-                "$set": {
-                    "referrer_user_id": int(referrer_user_id),
-                    "referrer_username": (referrer_username or ""),
-                    "referrer_set_at": now,
-                    "updated_at": now,
-                },
-            },
-            upsert=True,
-        )
-        return True
-
-    async def get_tokens(self, user_id: int) -> int:
-        # legacy (discount tokens) - no longer used by referral UI
-        doc = await self.db.ref_tokens.find_one({"user_id": int(user_id)})
-        return int((doc or {}).get("tokens", 0))
-
-    async def get_referral_stats(self, user_id: int) -> dict[str, Any]:
-        """Return {'referrals': int, 'total_earned': float} for a referrer."""
-        referrals = await self.db.referrals.count_documents({"referrer_user_id": int(user_id)})
-        u = await self.db.users.find_one({"user_id": int(user_id)})
-        total_earned = float((u or {}).get("ref_earned_total", 0.0) or 0.0)
-        return {"referrals": int(referrals), "total_earned": float(total_earned)}
-
-    async def add_referral_earning(
-        self,
-        *,
-        referrer_user_id: int,
-        referred_user_id: int,
-        amount: float,
-        by_admin: int,
-        deposit_id: str | None = None,
-        deposit_amount: int | None = None,
-    ) -> dict[str, Any]:
-        """Credit referral earning to referrer (adds to credits + tracks total earned).
-
-        Returns updated user doc for referrer.
-        """
-        now = utcnow()
-        amt_i = int(amount)
-        # add to credits as integer credits, and track total earned as float
-        user = await self.db.users.find_one_and_update(
-            {"user_id": int(referrer_user_id)},
-            {
-                "$inc": {"credits": amt_i, "ref_earned_total": float(amount)},
-                "$setOnInsert": {"user_id": int(referrer_user_id), "created_at": now},
-                "$set": {"updated_at": now},
-            },
-            upsert=True,
-            return_document=ReturnDocument.AFTER,
-        )
-
-        # best-effort audit log
-        try:
-            await self.db.ref_earn_logs.insert_one(
-                {
-                    "referrer_user_id": int(referrer_user_id),
-                    "referred_user_id": int(referred_user_id),
-                    "amount": float(amount),
-                    "amount_int": amt_i,
-                    "deposit_id": deposit_id,
-                    "deposit_amount": int(deposit_amount) if deposit_amount is not None else None,
-                    "by_admin": int(by_admin),
-                    "created_at": now,
-                }
-            )
-        except Exception:
-            pass
-
-        return user or {}
-
-    async def _reserve_token(self, user_id: int) -> bool:
-        """Reserve one token for a purchase (decrement immediately)."""
-        doc = await self.db.ref_tokens.find_one_and_update(
-            {"user_id": int(user_id), "tokens": {"$gte": 1}},
-            {"$inc": {"tokens": -1}, "$set": {"updated_at": utcnow()}},
-            return_document=ReturnDocument.AFTER,
-        )
-        return doc is not None
-
-    async def _release_token(self, user_id: int) -> None:
-        """Rollback a reserved token."""
-        await self.db.ref_tokens.update_one(
-            {"user_id": int(user_id)},
-            {"$inc": {"tokens": 1}, "$set": {"updated_at": utcnow()}},
-            upsert=True,
-        )
-
-    async def add_tokens(self, user_id: int, delta: int) -> int:
-        now = utcnow()
-        doc = await self.db.ref_tokens.find_one_and_update(
-            {"user_id": int(user_id)},
-            {"$inc": {"tokens": int(delta)}, "$set": {"updated_at": now}, "$setOnInsert": {"user_id": int(user_id)}},
-            upsert=True,
-            return_document=ReturnDocument.AFTER,
-        )
-        return int((doc or {}).get("tokens", 0))
-
-    async def set_tokens(self, user_id: int, tokens: int) -> int:
-        now = utcnow()
-        doc = await self.db.ref_tokens.find_one_and_update(
-            {"user_id": int(user_id)},
-            {"$set": {"tokens": int(tokens), "updated_at": now, "user_id": int(user_id)}},
-            upsert=True,
-            return_document=ReturnDocument.AFTER,
-        )
-        return int((doc or {}).get("tokens", 0))
-
-    # ----------------------------
-    # Bans
-    # ----------------------------
-    async def is_banned(self, user_id: int) -> bool:
-        doc = await self.db.banned_users.find_one({"user_id": int(user_id)})
-        return doc is not None
-
-    async def ban_user(self, *, user_id: int, by_admin: int, username: str | None = None) -> None:
-        await self.db.banned_users.update_one(
-            {"user_id": int(user_id)},
-            {
-                "$set": {
-                    "user_id": int(user_id),
-                    "username": (username or ""),
-                    "by_admin": int(by_admin),
-                    "created_at": utcnow(),
-                }
-            },
-            upsert=True,
-        )
-
-    async def unban_user(self, *, user_id: int) -> bool:
-        res = await self.db.banned_users.delete_one({"user_id": int(user_id)})
-        return res.deleted_count == 1
-
-    # ----------------------------
-    # QR settings
-    # ----------------------------
-    async def get_inr_qr_flags(self) -> dict[str, bool]:
-        """Return {'qr1': bool, 'qr2': bool}. Defaults to both True."""
-        doc = await self.db.qr_settings.find_one({"key": "inr"})
-        if not doc:
-            return {"qr1": True, "qr2": True}
-        return {
-            "qr1": bool(doc.get("qr1", True)),
-            "qr2": bool(doc.get("qr2", True)),
-        }
-
-    async def set_inr_qr_flag(self, *, qr_key: str, enabled: bool) -> dict[str, bool]:
-        if qr_key not in {"qr1", "qr2"}:
-            return await self.get_inr_qr_flags()
-        await self.db.qr_settings.update_one(
-            {"key": "inr"},
-            {"$set": {"key": "inr", qr_key: bool(enabled), "updated_at": utcnow()}},
-            upsert=True,
-        )
-        return await self.get_inr_qr_flags()
-
-    async def try_credit_referral_on_first_approved_deposit(self, *, referred_user_id: int) -> dict[str, Any] | None:
-        """If referred_user has a referral and this is their first approved deposit, grant +1 token.
-
-        Returns info dict if credited, else None.
-        """
-        ref = await self.db.referrals.find_one({"referred_user_id": int(referred_user_id)})
-        if not ref or ref.get("credited") is True:
-            return None
-
-        approved_count = await self.db.deposits.count_documents({"user_id": int(referred_user_id), "status": "approved"})
-        if approved_count != 1:
-            return None
-
-        # mark credited atomically
-        res = await self.db.referrals.update_one(
-            {"_id": ref.get("_id"), "credited": False},
-            {"$set": {"credited": True, "credited_at": utcnow()}},
-        )
-        if res.modified_count != 1:
-            return None
-
-        referrer_id = int(ref.get("referrer_user_id"))
-        new_tokens = await self.add_tokens(referrer_id, 1)
-        return {
-            "referrer_user_id": referrer_id,
-            "referrer_username": (ref.get("referrer_username") or ""),
-            "referred_user_id": int(ref.get("referred_user_id")),
-            "referred_username": (ref.get("referred_username") or ""),
-            "tokens_now": new_tokens,
-        }
-
-    # -------- Deposits --------
-    async def create_deposit_request(
-        self,
-        *,
-        user_id: int,
-        username: str,
-        amount: int,
-        method: str,
-        network: str | None = None,
-        amount_text: str | None = None,
-    ) -> str:
-        now = utcnow()
-        res = await self.db.deposits.insert_one(
-            {
-                "user_id": int(user_id),
-                "username": username,
-                "amount": int(amount),
-                "amount_text": amount_text,
-                "method": method,  # inr|crypto
-                "network": network,  # trc20|bep20|sol|ton|binance
-                "credits_added": None,
-                "status": "pending",  # pending|approved|rejected
-                # Screenshot info (Telegram file_id). Stored so admin can fetch/resend later.
-                "screenshot": None,  # {kind: photo|document, file_id: str}
-                # Delivery attempts to admins (best-effort). Stored for diagnostics.
-                "admin_notify": [],  # list[{admin_id:int, ok:bool, error:str|None, at:datetime}]
-                "created_at": now,
-                "updated_at": now,
-            }
-        )
-        return str(res.inserted_id)
-
-    async def get_deposit(self, deposit_id: str) -> Optional[dict[str, Any]]:
-        try:
-            oid = ObjectId(deposit_id)
-        except Exception:
-            return None
-        return await self.db.deposits.find_one({"_id": oid})
-
-    async def mark_deposit(
-        self, deposit_id: str, status: str, *, admin_id: int, credits_added: int | None = None
-    ) -> Optional[dict[str, Any]]:
-        try:
-            oid = ObjectId(deposit_id)
-        except Exception:
-            return None
-        now = utcnow()
-        set_doc: dict[str, Any] = {"status": status, "admin_id": int(admin_id), "updated_at": now}
-        if credits_added is not None:
-            set_doc["credits_added"] = int(credits_added)
-        return await self.db.deposits.find_one_and_update(
-            {"_id": oid, "status": "pending"},
-            {"$set": set_doc},
-            return_document=ReturnDocument.AFTER,
-        )
-
-    async def attach_deposit_screenshot(self, deposit_id: str, *, kind: str, file_id: str) -> bool:
-        """Persist screenshot file reference on a deposit. Returns True if updated."""
-        try:
-            oid = ObjectId(deposit_id)
-        except Exception:
-            return False
-        now = utcnow()
-        res = await self.db.deposits.update_one(
-            {"_id": oid},
-            {"$set": {"screenshot": {"kind": kind, "file_id": str(file_id)}, "updated_at": now}},
-        )
-        return res.modified_count == 1
-
-    async def add_deposit_admin_notify(
-        self, deposit_id: str, *, admin_id: int, ok: bool, error: str | None
-    ) -> None:
-        """Append an admin notification result for diagnostics."""
-        try:
-            oid = ObjectId(deposit_id)
-        except Exception:
-            return
-        now = utcnow()
-        await self.db.deposits.update_one(
-            {"_id": oid},
-            {
-                "$push": {
-                    "admin_notify": {
-                        "admin_id": int(admin_id),
-                        "ok": bool(ok),
-                        "error": (str(error) if error else None),
-                        "at": now,
-                    }
-                },
-                "$set": {"updated_at": now},
-            },
-        )
-
-    async def deposit_totals(self) -> dict[str, Any]:
-        """Totals for pending/approved/rejected + overall."""
-        pipeline = [
-            {"$group": {"_id": "$status", "count": {"$sum": 1}, "amount": {"$sum": "$amount"}}}
-        ]
-        out = {
-            "pending_count": 0,
-            "pending_amount": 0,
-            "approved_count": 0,
-            "approved_amount": 0,
-            "rejected_count": 0,
-            "rejected_amount": 0,
-        }
-        async for row in self.db.deposits.aggregate(pipeline):
-            status = row.get("_id")
-            if status not in {"pending", "approved", "rejected"}:
-                continue
-            out[f"{status}_count"] = int(row.get("count", 0))
-            out[f"{status}_amount"] = int(row.get("amount", 0))
-        return out
-
-    async def list_deposits_page(self, *, status: str | None, page: int, page_size: int = 8) -> list[dict[str, Any]]:
-        q: dict[str, Any] = {}
-        if status:
-            q["status"] = status
-        cur = (
-            self.db.deposits.find(q)
-            .sort("created_at", -1)
-            .skip(max(0, int(page)) * int(page_size))
-            .limit(int(page_size))
-        )
-        return [x async for x in cur]
-
-    async def count_deposits(self, *, status: str | None) -> int:
-        q: dict[str, Any] = {}
-        if status:
-            q["status"] = status
-        return await self.db.deposits.count_documents(q)
-
-    async def list_deposits_for_user(self, user_id: int, *, limit: int = 20) -> list[dict[str, Any]]:
-        cur = self.db.deposits.find({"user_id": int(user_id)}).sort("created_at", -1).limit(int(limit))
-        return [x async for x in cur]
-
-
-    # -------- Users --------
-    async def ensure_user(self, user_id: int, *, username: str | None = None) -> dict[str, Any]:
-        now = utcnow()
-        set_doc: dict[str, Any] = {"updated_at": now}
-        if username is not None:
-            set_doc["username"] = str(username)
-
-        await self.db.users.update_one(
-            {"user_id": int(user_id)},
-            {
-                "$setOnInsert": {"user_id": int(user_id), "credits": 0, "created_at": now},
-                "$set": set_doc,
-            },
-            upsert=True,
-        )
-        return await self.db.users.find_one({"user_id": int(user_id)})
-
-    async def add_credits(self, user_id: int, amount: int, *, by_admin: int) -> dict[str, Any]:
-        now = utcnow()
-        await self.ensure_user(user_id)
-        user = await self.db.users.find_one_and_update(
-            {"user_id": int(user_id)},
-            {"$inc": {"credits": int(amount)}, "$set": {"updated_at": now}},
-            return_document=ReturnDocument.AFTER,
-        )
-        await self.db.credit_logs.insert_one(
-            {"user_id": int(user_id), "amount": int(amount), "by_admin": int(by_admin), "created_at": now}
-        )
-        return user
-
-    async def set_credits(self, user_id: int, credits: int, *, by_admin: int) -> dict[str, Any]:
-        now = utcnow()
-        await self.ensure_user(user_id)
-        user = await self.db.users.find_one_and_update(
-            {"user_id": int(user_id)},
-            {"$set": {"credits": int(credits), "updated_at": now}},
-            return_document=ReturnDocument.AFTER,
-        )
-        await self.db.credit_logs.insert_one(
-            {
-                "user_id": int(user_id),
-                "amount": int(credits),
-                "by_admin": int(by_admin),
-                "mode": "set",
-                "created_at": now,
-            }
-        )
-        return user
-
-    # -------- Accounts --------
-    async def create_account(
-        self,
-        *,
-        phone: str,
-        api_id: int,
-        api_hash: str,
-        session_string: str,
-        added_by: int,
-        year: int | str | None = None,
-        premium_months: int | None = None,
-        country: str | None = None,
-        country_emoji: str | None = None,
-        twofa_password: str | None = None,
-        price: int | None = None,
-    ) -> ObjectId:
-        now = utcnow()
-        doc = {
-            "phone": str(phone),
-            "api_id": int(api_id),
-            "api_hash": str(api_hash),
-            "session_string": str(session_string),
-            "twofa_password": twofa_password,
-            "country": country,
-            "country_emoji": country_emoji,
-            "year": int(year) if isinstance(year, int) else (str(year) if year is not None else None),
-            "premium_months": int(premium_months) if premium_months is not None else None,
-            "price": int(price) if price is not None else None,
-            "status": "available",  # available|assigned
-            "assigned_to": None,
-            "assigned_at": None,
-            "created_at": now,
-            "updated_at": now,
-            "added_by": int(added_by),
-        }
-        res = await self.db.accounts.insert_one(doc)
-        return res.inserted_id
-
-    async def list_accounts(self, limit: int = 20) -> list[dict[str, Any]]:
-        cur = self.db.accounts.find({}).sort("created_at", -1).limit(int(limit))
-        return [x async for x in cur]
-
-    async def count_accounts(self, *, status: str | None = None) -> int:
-        q: dict[str, Any] = {}
-        if status is not None:
-            q["status"] = status
-        return await self.db.accounts.count_documents(q)
-
-    async def list_accounts_page(
-        self, *, status: str | None = None, page: int, page_size: int = 5
-    ) -> list[dict[str, Any]]:
-        q: dict[str, Any] = {}
-        if status is not None:
-            q["status"] = status
-        cur = (
-            self.db.accounts.find(q)
-            .sort("created_at", -1)
-            .skip(max(0, int(page)) * int(page_size))
-            .limit(int(page_size))
-        )
-        return [x async for x in cur]
-
-    async def get_account(self, account_id: ObjectId) -> Optional[dict[str, Any]]:
-        return await self.db.accounts.find_one({"_id": account_id})
-
-    async def delete_account(self, account_id: ObjectId) -> bool:
-        res = await self.db.accounts.delete_one({"_id": account_id})
-        return res.deleted_count == 1
-
-    async def update_account_fields(self, account_id: ObjectId, fields: dict[str, Any]) -> bool:
-        if not fields:
-            return False
-        fields = dict(fields)
-        fields["updated_at"] = utcnow()
-        res = await self.db.accounts.update_one({"_id": account_id}, {"$set": fields})
-        return res.modified_count == 1
-
-    async def count_available_accounts(self) -> int:
-        return await self.db.accounts.count_documents({"status": "available"})
-
-    async def list_available_countries(self) -> list[dict[str, Any]]:
-        pipeline = [
-            {"$match": {"status": "available"}},
-            {"$group": {"_id": {"country": "$country", "emoji": "$country_emoji"}, "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}},
-        ]
-        out: list[dict[str, Any]] = []
-        async for row in self.db.accounts.aggregate(pipeline):
-            out.append(
-                {
-                    "country": (row.get("_id") or {}).get("country"),
-                    "country_emoji": (row.get("_id") or {}).get("emoji"),
-                    "count": row.get("count", 0),
-                }
-            )
-        return out
-
-    async def list_available_years_for_country(self, country: str) -> list[dict[str, Any]]:
-        pipeline = [
-            {"$match": {"status": "available", "country": country}},
-            {"$group": {"_id": "$year", "count": {"$sum": 1}}},
-            {"$sort": {"_id": -1}},
-        ]
-        out: list[dict[str, Any]] = []
-        async for row in self.db.accounts.aggregate(pipeline):
-            out.append({"year": row.get("_id"), "count": row.get("count", 0)})
-        return out
-
-    async def available_price_range(self, *, country: str, year: Any) -> dict[str, Any]:
-        """Return {min_price, max_price, count} for available accounts in selection."""
-        match: dict[str, Any] = {"status": "available", "country": country, "price": {"$ne": None}}
-        if year is not None:
-            match["year"] = year
-
-        pipeline = [
-            {"$match": match},
-            {
-                "$group": {
-                    "_id": None,
-                    "min_price": {"$min": "$price"},
-                    "max_price": {"$max": "$price"},
-                    "count": {"$sum": 1},
-                }
-            },
-        ]
-
-        row = None
-        async for r in self.db.accounts.aggregate(pipeline):
-            row = r
-            break
-
-        if not row:
-            return {"min_price": None, "max_price": None, "count": 0}
-
-        return {
-            "min_price": row.get("min_price"),
-            "max_price": row.get("max_price"),
-            "count": row.get("count", 0),
-        }
-
-    async def list_purchases_page(self, *, user_id: int, page: int, page_size: int = 6) -> list[dict[str, Any]]:
-        cur = (
-            self.db.purchases.find({"user_id": int(user_id)})
-            .sort("created_at", -1)
-            .skip(max(0, int(page)) * int(page_size))
-            .limit(int(page_size))
-        )
-        return [x async for x in cur]
-
-    async def count_purchases(self, *, user_id: int) -> int:
-        return await self.db.purchases.count_documents({"user_id": int(user_id)})
-
-    async def buy_account_filtered(
-        self, *, user_id: int, username: str | None, country: str, year: Any
-    ) -> tuple[Optional[dict[str, Any]], str]:
-        """Buy one account for (country, year) that the user can afford.
-
-        This intentionally picks the cheapest available account within the user's budget.
-        If the user has discount tokens, it will first try using a token (allows buying
-        up to credits+5 because charge = price-5).
-        """
-        now = utcnow()
-        user = await self.ensure_user(user_id)
-        credits = int((user or {}).get("credits", 0) or 0)
-
-        base_q: dict[str, Any] = {"status": "available", "country": country, "price": {"$ne": None}}
-        if year is not None:
-            base_q["year"] = year
-
-        # Try with token first (if available), then without token.
-        for want_token in (True, False):
-            token_used = False
-            max_price = credits
-
-            if want_token:
-                token_used = await self._reserve_token(user_id)
-                if not token_used:
-                    continue
-                max_price = credits + 5
-
-            q = dict(base_q)
-            q["price"] = {"$ne": None, "$lte": int(max_price)}
-
-            account = await self.db.accounts.find_one_and_update(
-                q,
-                {
-                    "$set": {
-                        "status": "assigned",
-                        "assigned_to": int(user_id),
-                        "sold_to_user_id": int(user_id),
-                        "sold_to_username": (username or ""),
-                        "assigned_at": now,
-                        "updated_at": now,
-                    }
-                },
-                # cheapest first
-                sort=[("price", 1), ("created_at", 1)],
-                return_document=ReturnDocument.AFTER,
-            )
-
-            if not account:
-                if token_used:
-                    await self._release_token(user_id)
-                continue
-
-            original_price = int(account.get("price") or 0)
-            charge = max(0, original_price - 5) if token_used else original_price
-
-            dec = await self.db.users.update_one(
-                {"user_id": int(user_id), "credits": {"$gte": int(charge)}},
-                {"$inc": {"credits": -int(charge)}, "$set": {"updated_at": now}},
-            )
-            if dec.modified_count != 1:
-                if token_used:
-                    await self._release_token(user_id)
-                await self.db.accounts.update_one(
-                    {"_id": account["_id"]},
-                    {"$set": {"status": "available", "assigned_to": None, "assigned_at": None, "updated_at": now}},
-                )
-                return None, "insufficient_credits"
-
-            account["_original_price"] = original_price
-            account["_final_price"] = charge
-            account["_discount_used"] = token_used
-
-            await self.db.purchases.insert_one(
-                {
-                    "user_id": int(user_id),
-                    "account_id": account["_id"],
-                    "price": int(charge),
-                    "original_price": int(original_price),
-                    "discount_used": bool(token_used),
-                    "phone": account.get("phone"),
-                    "country": account.get("country"),
-                    "year": account.get("year"),
-                    "created_at": now,
-                }
-            )
-            return account, "ok"
-
-        return None, "no_affordable"
-
-    async def count_available_under_price(self, *, max_price: int) -> int:
-        return await self.db.accounts.count_documents(
-            {"status": "available", "price": {"$ne": None, "$lte": int(max_price)}}
-        )
-
-    async def count_groups_under_price(self, *, max_price: int) -> int:
-        pipeline = [
-            {"$match": {"status": "available", "price": {"$ne": None, "$lte": int(max_price)}}},
-            {
-                "$group": {
-                    "_id": {
-                        "country": "$country",
-                        "country_emoji": "$country_emoji",
-                        "year": "$year",
-                        "price": "$price",
-                    },
-                    "count": {"$sum": 1},
-                }
-            },
-            {"$count": "n"},
-        ]
-        row = None
-        async for r in self.db.accounts.aggregate(pipeline):
-            row = r
-            break
-        return int((row or {}).get("n", 0))
-
-    async def list_groups_under_price_page(
-        self, *, max_price: int, page: int, page_size: int = 10
-    ) -> list[dict[str, Any]]:
-        pipeline = [
-            {"$match": {"status": "available", "price": {"$ne": None, "$lte": int(max_price)}}},
-            {
-                "$group": {
-                    "_id": {
-                        "country": "$country",
-                        "country_emoji": "$country_emoji",
-                        "year": "$year",
-                        "price": "$price",
-                    },
-                    "count": {"$sum": 1},
-                }
-            },
-            {"$sort": {"_id.price": 1, "_id.country": 1, "_id.year": -1}},
-            {"$skip": max(0, int(page)) * int(page_size)},
-            {"$limit": int(page_size)},
-        ]
-        out: list[dict[str, Any]] = []
-        async for row in self.db.accounts.aggregate(pipeline):
-            _id = row.get("_id") or {}
-            out.append(
-                {
-                    "country": _id.get("country"),
-                    "country_emoji": _id.get("country_emoji"),
-                    "year": _id.get("year"),
-                    "premium_months": _id.get("premium_months"),
-                    "price": _id.get("price"),
-                    "count": row.get("count", 0),
-                }
-            )
-        return out
-
-    async def buy_account_by_group(
-        self,
-        *,
-        user_id: int,
-        username: str | None,
-        country: str,
-        year: Any,
-        price: int,
-    ) -> tuple[Optional[dict[str, Any]], str]:
-        """Buy one available account from a (country, year, price) group."""
-        now = utcnow()
-        await self.ensure_user(user_id)
-
-        q: dict[str, Any] = {
-            "status": "available",
-            "country": country,
-            "price": int(price),
-        }
-        if year is None:
-            q["year"] = None
-        else:
-            q["year"] = year
-
-        account = await self.db.accounts.find_one_and_update(
-            q,
-            {
-                "$set": {
-                    "status": "assigned",
-                    "assigned_to": int(user_id),
-                    "sold_to_user_id": int(user_id),
-                    "sold_to_username": (username or ""),
-                    "assigned_at": now,
-                    "updated_at": now,
-                }
-            },
-            sort=[("created_at", 1)],
-            return_document=ReturnDocument.AFTER,
-        )
-        if not account:
-            return None, "not_available"
-
-        original_price = int(account.get("price") or 0)
-
-        token_used = await self._reserve_token(user_id)
-        charge = max(0, original_price - 5) if token_used else original_price
-
-        dec = await self.db.users.update_one(
-            {"user_id": int(user_id), "credits": {"$gte": int(charge)}},
-            {"$inc": {"credits": -int(charge)}, "$set": {"updated_at": now}},
-        )
-        if dec.modified_count != 1:
-            if token_used:
-                await self._release_token(user_id)
-            await self.db.accounts.update_one(
-                {"_id": account["_id"]},
-                {"$set": {"status": "available", "assigned_to": None, "assigned_at": None, "updated_at": now}},
-            )
-            return None, "insufficient_credits"
-
-        account["_original_price"] = original_price
-        account["_final_price"] = charge
-        account["_discount_used"] = token_used
-
-        await self.db.purchases.insert_one(
-            {
-                "user_id": int(user_id),
-                "account_id": account["_id"],
-                "price": int(charge),
-                "original_price": int(original_price),
-                "discount_used": bool(token_used),
-                "phone": account.get("phone"),
-                "country": account.get("country"),
-                "year": account.get("year"),
-                "created_at": now,
-            }
-        )
-        return account, "ok"
-
-    async def buy_account_by_id(
-        self, *, user_id: int, username: str | None, account_id: str
-    ) -> tuple[Optional[dict[str, Any]], str]:
-        """Atomically assign a specific account id to user, then decrement credits."""
-        now = utcnow()
-        await self.ensure_user(user_id)
-        try:
-            oid = ObjectId(account_id)
-        except Exception:
-            return None, "invalid_id"
-
-        account = await self.db.accounts.find_one_and_update(
-            {"_id": oid, "status": "available"},
-            {
-                "$set": {
-                    "status": "assigned",
-                    "assigned_to": int(user_id),
-                    "sold_to_user_id": int(user_id),
-                    "sold_to_username": (username or ""),
-                    "assigned_at": now,
-                    "updated_at": now,
-                }
-            },
-            return_document=ReturnDocument.AFTER,
-        )
-        if not account:
-            return None, "not_available"
-
-        if account.get("price") is None:
-            await self.db.accounts.update_one(
-                {"_id": oid},
-                {"$set": {"status": "available", "assigned_to": None, "assigned_at": None, "updated_at": now}},
-            )
-            return None, "no_price"
-
-        original_price = int(account["price"])
-        token_used = await self._reserve_token(user_id)
-        charge = max(0, original_price - 5) if token_used else original_price
-
-        dec = await self.db.users.update_one(
-            {"user_id": int(user_id), "credits": {"$gte": int(charge)}},
-            {"$inc": {"credits": -int(charge)}, "$set": {"updated_at": now}},
-        )
-        if dec.modified_count != 1:
-            if token_used:
-                await self._release_token(user_id)
-
-            await self.db.accounts.update_one(
-                {"_id": oid},
-                {"$set": {"status": "available", "assigned_to": None, "assigned_at": None, "updated_at": now}},
-            )
-            return None, "insufficient_credits"
-
-        # annotate returned account with discount info for UI
-        account["_original_price"] = original_price
-        account["_final_price"] = charge
-        account["_discount_used"] = token_used
-
-        await self.db.purchases.insert_one(
-            {
-                "user_id": int(user_id),
-                "account_id": oid,
-                "price": int(charge),
-                "original_price": int(original_price),
-                "discount_used": bool(token_used),
-                "phone": account.get("phone"),
-                "country": account.get("country"),
-                "year": account.get("year"),
-                "created_at": now,
-            }
-        )
-        return account, "ok"
+from __future__ import annotations
+
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+
+# Use certifi CA bundle for TLS connections to MongoDB Atlas (helps on Windows/Python)
+try:
+    import certifi  # type: ignore
+except Exception:  # pragma: no cover
+    certifi = None  # type: ignore
+from pymongo import ReturnDocument, UpdateOne
+
+from config import DB_NAME, MONGO_URI
+
+_client: Optional[AsyncIOMotorClient] = None
+_db: Optional[AsyncIOMotorDatabase] = None
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def get_client() -> AsyncIOMotorClient:
+    global _client
+    if _client is None:
+        kwargs: dict[str, Any] = {}
+        if certifi is not None:
+            kwargs["tlsCAFile"] = certifi.where()
+        # Explicit pool sizing: keep a few warm sockets so bursts of admin
+        # callbacks don't pay TCP+TLS+auth handshakes, and bound the pool so a
+        # burst can't starve the event loop waiting on connections.
+        _client = AsyncIOMotorClient(
+            MONGO_URI,
+            maxPoolSize=50,
+            minPoolSize=5,
+            maxIdleTimeMS=300_000,
+            waitQueueTimeoutMS=5000,
+            **kwargs,
+        )
+    return _client
+
+
+def get_db() -> AsyncIOMotorDatabase:
+    global _db
+    if _db is None:
+        _db = get_client()[DB_NAME]
+    return _db
+
+
+async def init_indexes() -> None:
+    db = get_db()
+
+    await db.users.create_index("user_id", unique=True)
+    # Active-credits admin list: keyset pagination over users with credits > 0,
+    # sorted (credits desc, _id asc). The _id tie-break keeps page boundaries
+    # stable between equal balances; the partial filter keeps the index small
+    # (most users sit at 0 credits).
+    await db.users.create_index(
+        [("credits", -1), ("_id", 1)],
+        partialFilterExpression={"credits": {"$gt": 0}},
+    )
+    await db.credit_logs.create_index([("user_id", 1), ("created_at", -1)])
+
+    await db.accounts.create_index("phone", unique=True)
+    await db.accounts.create_index("status")
+    await db.accounts.create_index("country")
+    await db.accounts.create_index("year")
+    await db.accounts.create_index([("country", 1), ("year", 1), ("status", 1)])
+    await db.accounts.create_index([("assigned_to", 1), ("status", 1)])
+
+    await db.purchases.create_index([("user_id", 1), ("created_at", -1)])
+    await db.purchases.create_index([("account_id", 1), ("created_at", -1)])
+
+    await db.deposits.create_index([("user_id", 1), ("created_at", -1)])
+    await db.deposits.create_index([("status", 1), ("created_at", -1)])
+
+    # referrals
+    await db.referrals.create_index([("referred_user_id", 1)], unique=True)
+    await db.referrals.create_index([("referrer_user_id", 1), ("created_at", -1)])
+
+    # referral earnings log (optional, for audit)
+    await db.ref_earn_logs.create_index([("referrer_user_id", 1), ("created_at", -1)])
+    await db.ref_earn_logs.create_index([("referred_user_id", 1), ("created_at", -1)])
+    await db.ref_earn_logs.create_index([("deposit_id", 1)], unique=True, sparse=True)
+
+    # legacy tokens (kept for compatibility; no longer used in UI)
+    await db.ref_tokens.create_index([("user_id", 1)], unique=True)
+
+    # bans
+    await db.banned_users.create_index([("user_id", 1)], unique=True)
+    await db.banned_users.create_index([("created_at", -1)])
+
+    # qr settings
+    await db.qr_settings.create_index([("key", 1)], unique=True)
+
+    # admin settings (bulk discount etc.)
+    await db.admin_settings.create_index([("key", 1)], unique=True)
+
+
+# Fields actually rendered by the admin accounts list; projecting keeps the
+# session_string and other bulky fields off the wire for list pages.
+_ACCOUNT_LIST_PROJECTION = {
+    "phone": 1,
+    "country": 1,
+    "country_emoji": 1,
+    "year": 1,
+    "status": 1,
+    "sold_to_username": 1,
+    "sold_to_user_id": 1,
+    "assigned_to": 1,
+    "price": 1,
+}
+
+
+# Burst re-reads (view/back/Retry-OTP clicks) fetch the same account/deposit
+# document within seconds. A short in-process TTL bounds staleness while the
+# mutating paths stay safe: they all go through filtered updates server-side.
+_DOC_CACHE_TTL = 5.0
+_DOC_CACHE_MAX = 1024
+
+
+class Repo:
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+        # (kind, id, projection shape) -> (doc, expires_at)
+        self._doc_cache: dict[tuple[Any, ...], tuple[dict[str, Any], float]] = {}
+
+    def _doc_cache_get(self, key: tuple[Any, ...]) -> Optional[dict[str, Any]]:
+        hit = self._doc_cache.get(key)
+        if hit is not None and hit[1] > time.monotonic():
+            return hit[0]
+        return None
+
+    def _doc_cache_put(self, key: tuple[Any, ...], doc: dict[str, Any]) -> None:
+        if len(self._doc_cache) >= _DOC_CACHE_MAX:
+            self._doc_cache.clear()
+        self._doc_cache[key] = (doc, time.monotonic() + _DOC_CACHE_TTL)
+
+    def _doc_cache_invalidate(self, kind: str, doc_id: Any) -> None:
+        for key in [k for k in self._doc_cache if k[0] == kind and k[1] == doc_id]:
+            self._doc_cache.pop(key, None)
+
+    # -------- Admin Settings (Bulk Discount) --------
+    async def get_bulk_discount(self) -> dict[str, Any]:
+        """Return {'enabled': bool, 'percent': int}."""
+        doc = await self.db.admin_settings.find_one({"key": "bulk_discount"})
+        if not doc:
+            return {"enabled": False, "percent": 0}
+        return {"enabled": bool(doc.get("enabled", False)), "percent": int(doc.get("percent", 0) or 0)}
+
+    async def set_bulk_discount(self, *, enabled: bool, percent: int) -> dict[str, Any]:
+        percent_i = int(percent)
+        await self.db.admin_settings.update_one(
+            {"key": "bulk_discount"},
+            {"$set": {"key": "bulk_discount", "enabled": bool(enabled), "percent": percent_i, "updated_at": utcnow()}},
+            upsert=True,
+        )
+        return await self.get_bulk_discount()
+
+    async def apply_bulk_discount(self, *, percent: int) -> dict[str, Any]:
+        """Apply discount percent to ALL AVAILABLE accounts.
+
+        Stores original base price in 'base_price' (only once) so it can be reset.
+        """
+        p = max(0, min(95, int(percent)))
+
+        # Ensure base_price is saved (only if missing)
+        await self.db.accounts.update_many(
+            {"status": "available", "price": {"$ne": None}, "base_price": {"$exists": False}},
+            [{"$set": {"base_price": "$price"}}],
+        )
+
+        # Apply discount based on base_price
+        await self.db.accounts.update_many(
+            {"status": "available", "base_price": {"$ne": None}},
+            [
+                {
+                    "$set": {
+                        "price": {
+                            "$toInt": {
+                                "$round": [
+                                    {
+                                        "$multiply": [
+                                            "$base_price",
+                                            {"$divide": [{"$subtract": [100, p]}, 100]},
+                                        ]
+                                    },
+                                    0,
+                                ]
+                            }
+                        },
+                        "updated_at": "$$NOW",
+                    }
+                }
+            ],
+        )
+
+        return await self.set_bulk_discount(enabled=True, percent=p)
+
+    async def disable_bulk_discount(self) -> dict[str, Any]:
+        """Disable discount and restore price from base_price (keeps base_price)."""
+        await self.db.accounts.update_many(
+            {"status": "available", "base_price": {"$ne": None}},
+            [{"$set": {"price": "$base_price", "updated_at": "$$NOW"}}],
+        )
+        st = await self.get_bulk_discount()
+        return await self.set_bulk_discount(enabled=False, percent=int(st.get("percent", 0) or 0))
+
+    async def reset_bulk_discount(self) -> dict[str, Any]:
+        """Reset to normal (restore price and remove base_price field)."""
+        await self.db.accounts.update_many(
+            {"status": "available", "base_price": {"$exists": True}},
+            [{"$set": {"price": "$base_price", "updated_at": "$$NOW"}}],
+        )
+        await self.db.accounts.update_many(
+            {"status": "available", "base_price": {"$exists": True}},
+            {"$unset": {"base_price": ""}},
+        )
+        return await self.set_bulk_discount(enabled=False, percent=0)
+
+    # -------- Payment toggles --------
+    async def get_crypto_enabled(self) -> bool:
+        doc = await self.db.admin_settings.find_one({"key": "crypto_enabled"})
+        if not doc:
+            return True
+        return bool(doc.get("enabled", True))
+
+    async def set_crypto_enabled(self, *, enabled: bool) -> bool:
+        await self.db.admin_settings.update_one(
+            {"key": "crypto_enabled"},
+            {"$set": {"key": "crypto_enabled", "enabled": bool(enabled), "updated_at": utcnow()}},
+            upsert=True,
+        )
+        return await self.get_crypto_enabled()
+
+    # ----------------------------
+    # Referral / earnings
+    # ----------------------------
+    async def is_new_user(self, user_id: int) -> bool:
+        doc = await self.db.users.find_one({"user_id": int(user_id)})
+        return doc is None
+
+    async def save_referral_if_new(
+        self,
+        *,
+        referred_user_id: int,
+        referred_username: str | None,
+        referrer_user_id: int,
+        referrer_username: str | None,
+    ) -> bool:
+        """Save referral for a NEW user. Returns True if saved."""
+        if referred_user_id == referrer_user_id:
+            return False
+
+        # only for new users
+        if not await self.is_new_user(referred_user_id):
+            return False
+
+        now = utcnow()
+        try:
+            await self.db.referrals.insert_one(
+                {
+                    "referrer_user_id": int(referrer_user_id),
+                    "referrer_username": (referrer_username or ""),
+                    "referred_user_id": int(referred_user_id),
+                    "referred_username": (referred_username or ""),
+                    "created_at": now,
+                    "credited": False,
+                }
+            )
+        except Exception:
+            return False
+
+        # store on user document too
+        await self.db.users.update_one(
+            {"user_id": int(referred_user_id)},
+            {
+                "$setOnInsert": {"user_id": int(referred_user_id), "credits": 0, "created_at": now},
+                "$set": {
+                    "referrer_user_id": int(referrer_user_id),
+                    "referrer_username": (referrer_username or ""),
+                    "referrer_set_at": now,
+                    "updated_at": now,
+                },
+            },
+            upsert=True,
+        )
+        return True
+
+    async def get_tokens(self, user_id: int) -> int:
+        # legacy (discount tokens) - no longer used by referral UI
+        doc = await self.db.ref_tokens.find_one({"user_id": int(user_id)})
+        return int((doc or {}).get("tokens", 0))
+
+    async def get_referral_stats(self, user_id: int) -> dict[str, Any]:
+        """Return {'referrals': int, 'total_earned': float} for a referrer."""
+        referrals = await self.db.referrals.count_documents({"referrer_user_id": int(user_id)})
+        u = await self.db.users.find_one({"user_id": int(user_id)})
+        total_earned = float((u or {}).get("ref_earned_total", 0.0) or 0.0)
+        return {"referrals": int(referrals), "total_earned": float(total_earned)}
+
+    async def add_referral_earning(
+        self,
+        *,
+        referrer_user_id: int,
+        referred_user_id: int,
+        amount: float,
+        by_admin: int,
+        deposit_id: str | None = None,
+        deposit_amount: int | None = None,
+    ) -> dict[str, Any]:
+        """Credit referral earning to referrer (adds to credits + tracks total earned).
+
+        Returns updated user doc for referrer.
+        """
+        now = utcnow()
+        amt_i = int(amount)
+        # add to credits as integer credits, and track total earned as float
+        user = await self.db.users.find_one_and_update(
+            {"user_id": int(referrer_user_id)},
+            {
+                "$inc": {"credits": amt_i, "ref_earned_total": float(amount)},
+                "$setOnInsert": {"user_id": int(referrer_user_id), "created_at": now},
+                "$set": {"updated_at": now},
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+
+        # best-effort audit log
+        try:
+            await self.db.ref_earn_logs.insert_one(
+                {
+                    "referrer_user_id": int(referrer_user_id),
+                    "referred_user_id": int(referred_user_id),
+                    "amount": float(amount),
+                    "amount_int": amt_i,
+                    "deposit_id": deposit_id,
+                    "deposit_amount": int(deposit_amount) if deposit_amount is not None else None,
+                    "by_admin": int(by_admin),
+                    "created_at": now,
+                }
+            )
+        except Exception:
+            pass
+
+        return user or {}
+
+    async def _reserve_token(self, user_id: int) -> bool:
+        """Reserve one token for a purchase (decrement immediately)."""
+        doc = await self.db.ref_tokens.find_one_and_update(
+            {"user_id": int(user_id), "tokens": {"$gte": 1}},
+            {"$inc": {"tokens": -1}, "$set": {"updated_at": utcnow()}},
+            return_document=ReturnDocument.AFTER,
+        )
+        return doc is not None
+
+    async def _release_token(self, user_id: int) -> None:
+        """Rollback a reserved token."""
+        await self.db.ref_tokens.update_one(
+            {"user_id": int(user_id)},
+            {"$inc": {"tokens": 1}, "$set": {"updated_at": utcnow()}},
+            upsert=True,
+        )
+
+    async def add_tokens(self, user_id: int, delta: int) -> int:
+        now = utcnow()
+        doc = await self.db.ref_tokens.find_one_and_update(
+            {"user_id": int(user_id)},
+            {"$inc": {"tokens": int(delta)}, "$set": {"updated_at": now}, "$setOnInsert": {"user_id": int(user_id)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return int((doc or {}).get("tokens", 0))
+
+    async def set_tokens(self, user_id: int, tokens: int) -> int:
+        now = utcnow()
+        doc = await self.db.ref_tokens.find_one_and_update(
+            {"user_id": int(user_id)},
+            {"$set": {"tokens": int(tokens), "updated_at": now, "user_id": int(user_id)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return int((doc or {}).get("tokens", 0))
+
+    # ----------------------------
+    # Bans
+    # ----------------------------
+    async def is_banned(self, user_id: int) -> bool:
+        doc = await self.db.banned_users.find_one({"user_id": int(user_id)})
+        return doc is not None
+
+    async def ban_user(self, *, user_id: int, by_admin: int, username: str | None = None) -> None:
+        await self.db.banned_users.update_one(
+            {"user_id": int(user_id)},
+            {
+                "$set": {
+                    "user_id": int(user_id),
+                    "username": (username or ""),
+                    "by_admin": int(by_admin),
+                    "created_at": utcnow(),
+                }
+            },
+            upsert=True,
+        )
+
+    async def unban_user(self, *, user_id: int) -> bool:
+        res = await self.db.banned_users.delete_one({"user_id": int(user_id)})
+        return res.deleted_count == 1
+
+    # ----------------------------
+    # QR settings
+    # ----------------------------
+    async def get_inr_qr_flags(self) -> dict[str, bool]:
+        """Return {'qr1': bool, 'qr2': bool}. Defaults to both True."""
+        doc = await self.db.qr_settings.find_one({"key": "inr"})
+        if not doc:
+            return {"qr1": True, "qr2": True}
+        return {
+            "qr1": bool(doc.get("qr1", True)),
+            "qr2": bool(doc.get("qr2", True)),
+        }
+
+    async def set_inr_qr_flag(self, *, qr_key: str, enabled: bool) -> dict[str, bool]:
+        if qr_key not in {"qr1", "qr2"}:
+            return await self.get_inr_qr_flags()
+        await self.db.qr_settings.update_one(
+            {"key": "inr"},
+            {"$set": {"key": "inr", qr_key: bool(enabled), "updated_at": utcnow()}},
+            upsert=True,
+        )
+        return await self.get_inr_qr_flags()
+
+    async def toggle_inr_qr_flag(self, *, qr_key: str) -> dict[str, bool]:
+        """Atomically invert one INR QR flag and return the new flags.
+
+        Single round-trip replacement for the read-invert-write-reread cycle:
+        the pipeline update flips the stored value (missing counts as the
+        True default) and returns the post-update document.
+        """
+        if qr_key not in {"qr1", "qr2"}:
+            return await self.get_inr_qr_flags()
+        doc = await self.db.qr_settings.find_one_and_update(
+            {"key": "inr"},
+            [
+                {
+                    "$set": {
+                        qr_key: {"$not": [{"$ifNull": [f"${qr_key}", True]}]},
+                        "updated_at": utcnow(),
+                    }
+                }
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        doc = doc or {}
+        return {
+            "qr1": bool(doc.get("qr1", True)),
+            "qr2": bool(doc.get("qr2", True)),
+        }
+
+    async def try_credit_referral_on_first_approved_deposit(self, *, referred_user_id: int) -> dict[str, Any] | None:
+        """If referred_user has a referral and this is their first approved deposit, grant +1 token.
+
+        Returns info dict if credited, else None.
+        """
+        ref = await self.db.referrals.find_one({"referred_user_id": int(referred_user_id)})
+        if not ref or ref.get("credited") is True:
+            return None
+
+        approved_count = await self.db.deposits.count_documents({"user_id": int(referred_user_id), "status": "approved"})
+        if approved_count != 1:
+            return None
+
+        # mark credited atomically
+        res = await self.db.referrals.update_one(
+            {"_id": ref.get("_id"), "credited": False},
+            {"$set": {"credited": True, "credited_at": utcnow()}},
+        )
+        if res.modified_count != 1:
+            return None
+
+        referrer_id = int(ref.get("referrer_user_id"))
+        new_tokens = await self.add_tokens(referrer_id, 1)
+        return {
+            "referrer_user_id": referrer_id,
+            "referrer_username": (ref.get("referrer_username") or ""),
+            "referred_user_id": int(ref.get("referred_user_id")),
+            "referred_username": (ref.get("referred_username") or ""),
+            "tokens_now": new_tokens,
+        }
+
+    # -------- Deposits --------
+    async def create_deposit_request(
+        self,
+        *,
+        user_id: int,
+        username: str,
+        amount: int,
+        method: str,
+        network: str | None = None,
+        amount_text: str | None = None,
+    ) -> str:
+        now = utcnow()
+        res = await self.db.deposits.insert_one(
+            {
+                "user_id": int(user_id),
+                "username": username,
+                "amount": int(amount),
+                "amount_text": amount_text,
+                "method": method,  # inr|crypto
+                "network": network,  # trc20|bep20|sol|ton|binance
+                "credits_added": None,
+                "status": "pending",  # pending|approved|rejected
+                # Screenshot info (Telegram file_id). Stored so admin can fetch/resend later.
+                "screenshot": None,  # {kind: photo|document, file_id: str}
+                # Delivery attempts to admins (best-effort). Stored for diagnostics.
+                "admin_notify": [],  # list[{admin_id:int, ok:bool, error:str|None, at:datetime}]
+                "created_at": now,
+                "updated_at": now,
+            }
+        )
+        return str(res.inserted_id)
+
+    async def get_deposit(
+        self, deposit_id: str, *, fields: dict[str, int] | None = None
+    ) -> Optional[dict[str, Any]]:
+        try:
+            oid = ObjectId(deposit_id)
+        except Exception:
+            return None
+        # fields: optional projection so callers that read a handful of keys
+        # don't pay for decoding the full document (e.g. admin_notify history).
+        key = ("dep", oid, None if fields is None else tuple(sorted(fields)))
+        doc = self._doc_cache_get(key)
+        if doc is not None:
+            return doc
+        doc = await self.db.deposits.find_one({"_id": oid}, fields)
+        if doc is not None:
+            self._doc_cache_put(key, doc)
+        return doc
+
+    async def mark_deposit(
+        self, deposit_id: str, status: str, *, admin_id: int, credits_added: int | None = None
+    ) -> Optional[dict[str, Any]]:
+        try:
+            oid = ObjectId(deposit_id)
+        except Exception:
+            return None
+        now = utcnow()
+        set_doc: dict[str, Any] = {"status": status, "admin_id": int(admin_id), "updated_at": now}
+        if credits_added is not None:
+            set_doc["credits_added"] = int(credits_added)
+        doc = await self.db.deposits.find_one_and_update(
+            {"_id": oid, "status": "pending"},
+            {"$set": set_doc},
+            return_document=ReturnDocument.AFTER,
+        )
+        self._doc_cache_invalidate("dep", oid)
+        return doc
+
+    async def approve_deposit(
+        self,
+        deposit_id: str,
+        *,
+        admin_id: int,
+        credits: int | None = None,
+        credits_fn: Callable[[dict[str, Any]], int] | None = None,
+    ) -> tuple[Optional[dict[str, Any]], Optional[dict[str, Any]]]:
+        """Approve a pending deposit and credit its user.
+
+        Returns (deposit, user) or (None, None) when the deposit is missing or
+        already processed. The filtered mark on status='pending' keeps
+        double-clicks single-credit: only the click that flips the status
+        reaches the $inc. Compared with mark_deposit + add_credits this folds
+        ensure_user into an upserting $inc and overlaps the credit-log insert
+        with it (4 sequential round-trips down to 2).
+
+        Callers that derive the credit amount from the deposit itself pass
+        credits_fn instead of pre-reading the document: it runs on the marked
+        deposit, so the status check and the amount read are one atomic
+        round-trip. The credits_added backfill then rides along with the
+        gathered writes.
+        """
+        dep = await self.mark_deposit(deposit_id, "approved", admin_id=admin_id, credits_added=credits)
+        if not dep:
+            return None, None
+
+        now = utcnow()
+        uid = int(dep["user_id"])
+        if credits is None:
+            credits = int(credits_fn(dep)) if credits_fn is not None else 0
+
+        ops: list[Any] = [
+            self.db.users.find_one_and_update(
+                {"user_id": uid},
+                {
+                    "$inc": {"credits": int(credits)},
+                    "$set": {"updated_at": now},
+                    "$setOnInsert": {"user_id": uid, "created_at": now},
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            ),
+            self.db.credit_logs.insert_one(
+                {"user_id": uid, "amount": int(credits), "by_admin": int(admin_id), "created_at": now}
+            ),
+        ]
+        if dep.get("credits_added") != int(credits):
+            dep["credits_added"] = int(credits)
+            ops.append(
+                self.db.deposits.update_one(
+                    {"_id": dep["_id"]}, {"$set": {"credits_added": int(credits)}}
+                )
+            )
+        user, *_ = await asyncio.gather(*ops)
+        return dep, user
+
+    async def attach_deposit_screenshot(self, deposit_id: str, *, kind: str, file_id: str) -> bool:
+        """Persist screenshot file reference on a deposit. Returns True if updated."""
+        try:
+            oid = ObjectId(deposit_id)
+        except Exception:
+            return False
+        now = utcnow()
+        res = await self.db.deposits.update_one(
+            {"_id": oid},
+            {"$set": {"screenshot": {"kind": kind, "file_id": str(file_id)}, "updated_at": now}},
+        )
+        self._doc_cache_invalidate("dep", oid)
+        return res.modified_count == 1
+
+    async def add_deposit_admin_notify(
+        self, deposit_id: str, *, admin_id: int, ok: bool, error: str | None
+    ) -> None:
+        """Append an admin notification result for diagnostics."""
+        try:
+            oid = ObjectId(deposit_id)
+        except Exception:
+            return
+        now = utcnow()
+        await self.db.deposits.update_one(
+            {"_id": oid},
+            {
+                "$push": {
+                    "admin_notify": {
+                        "admin_id": int(admin_id),
+                        "ok": bool(ok),
+                        "error": (str(error) if error else None),
+                        "at": now,
+                    }
+                },
+                "$set": {"updated_at": now},
+            },
+        )
+        self._doc_cache_invalidate("dep", oid)
+
+    async def deposit_totals(self) -> dict[str, Any]:
+        """Totals for pending/approved/rejected + overall."""
+        pipeline = [
+            {"$group": {"_id": "$status", "count": {"$sum": 1}, "amount": {"$sum": "$amount"}}}
+        ]
+        out = {
+            "pending_count": 0,
+            "pending_amount": 0,
+            "approved_count": 0,
+            "approved_amount": 0,
+            "rejected_count": 0,
+            "rejected_amount": 0,
+        }
+        async for row in self.db.deposits.aggregate(pipeline):
+            status = row.get("_id")
+            if status not in {"pending", "approved", "rejected"}:
+                continue
+            out[f"{status}_count"] = int(row.get("count", 0))
+            out[f"{status}_amount"] = int(row.get("amount", 0))
+        return out
+
+    async def list_deposits_page(self, *, status: str | None, page: int, page_size: int = 8) -> list[dict[str, Any]]:
+        q: dict[str, Any] = {}
+        if status:
+            q["status"] = status
+        cur = (
+            self.db.deposits.find(q)
+            .sort("created_at", -1)
+            .skip(max(0, int(page)) * int(page_size))
+            .limit(int(page_size))
+        )
+        return [x async for x in cur]
+
+    async def count_deposits(self, *, status: str | None) -> int:
+        q: dict[str, Any] = {}
+        if status:
+            q["status"] = status
+        return await self.db.deposits.count_documents(q)
+
+    async def deposits_overview(
+        self, *, status: str | None, page: int, page_size: int = 8, include_totals: bool = True
+    ) -> tuple[dict[str, Any] | None, int, list[dict[str, Any]]]:
+        """One round-trip for the admin deposits screen.
+
+        Returns (totals, filtered_row_count, page_rows) via a single $facet
+        pipeline instead of separate totals/count/find queries. The page rows
+        are only projected to the fields the list renders. Callers holding
+        recent totals (they change far slower than page flips) can pass
+        include_totals=False to skip that facet's collection scan; totals is
+        then None.
+        """
+        match_q: dict[str, Any] = {"status": status} if status else {}
+        facets: dict[str, Any] = {
+            "count": [{"$match": match_q}, {"$count": "n"}],
+            "page": [
+                {"$match": match_q},
+                {"$sort": {"created_at": -1}},
+                {"$skip": max(0, int(page)) * int(page_size)},
+                {"$limit": int(page_size)},
+                {"$project": {"status": 1, "amount": 1, "user_id": 1, "username": 1}},
+            ],
+        }
+        if include_totals:
+            facets["totals"] = [
+                {"$group": {"_id": "$status", "count": {"$sum": 1}, "amount": {"$sum": "$amount"}}}
+            ]
+        pipeline = [{"$facet": facets}]
+        facet: dict[str, Any] = {}
+        async for row in self.db.deposits.aggregate(pipeline):
+            facet = row
+            break
+
+        totals: dict[str, Any] | None = None
+        if include_totals:
+            totals = {
+                "pending_count": 0,
+                "pending_amount": 0,
+                "approved_count": 0,
+                "approved_amount": 0,
+                "rejected_count": 0,
+                "rejected_amount": 0,
+            }
+            for row in facet.get("totals") or []:
+                st = row.get("_id")
+                if st not in {"pending", "approved", "rejected"}:
+                    continue
+                totals[f"{st}_count"] = int(row.get("count", 0))
+                totals[f"{st}_amount"] = int(row.get("amount", 0))
+
+        count_rows = facet.get("count") or []
+        total_rows = int((count_rows[0] or {}).get("n", 0)) if count_rows else 0
+        return totals, total_rows, facet.get("page") or []
+
+    async def list_deposits_for_user(self, user_id: int, *, limit: int = 20) -> list[dict[str, Any]]:
+        cur = self.db.deposits.find({"user_id": int(user_id)}).sort("created_at", -1).limit(int(limit))
+        return [x async for x in cur]
+
+
+    # -------- Users --------
+    async def ensure_user(self, user_id: int, *, username: str | None = None) -> dict[str, Any]:
+        now = utcnow()
+        set_doc: dict[str, Any] = {"updated_at": now}
+        if username is not None:
+            set_doc["username"] = str(username)
+
+        await self.db.users.update_one(
+            {"user_id": int(user_id)},
+            {
+                "$setOnInsert": {"user_id": int(user_id), "credits": 0, "created_at": now},
+                "$set": set_doc,
+            },
+            upsert=True,
+        )
+        return await self.db.users.find_one({"user_id": int(user_id)})
+
+    async def add_credits(self, user_id: int, amount: int, *, by_admin: int) -> dict[str, Any]:
+        now = utcnow()
+        await self.ensure_user(user_id)
+        user = await self.db.users.find_one_and_update(
+            {"user_id": int(user_id)},
+            {"$inc": {"credits": int(amount)}, "$set": {"updated_at": now}},
+            return_document=ReturnDocument.AFTER,
+        )
+        await self.db.credit_logs.insert_one(
+            {"user_id": int(user_id), "amount": int(amount), "by_admin": int(by_admin), "created_at": now}
+        )
+        return user
+
+    async def bulk_add_credits(self, rows: list[tuple[int, int]], *, by_admin: int) -> int:
+        """Apply many (user_id, amount) credit deltas in two round-trips.
+
+        One unordered bulk_write upserts and $incs every user, one
+        insert_many writes the audit rows - instead of three round-trips
+        per user via add_credits. Returns the number of users touched.
+        Credits is left out of $setOnInsert ($inc seeds it on insert and
+        the two operators may not share a field).
+        """
+        if not rows:
+            return 0
+        now = utcnow()
+        ops = [
+            UpdateOne(
+                {"user_id": int(u)},
+                {
+                    "$inc": {"credits": int(a)},
+                    "$set": {"updated_at": now},
+                    "$setOnInsert": {"user_id": int(u), "created_at": now},
+                },
+                upsert=True,
+            )
+            for u, a in rows
+        ]
+        res = await self.db.users.bulk_write(ops, ordered=False)
+        await self.db.credit_logs.insert_many(
+            [
+                {"user_id": int(u), "amount": int(a), "by_admin": int(by_admin), "created_at": now}
+                for u, a in rows
+            ],
+            ordered=False,
+        )
+        return int(res.matched_count) + len(res.upserted_ids or {})
+
+    async def set_credits(self, user_id: int, credits: int, *, by_admin: int) -> dict[str, Any]:
+        now = utcnow()
+        await self.ensure_user(user_id)
+        user = await self.db.users.find_one_and_update(
+            {"user_id": int(user_id)},
+            {"$set": {"credits": int(credits), "updated_at": now}},
+            return_document=ReturnDocument.AFTER,
+        )
+        await self.db.credit_logs.insert_one(
+            {
+                "user_id": int(user_id),
+                "amount": int(credits),
+                "by_admin": int(by_admin),
+                "mode": "set",
+                "created_at": now,
+            }
+        )
+        return user
+
+    # -------- Accounts --------
+    async def create_account(
+        self,
+        *,
+        phone: str,
+        api_id: int,
+        api_hash: str,
+        session_string: str,
+        added_by: int,
+        year: int | str | None = None,
+        premium_months: int | None = None,
+        country: str | None = None,
+        country_emoji: str | None = None,
+        twofa_password: str | None = None,
+        price: int | None = None,
+    ) -> ObjectId:
+        now = utcnow()
+        doc = {
+            "phone": str(phone),
+            "api_id": int(api_id),
+            "api_hash": str(api_hash),
+            "session_string": str(session_string),
+            "twofa_password": twofa_password,
+            "country": country,
+            "country_emoji": country_emoji,
+            "year": int(year) if isinstance(year, int) else (str(year) if year is not None else None),
+            "premium_months": int(premium_months) if premium_months is not None else None,
+            "price": int(price) if price is not None else None,
+            "status": "available",  # available|assigned
+            "assigned_to": None,
+            "assigned_at": None,
+            "created_at": now,
+            "updated_at": now,
+            "added_by": int(added_by),
+        }
+        res = await self.db.accounts.insert_one(doc)
+        return res.inserted_id
+
+    async def list_accounts(self, limit: int = 20) -> list[dict[str, Any]]:
+        cur = self.db.accounts.find({}).sort("created_at", -1).limit(int(limit))
+        return [x async for x in cur]
+
+    async def count_accounts(self, *, status: str | None = None) -> int:
+        q: dict[str, Any] = {}
+        if status is not None:
+            q["status"] = status
+        return await self.db.accounts.count_documents(q)
+
+    async def list_accounts_page(
+        self, *, status: str | None = None, page: int, page_size: int = 5, limit: int | None = None
+    ) -> list[dict[str, Any]]:
+        """List one page of accounts.
+
+        skip is always computed from page_size (the display page length);
+        limit defaults to page_size but may be larger so callers can fetch
+        a probe row for has_next without shifting page boundaries.
+        """
+        q: dict[str, Any] = {}
+        if status is not None:
+            q["status"] = status
+        cur = (
+            self.db.accounts.find(q, _ACCOUNT_LIST_PROJECTION)
+            .sort("created_at", -1)
+            .skip(max(0, int(page)) * int(page_size))
+            .limit(int(limit if limit is not None else page_size))
+        )
+        return [x async for x in cur]
+
+    async def get_account(
+        self, account_id: ObjectId, *, fields: dict[str, int] | None = None
+    ) -> Optional[dict[str, Any]]:
+        key = ("acc", account_id, None if fields is None else tuple(sorted(fields)))
+        doc = self._doc_cache_get(key)
+        if doc is not None:
+            return doc
+        doc = await self.db.accounts.find_one({"_id": account_id}, fields)
+        if doc is not None:
+            self._doc_cache_put(key, doc)
+        return doc
+
+    async def delete_account(self, account_id: ObjectId) -> bool:
+        res = await self.db.accounts.delete_one({"_id": account_id})
+        self._doc_cache_invalidate("acc", account_id)
+        return res.deleted_count == 1
+
+    async def update_account_fields(self, account_id: ObjectId, fields: dict[str, Any]) -> bool:
+        if not fields:
+            return False
+        fields = dict(fields)
+        fields["updated_at"] = utcnow()
+        res = await self.db.accounts.update_one({"_id": account_id}, {"$set": fields})
+        self._doc_cache_invalidate("acc", account_id)
+        return res.modified_count == 1
+
+    async def count_available_accounts(self) -> int:
+        return await self.db.accounts.count_documents({"status": "available"})
+
+    async def list_available_countries(self) -> list[dict[str, Any]]:
+        pipeline = [
+            {"$match": {"status": "available"}},
+            {"$group": {"_id": {"country": "$country", "emoji": "$country_emoji"}, "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+        ]
+        out: list[dict[str, Any]] = []
+        async for row in self.db.accounts.aggregate(pipeline):
+            out.append(
+                {
+                    "country": (row.get("_id") or {}).get("country"),
+                    "country_emoji": (row.get("_id") or {}).get("emoji"),
+                    "count": row.get("count", 0),
+                }
+            )
+        return out
+
+    async def list_available_years_for_country(self, country: str) -> list[dict[str, Any]]:
+        pipeline = [
+            {"$match": {"status": "available", "country": country}},
+            {"$group": {"_id": "$year", "count": {"$sum": 1}}},
+            {"$sort": {"_id": -1}},
+        ]
+        out: list[dict[str, Any]] = []
+        async for row in self.db.accounts.aggregate(pipeline):
+            out.append({"year": row.get("_id"), "count": row.get("count", 0)})
+        return out
+
+    async def available_price_range(self, *, country: str, year: Any) -> dict[str, Any]:
+        """Return {min_price, max_price, count} for available accounts in selection."""
+        match: dict[str, Any] = {"status": "available", "country": country, "price": {"$ne": None}}
+        if year is not None:
+            match["year"] = year
+
+        pipeline = [
+            {"$match": match},
+            {
+                "$group": {
+                    "_id": None,
+                    "min_price": {"$min": "$price"},
+                    "max_price": {"$max": "$price"},
+                    "count": {"$sum": 1},
+                }
+            },
+        ]
+
+        row = None
+        async for r in self.db.accounts.aggregate(pipeline):
+            row = r
+            break
+
+        if not row:
+            return {"min_price": None, "max_price": None, "count": 0}
+
+        return {
+            "min_price": row.get("min_price"),
+            "max_price": row.get("max_price"),
+            "count": row.get("count", 0),
+        }
+
+    async def list_purchases_page(self, *, user_id: int, page: int, page_size: int = 6) -> list[dict[str, Any]]:
+        cur = (
+            self.db.purchases.find({"user_id": int(user_id)})
+            .sort("created_at", -1)
+            .skip(max(0, int(page)) * int(page_size))
+            .limit(int(page_size))
+        )
+        return [x async for x in cur]
+
+    async def count_purchases(self, *, user_id: int) -> int:
+        return await self.db.purchases.count_documents({"user_id": int(user_id)})
+
+    async def buy_account_filtered(
+        self, *, user_id: int, username: str | None, country: str, year: Any
+    ) -> tuple[Optional[dict[str, Any]], str]:
+        """Buy one account for (country, year) that the user can afford.
+
+        This intentionally picks the cheapest available account within the user's budget.
+        If the user has discount tokens, it will first try using a token (allows buying
+        up to credits+5 because charge = price-5).
+        """
+        now = utcnow()
+        user = await self.ensure_user(user_id)
+        credits = int((user or {}).get("credits", 0) or 0)
+
+        base_q: dict[str, Any] = {"status": "available", "country": country, "price": {"$ne": None}}
+        if year is not None:
+            base_q["year"] = year
+
+        # Try with token first (if available), then without token.
+        for want_token in (True, False):
+            token_used = False
+            max_price = credits
+
+            if want_token:
+                token_used = await self._reserve_token(user_id)
+                if not token_used:
+                    continue
+                max_price = credits + 5
+
+            q = dict(base_q)
+            q["price"] = {"$ne": None, "$lte": int(max_price)}
+
+            account = await self.db.accounts.find_one_and_update(
+                q,
+                {
+                    "$set": {
+                        "status": "assigned",
+                        "assigned_to": int(user_id),
+                        "sold_to_user_id": int(user_id),
+                        "sold_to_username": (username or ""),
+                        "assigned_at": now,
+                        "updated_at": now,
+                    }
+                },
+                # cheapest first
+                sort=[("price", 1), ("created_at", 1)],
+                return_document=ReturnDocument.AFTER,
+            )
+
+            if not account:
+                if token_used:
+                    await self._release_token(user_id)
+                continue
+            self._doc_cache_invalidate("acc", account["_id"])
+
+            original_price = int(account.get("price") or 0)
+            charge = max(0, original_price - 5) if token_used else original_price
+
+            dec = await self.db.users.update_one(
+                {"user_id": int(user_id), "credits": {"$gte": int(charge)}},
+                {"$inc": {"credits": -int(charge)}, "$set": {"updated_at": now}},
+            )
+            if dec.modified_count != 1:
+                if token_used:
+                    await self._release_token(user_id)
+                await self.db.accounts.update_one(
+                    {"_id": account["_id"]},
+                    {"$set": {"status": "available", "assigned_to": None, "assigned_at": None, "updated_at": now}},
+                )
+                return None, "insufficient_credits"
+
+            account["_original_price"] = original_price
+            account["_final_price"] = charge
+            account["_discount_used"] = token_used
+
+            await self.db.purchases.insert_one(
+                {
+                    "user_id": int(user_id),
+                    "account_id": account["_id"],
+                    "price": int(charge),
+                    "original_price": int(original_price),
+                    "discount_used": bool(token_used),
+                    "phone": account.get("phone"),
+                    "country": account.get("country"),
+                    "year": account.get("year"),
+                    "created_at": now,
+                }
+            )
+            return account, "ok"
+
+        return None, "no_affordable"
+
+    async def count_available_under_price(self, *, max_price: int) -> int:
+        return await self.db.accounts.count_documents(
+            {"status": "available", "price": {"$ne": None, "$lte": int(max_price)}}
+        )
+
+    async def count_groups_under_price(self, *, max_price: int) -> int:
+        pipeline = [
+            {"$match": {"status": "available", "price": {"$ne": None, "$lte": int(max_price)}}},
+            {
+                "$group": {
+                    "_id": {
+                        "country": "$country",
+                        "country_emoji": "$country_emoji",
+                        "year": "$year",
+                        "price": "$price",
+                    },
+                    "count": {"$sum": 1},
+                }
+            },
+            {"$count": "n"},
+        ]
+        row = None
+        async for r in self.db.accounts.aggregate(pipeline):
+            row = r
+            break
+        return int((row or {}).get("n", 0))
+
+    async def list_groups_under_price_page(
+        self, *, max_price: int, page: int, page_size: int = 10
+    ) -> list[dict[str, Any]]:
+        pipeline = [
+            {"$match": {"status": "available", "price": {"$ne": None, "$lte": int(max_price)}}},
+            {
+                "$group": {
+                    "_id": {
+                        "country": "$country",
+                        "country_emoji": "$country_emoji",
+                        "year": "$year",
+                        "price": "$price",
+                    },
+                    "count": {"$sum": 1},
+                }
+            },
+            {"$sort": {"_id.price": 1, "_id.country": 1, "_id.year": -1}},
+            {"$skip": max(0, int(page)) * int(page_size)},
+            {"$limit": int(page_size)},
+        ]
+        out: list[dict[str, Any]] = []
+        async for row in self.db.accounts.aggregate(pipeline):
+            _id = row.get("_id") or {}
+            out.append(
+                {
+                    "country": _id.get("country"),
+                    "country_emoji": _id.get("country_emoji"),
+                    "year": _id.get("year"),
+                    "premium_months": _id.get("premium_months"),
+                    "price": _id.get("price"),
+                    "count": row.get("count", 0),
+                }
+            )
+        return out
+
+    async def buy_account_by_group(
+        self,
+        *,
+        user_id: int,
+        username: str | None,
+        country: str,
+        year: Any,
+        price: int,
+    ) -> tuple[Optional[dict[str, Any]], str]:
+        """Buy one available account from a (country, year, price) group."""
+        now = utcnow()
+        await self.ensure_user(user_id)
+
+        q: dict[str, Any] = {
+            "status": "available",
+            "country": country,
+            "price": int(price),
+        }
+        if year is None:
+            q["year"] = None
+        else:
+            q["year"] = year
+
+        account = await self.db.accounts.find_one_and_update(
+            q,
+            {
+                "$set": {
+                    "status": "assigned",
+                    "assigned_to": int(user_id),
+                    "sold_to_user_id": int(user_id),
+                    "sold_to_username": (username or ""),
+                    "assigned_at": now,
+                    "updated_at": now,
+                }
+            },
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if not account:
+            return None, "not_available"
+        self._doc_cache_invalidate("acc", account["_id"])
+
+        original_price = int(account.get("price") or 0)
+
+        token_used = await self._reserve_token(user_id)
+        charge = max(0, original_price - 5) if token_used else original_price
+
+        dec = await self.db.users.update_one(
+            {"user_id": int(user_id), "credits": {"$gte": int(charge)}},
+            {"$inc": {"credits": -int(charge)}, "$set": {"updated_at": now}},
+        )
+        if dec.modified_count != 1:
+            if token_used:
+                await self._release_token(user_id)
+            await self.db.accounts.update_one(
+                {"_id": account["_id"]},
+                {"$set": {"status": "available", "assigned_to": None, "assigned_at": None, "updated_at": now}},
+            )
+            return None, "insufficient_credits"
+
+        account["_original_price"] = original_price
+        account["_final_price"] = charge
+        account["_discount_used"] = token_used
+
+        await self.db.purchases.insert_one(
+            {
+                "user_id": int(user_id),
+                "account_id": account["_id"],
+                "price": int(charge),
+                "original_price": int(original_price),
+                "discount_used": bool(token_used),
+                "phone": account.get("phone"),
+                "country": account.get("country"),
+                "year": account.get("year"),
+                "created_at": now,
+            }
+        )
+        return account, "ok"
+
+    async def buy_account_by_id(
+        self, *, user_id: int, username: str | None, account_id: str
+    ) -> tuple[Optional[dict[str, Any]], str]:
+        """Atomically assign a specific account id to user, then decrement credits."""
+        now = utcnow()
+        await self.ensure_user(user_id)
+        try:
+            oid = ObjectId(account_id)
+        except Exception:
+            return None, "invalid_id"
+
+        account = await self.db.accounts.find_one_and_update(
+            {"_id": oid, "status": "available"},
+            {
+                "$set": {
+                    "status": "assigned",
+                    "assigned_to": int(user_id),
+                    "sold_to_user_id": int(user_id),
+                    "sold_to_username": (username or ""),
+                    "assigned_at": now,
+                    "updated_at": now,
+                }
+            },
+            return_document=ReturnDocument.AFTER,
+        )
+        self._doc_cache_invalidate("acc", oid)
+        if not account:
+            return None, "not_available"
+
+        if account.get("price") is None:
+            await self.db.accounts.update_one(
+                {"_id": oid},
+                {"$set": {"status": "available", "assigned_to": None, "assigned_at": None, "updated_at": now}},
+            )
+            return None, "no_price"
+
+        original_price = int(account["price"])
+        token_used = await self._reserve_token(user_id)
+        charge = max(0, original_price - 5) if token_used else original_price
+
+        dec = await self.db.users.update_one(
+            {"user_id": int(user_id), "credits": {"$gte": int(charge)}},
+            {"$inc": {"credits": -int(charge)}, "$set": {"updated_at": now}},
+        )
+        if dec.modified_count != 1:
+            if token_used:
+                await self._release_token(user_id)
+
+            await self.db.accounts.update_one(
+                {"_id": oid},
+                {"$set": {"status": "available", "assigned_to": None, "assigned_at": None, "updated_at": now}},
+            )
+            return None, "insufficient_credits"
+
+        # annotate returned account with discount info for UI
+        account["_original_price"] = original_price
+        account["_final_price"] = charge
+        account["_discount_used"] = token_used
+
+        await self.db.purchases.insert_one(
+            {
+                "user_id": int(user_id),
+                "account_id": oid,
+                "price": int(charge),
+                "original_price": int(original_price),
+                "discount_used": bool(token_used),
+                "phone": account.get("phone"),
+                "country": account.get("country"),
+                "year": account.get("year"),
+                "created_at": now,
+            }
+        )
+        return account, "ok"
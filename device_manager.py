@@ -21,8 +21,12 @@ if TYPE_CHECKING:
 from config import ADMIN_USER_IDS
 
 
+# Frozen at import so the admin check is a hash lookup, matching bot/admin.
+_ADMIN_IDS: frozenset[int] = frozenset(int(x) for x in ADMIN_USER_IDS)
+
+
 def is_admin(user_id: int) -> bool:
-    return int(user_id) in ADMIN_USER_IDS
+    return int(user_id) in _ADMIN_IDS
 
 
 def kb(rows: list[list[InlineKeyboardButton]]) -> InlineKeyboardMarkup: